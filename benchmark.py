@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+#
+# File: benchmark.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+"""
+Benchmarks the database backends on synthetic portage trees.
+
+For each requested size, a portage tree, an installed packages database (vdb) and an eix cache
+are generated into a temporary directory. The portage backend is replaced by L{SyntheticSystem},
+which answers from the generated package list, so neither portage nor eix have to be installed.
+
+The results are written as one JSON object per line::
+
+    {"backend": "sql", "packages": 10000, "operation": "get_cat", "runs": 5, "min": 0.0123, "mean": 0.0131}
+
+Example::
+
+    python benchmark.py --sizes 1000,10000,100000 --backends dict,sql --output results.json
+"""
+
+from __future__ import with_statement
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import tempfile
+from optparse import OptionParser
+
+from portato import _sub_start
+_sub_start()
+
+# do not touch the real session directory: redirect it before the modules using it are imported
+from portato import constants
+TMP = tempfile.mkdtemp(prefix = "portato-benchmark-")
+SESSION_DIR = constants.SESSION_DIR = os.path.join(TMP, ".portato")
+os.mkdir(SESSION_DIR)
+
+from portato.log import start as logstart, set_log_level
+from portato.backend import SystemWrapper
+from portato.backend.synthetic import SyntheticSystem
+from portato.db import types
+
+# the files the backends store in the session directory
+SESSION_FILES = ("package.db", "package.db-wal", "package.db-shm", "categories.db", "portdirs.db", "hash.db", "packages.map")
+
+WORDS = ("gtk", "qt", "lib", "py", "perl", "tools", "utils", "font", "x11", "dev", "net", "kde", "gnome", "ruby", "data", "base")
+DESCRIPTIONS = ("The GIMP toolkit", "Library for widgets", "Python bindings", "Command line tool", "Text editor", "Network daemon")
+
+def generate_system (path, packages, categories = 160, installed = 0.1, seed = 42):
+    """
+    Generates the packages of a L{SyntheticSystem}. Each package has the single version C{1.0}.
+
+    @param path: the directory to generate the trees in
+    @type path: string
+    @param packages: number of packages
+    @type packages: int
+    @param categories: number of categories
+    @type categories: int
+    @param installed: the fraction of installed packages
+    @type installed: float
+    @param seed: the seed of the random generator
+    @type seed: int
+    @rtype: L{SyntheticSystem}
+    """
+
+    r = random.Random(seed)
+
+    cats = sorted(set("%s-%s%d" % (r.choice(WORDS), r.choice(WORDS), i) for i in xrange(categories)))
+    pkgs = []
+    for i in xrange(packages):
+        name = "%s%s-%d" % (r.choice(WORDS), r.choice(("", "-", "_")).join(r.sample(WORDS, 2)), i)
+        if r.random() < 0.2:
+            name = name.capitalize()
+        pkgs.append("%s/%s" % (cats[i % len(cats)], name))
+
+    inst = set(p for p in pkgs if r.random() < installed)
+    descriptions = dict((p, DESCRIPTIONS[i % len(DESCRIPTIONS)]) for i, p in enumerate(pkgs))
+
+    return SyntheticSystem(path, pkgs, inst, cats, descriptions)
+
+#
+# the benchmark itself
+#
+
+def clear_session ():
+    for name in SESSION_FILES:
+        path = os.path.join(SESSION_DIR, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+def measure (f, runs, setup = None):
+    """
+    Runs a function several times.
+
+    @param f: the function to measure
+    @type f: function
+    @param runs: number of runs
+    @type runs: int
+    @param setup: called (without being measured) before each run
+    @type setup: function
+    @returns: the times of all runs in seconds
+    @rtype: float[]
+    """
+    times = []
+    for i in xrange(runs):
+        if setup: setup()
+
+        start = time.time()
+        f()
+        times.append(time.time() - start)
+
+    return times
+
+def bench_backend (name, system, eix_cache, runs):
+    """
+    Benchmarks a single backend.
+
+    @returns: operation -> times
+    @rtype: (string, float[])[]
+    """
+
+    dbtype = types[name]
+    mod = __import__("portato.db."+dbtype.module, globals(), locals(), [dbtype.cls])
+    cls = getattr(mod, dbtype.cls)
+
+    def new_session ():
+        if name == "eixsql":
+            return {"cache" : eix_cache}
+        else:
+            return {}
+
+    results = []
+    state = {}
+
+    def create ():
+        state["db"] = cls(state["session"])
+
+    def cold ():
+        if "db" in state: state["db"].close()
+        clear_session()
+        state["session"] = new_session()
+
+    def warm ():
+        state["db"].close()
+
+    results.append(("populate", measure(create, runs, cold)))
+    results.append(("startup", measure(create, runs, warm)))
+
+    db = state["db"]
+    cats = system.categories
+    some_cats = cats[::max(1, len(cats) // 10)]
+    clear_cache = db.invalidate_cache
+
+    results.append(("get_cat", measure(lambda: list(db.get_cat()), runs, clear_cache)))
+    results.append(("get_cat_by_inst", measure(lambda: list(db.get_cat(byName = False)), runs, clear_cache)))
+    results.append(("get_cat_single", measure(lambda: [list(db.get_cat(c)) for c in some_cats], runs, clear_cache)))
+    results.append(("get_cat_cached", measure(lambda: list(db.get_cat()), runs)))
+    results.append(("get_cat_range", measure(lambda: list(db.get_cat_range(None, len(system.pkgs) // 2, 500)), runs, clear_cache)))
+    results.append(("count_cat", measure(db.count_cat, runs)))
+    results.append(("get_categories", measure(lambda: list(db.get_categories()), runs, clear_cache)))
+    results.append(("get_categories_installed", measure(lambda: list(db.get_categories(installed = True)), runs, clear_cache)))
+    results.append(("get_category_stats", measure(db.get_category_stats, runs)))
+
+    some_cps = system.pkgs[::max(1, len(system.pkgs) // 100)]
+    results.append(("get_versions", measure(lambda: [db.get_versions(cp) for cp in some_cps], runs)))
+
+    for term in ("gtk", "qt-lib", "x", "lib.*5"):
+        def search ():
+            db.restrict = term
+            list(db.get_cat())
+            list(db.get_categories())
+
+        def reset ():
+            db.restrict = None
+            clear_cache()
+
+        results.append(("search:%s" % term, measure(search, runs, reset)))
+
+    db.restrict = None
+
+    results.append(("reload", measure(lambda: db.reload(cats[0]), runs)))
+    results.append(("reload_many", measure(lambda: db.reload_many(some_cats), runs)))
+
+    pkgs = iter(system.pkgs)
+    results.append(("disable", measure(lambda: db.disable(next(pkgs)), runs)))
+
+    db.close()
+    return results
+
+def get_parser ():
+    parser = OptionParser(usage = "%prog [options]", description = "Benchmarks the database backends on synthetic portage trees.")
+    parser.add_option("-s", "--sizes", default = "1000,10000",
+            help = "comma separated list of the numbers of packages to test with [default: %default]")
+    parser.add_option("-b", "--backends", default = ",".join(types.keys()),
+            help = "comma separated list of the backends to test [default: %default]")
+    parser.add_option("-c", "--categories", type = "int", default = 160,
+            help = "number of categories [default: %default]")
+    parser.add_option("-r", "--runs", type = "int", default = 3,
+            help = "number of runs per operation [default: %default]")
+    parser.add_option("-o", "--output", default = None,
+            help = "file to write the results to [default: stdout]")
+    parser.add_option("-v", "--verbose", action = "store_true", default = False,
+            help = "show the debug output of portato")
+
+    return parser
+
+def main ():
+    options, args = get_parser().parse_args()
+
+    logstart(file = False)
+    set_log_level(logging.DEBUG if options.verbose else logging.WARNING)
+
+    out = open(options.output, "w") if options.output else sys.stdout
+    try:
+        for size in (int(s) for s in options.sizes.split(",")):
+            path = os.path.join(TMP, str(size))
+            eix_cache = os.path.join(path, "eix.cache")
+
+            start = time.time()
+            system = generate_system(path, size, options.categories)
+            system.write_tree()
+            system.write_eix_cache(eix_cache)
+            SystemWrapper.set_system(system)
+            print >> sys.stderr, "Generated %d packages in %.2f seconds." % (size, time.time() - start)
+
+            for backend in options.backends.split(","):
+                try:
+                    results = bench_backend(backend, system, eix_cache, options.runs)
+                except ImportError as e:
+                    print >> sys.stderr, "Skipping backend '%s': %s" % (backend, e)
+                    continue
+
+                for op, times in results:
+                    out.write(json.dumps({"backend" : backend, "packages" : size, "operation" : op,
+                        "runs" : len(times), "min" : min(times), "mean" : sum(times) / len(times)}))
+                    out.write("\n")
+                out.flush()
+
+            shutil.rmtree(path)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        shutil.rmtree(TMP)
+
+if __name__ == "__main__":
+    main()
@@ -56,8 +56,53 @@ def get_parser (use_ = False):
     parser.add_option("--plugin-dir", action = "store_true", dest = "pdir", default = False,
             help = _("print the directory the plugins are located in"))
 
+    parser.add_option("--export-db", action = "store", dest = "exportdb", metavar = "FILE", default = None,
+            help = _("export the package database into FILE - to be imported on hosts with the same portage tree"))
+
+    parser.add_option("--import-db", action = "store", dest = "importdb", metavar = "FILE", default = None,
+            help = _("replace the package database by the one exported into FILE on a host with the same portage tree"))
+
     return parser
 
+def db_snapshot (export = None, import_ = None):
+    """Exports the package database into a snapshot or imports it from one - without starting the GUI.
+
+    @param export: the file to export to
+    @type export: string
+    @param import_: the file to import from
+    @type import_: string
+    @returns: whether it succeeded
+    @rtype: boolean"""
+
+    from .config_parser import ConfigParser
+    from .constants import CONFIG_LOCATION
+    from .session import Session
+    from .backend import system
+    from .db import Database
+    from .db.exceptions import SnapshotError
+
+    cfg = ConfigParser(CONFIG_LOCATION)
+    cfg.parse()
+    system.set_system(cfg.get("system"))
+
+    # no need to load the database, if it is replaced anyway
+    db = Database(cfg.get("type", section = "DATABASE"), background = import_ is not None)
+    try:
+        if export is not None:
+            db.export_snapshot(export)
+            info(_("Exported the database into '%s'."), export)
+        else:
+            db.import_snapshot(import_)
+            info(_("Imported the database from '%s'."), import_)
+    except (IOError, OSError, SnapshotError) as e:
+        error(_("Error: %s"), e)
+        return False
+    finally:
+        db.close()
+        Session.close()
+
+    return True
+
 def _sub_start ():
     # set gettext stuff
     locale.setlocale(locale.LC_ALL, '')
@@ -79,6 +124,12 @@ def start():
         print PLUGIN_DIR
         return
 
+    # database snapshots
+    if options.exportdb or options.importdb:
+        if not db_snapshot(options.exportdb, options.importdb):
+            sys.exit(1)
+        return
+
     if options.nofork or os.getuid() == 0: # start GUI
         
         # close listener at exit
@@ -49,11 +49,15 @@ class SystemWrapper (SystemInterface):
     def set_system (cls, system):
         """Sets the current system to a new one.
 
-        @param system: the name of the system to take
-        @type system: string"""
+        @param system: the name of the system to take - or an already created system (e.g. for testing)
+        @type system: string or L{SystemInterface}"""
 
-        cls.__system = system
-        cls.__wrapped_sys = None
+        if isinstance(system, SystemInterface):
+            cls.__system = system.__class__.__name__
+            cls.__wrapped_sys = system
+        else:
+            cls.__system = system
+            cls.__wrapped_sys = None
 
     @classmethod
     def __load (cls):
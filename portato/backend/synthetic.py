@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+#
+# File: portato/backend/synthetic.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+"""
+A system answering from a given list of packages, so that the databases can be run without portage
+(and eix) being installed. Used by the benchmark and the tests - set it with L{SystemWrapper.set_system}.
+"""
+
+from __future__ import with_statement
+
+import os
+import re
+import time
+import shutil
+
+from .system_interface import SystemInterface
+from .package import Package
+
+class SyntheticPackage (Package):
+    """
+    A version of a package of L{SyntheticSystem}.
+    """
+
+    def __init__ (self, system, cpv):
+        Package.__init__(self, cpv)
+        self._system = system
+        self._cp, self._version = cpv.rsplit("-", 1)
+
+    def get_name (self):
+        return self._cp.split("/")[1]
+
+    def get_version (self):
+        return self._version
+
+    def get_category (self):
+        return self._cp.split("/")[0]
+
+    def is_installed (self):
+        return self._system.installed_version(self._cp) == self._version
+
+    def is_in_overlay (self):
+        return False
+
+    def get_overlay_path (self):
+        return self._system.portdir
+
+    def is_masked (self, use_changed = True):
+        return False
+
+    def get_package_settings (self, var, installed = True):
+        return {"SLOT" : "0", "KEYWORDS" : "x86 ~amd64", "IUSE" : "+gtk -qt doc"}.get(var, "")
+
+def version_key (version):
+    """Sorts versions of the form C{1.2.3}."""
+    return [int(p) if p.isdigit() else p for p in version.split(".")]
+
+class SyntheticSystem (SystemInterface):
+    """
+    A system answering the queries of the databases from a list of packages.
+    Each package has the version C{1.0}, unless others are added with L{add_version}.
+    The oldest version of an installed package is the installed one.
+    """
+
+    def __init__ (self, path, packages, installed = (), categories = None, descriptions = None):
+        """
+        @param path: the directory to write the trees in (see L{write_tree})
+        @type path: string
+        @param packages: the packages as cat/pkg
+        @type packages: string[]
+        @param installed: the installed packages
+        @type installed: string<iterable>
+        @param categories: all categories - including empty ones; None for the ones of the packages
+        @type categories: string[]
+        @param descriptions: the descriptions written into the eix and the metadata cache
+        @type descriptions: dict(cp -> string)
+        """
+
+        self.root = os.path.join(path, "root")
+        self.portdir = os.path.join(path, "portage")
+        self.vdb = os.path.join(self.root, "var/db/pkg")
+
+        self.pkgs = list(packages)
+        self.versions = dict((p, ["1.0"]) for p in self.pkgs)
+        self.inst = set(installed)
+        self.descriptions = descriptions or {}
+
+        if categories is None:
+            categories = set(p.split("/")[0] for p in self.pkgs)
+        self.categories = sorted(categories)
+
+    def installed_version (self, cp):
+        if cp in self.inst:
+            return self.versions[cp][0]
+        else:
+            return None
+
+    def write_tree (self):
+        """
+        Writes the portage tree and the vdb: one directory per package holding an ebuild per version,
+        and one directory per installed version.
+        """
+        for d in (self.portdir, self.root):
+            if os.path.exists(d):
+                shutil.rmtree(d)
+
+        os.makedirs(os.path.join(self.portdir, "metadata"))
+        with open(os.path.join(self.portdir, "metadata/timestamp"), "w") as f:
+            f.write(time.ctime())
+
+        for p in self.pkgs:
+            os.makedirs(os.path.join(self.portdir, p))
+            for v in self.versions[p]:
+                self._write_ebuild(p, v)
+
+        os.makedirs(self.vdb)
+        for p in self.inst:
+            os.makedirs(os.path.join(self.vdb, "%s-%s" % (p, self.installed_version(p))))
+
+    def _write_ebuild (self, cp, version):
+        open(os.path.join(self.portdir, cp, "%s-%s.ebuild" % (cp.split("/")[1], version)), "w").close()
+
+    def add_version (self, cp, version):
+        """
+        Adds a version to a package - and its ebuild to the tree, if it has been written.
+
+        @param cp: the package
+        @type cp: string
+        @param version: the new version
+        @type version: string
+        """
+        self.versions[cp].append(version)
+        self.versions[cp].sort(key = version_key)
+
+        if os.path.isdir(os.path.join(self.portdir, cp)):
+            self._write_ebuild(cp, version)
+
+    def write_metadata_cache (self):
+        """
+        Writes the descriptions of the packages into the metadata cache (C{metadata/md5-cache}) of the tree.
+        """
+        cache = os.path.join(self.portdir, "metadata/md5-cache")
+        if os.path.exists(cache):
+            shutil.rmtree(cache)
+
+        for p in self.pkgs:
+            cat, name = p.split("/")
+            if not os.path.isdir(os.path.join(cache, cat)):
+                os.makedirs(os.path.join(cache, cat))
+
+            for v in self.versions[p]:
+                with open(os.path.join(cache, cat, "%s-%s" % (name, v)), "w") as f:
+                    f.write("DESCRIPTION=%s\nSLOT=0\n" % self.descriptions.get(p, ""))
+
+    def write_eix_cache (self, path):
+        """
+        Writes an eix cache (version 28) with the packages.
+
+        @param path: the file to write
+        @type path: string
+        """
+        cats = {}
+        for p in self.pkgs:
+            cat, name = p.split("/")
+            cats.setdefault(cat, []).append((name, self.descriptions.get(p, ""), self.versions[p]))
+
+        with open(path, "wb") as f:
+            write_eix(f, sorted(cats.iteritems()), self.portdir)
+
+    def _match (self, key, pkgs):
+        # mimics the key handling of the portage system
+        if not key:
+            return list(pkgs)
+        elif key.endswith("/*"):
+            return [p for p in pkgs if p.split("/")[0] == key[:-2]]
+        elif "*" in key[1:] and key[0] not in ("=","<",">","~","!"):
+            regex = re.compile(key, re.I)
+            return [p for p in pkgs if regex.match(p)]
+        elif "/" in key:
+            return [p for p in pkgs if p == key]
+        else:
+            return [p for p in pkgs if p.split("/")[0] == key]
+
+    def find_packages (self, key = "", pkgSet = SystemInterface.SET_ALL, masked = False, with_version = True, only_cpv = False):
+        version = None
+        if key and key.startswith("="): # a single version
+            key, version = key[1:].rsplit("-", 1)
+
+        if pkgSet == self.SET_INSTALLED:
+            pkgs = [p for p in self.pkgs if p in self.inst]
+        elif pkgSet == self.SET_UNINSTALLED:
+            pkgs = [p for p in self.pkgs if p not in self.inst]
+        else:
+            pkgs = self.pkgs
+
+        pkgs = self._match(key, pkgs)
+        if with_version or only_cpv:
+            if pkgSet == self.SET_INSTALLED:
+                pkgs = ["%s-%s" % (p, self.installed_version(p)) for p in pkgs]
+            else:
+                pkgs = ["%s-%s" % (p, v) for p in pkgs for v in self.versions[p]]
+
+            if version is not None:
+                pkgs = [p for p in pkgs if p.rsplit("-", 1)[1] == version]
+
+            if not only_cpv:
+                pkgs = map(self.new_package, pkgs)
+
+        return pkgs
+
+    def new_package (self, cpv):
+        return SyntheticPackage(self, cpv)
+
+    def split_cpv (self, cpv):
+        cp, version = cpv.rsplit("-", 1)
+        cat, pkg = cp.split("/")
+        return [cat, pkg, version, "r0"]
+
+    def sort_package_list (self, pkglist, only_cpv = False):
+        def key (p):
+            cpv = p if only_cpv else p.get_cpv()
+            cp, version = cpv.rsplit("-", 1)
+            return (cp, version_key(version))
+
+        pkglist.sort(key = key)
+        return pkglist
+
+    def list_categories (self, name = None):
+        return [c for c in self.categories if name is None or name in c]
+
+    def get_global_settings (self, key):
+        return {"PORTDIR" : self.portdir, "PORTDIR_OVERLAY" : "", "ROOT" : self.root}.get(key, "")
+
+#
+# eix cache writing
+#
+
+def eix_number (n):
+    if n < 0xFF:
+        return chr(n)
+
+    digits = []
+    while n:
+        digits.insert(0, n & 0xFF)
+        n >>= 8
+
+    if digits[0] == 0xFF: # a leading 0xFF is escaped by a following 0
+        return "\xff" * len(digits) + "\x00" + "".join(map(chr, digits[1:]))
+    else:
+        return "\xff" * (len(digits) - 1) + "".join(map(chr, digits))
+
+def eix_string (s):
+    if isinstance(s, unicode):
+        s = s.encode("utf-8")
+    return eix_number(len(s)) + s
+
+def eix_vector (items, f):
+    return eix_number(len(items)) + "".join(f(i) for i in items)
+
+def eix_version (version):
+    """Encodes a stable version of the form C{1.2.3} in slot C{0}."""
+    parts = version.split(".")
+    encoded = [eix_number((len(parts[0]) << 5) | 10) + parts[0]] # first part
+    encoded.extend(eix_number((len(p) << 5) | 9) + p for p in parts[1:]) # primary parts
+
+    # mask, properties, restrict, keywords, version parts, slot, overlay, useflags
+    return "\x00\x00" + eix_number(0) + eix_vector([0, 1], eix_number) \
+            + eix_number(len(encoded)) + "".join(encoded) \
+            + eix_number(0) + eix_number(0) + eix_vector([0], eix_number)
+
+def write_eix (f, cats, portdir):
+    """
+    Writes an eix cache.
+
+    @param f: the file to write to
+    @type f: file
+    @param cats: the categories with their packages
+    @type cats: (string, (name, description, versions)[])[]
+    @param portdir: the path of the portage tree
+    @type portdir: string
+    """
+    f.write(eix_number(28) + eix_number(len(cats)))
+    f.write(eix_vector([(portdir, "gentoo")], lambda o: eix_string(o[0]) + eix_string(o[1]))) # overlays
+    f.write(eix_vector([], eix_string)) # provide
+    f.write(eix_vector(["GPL-2"], eix_string)) # licenses
+    f.write(eix_vector(["x86", "amd64"], eix_string)) # keywords
+    f.write(eix_vector(["doc", "gtk"], eix_string)) # useflags
+    f.write(eix_vector([""], eix_string)) # slots
+    f.write(eix_vector([], eix_string)) # world sets
+
+    for cat, pkgs in cats:
+        f.write(eix_string(cat) + eix_number(len(pkgs)))
+        for name, descr, versions in pkgs:
+            # name, description, provide, homepage, license, useflags, versions
+            body = eix_string(name) + eix_string(descr) + eix_vector([], eix_number) \
+                    + eix_string("http://www.gentoo.org") + eix_number(0) + eix_vector([0, 1], eix_number) \
+                    + eix_vector(versions, eix_version)
+            f.write(eix_number(len(body)) + body)
@@ -24,7 +24,7 @@ types = [
         ("eixsql",
                 DBType(
                     _("eix + SQLite"),
-                    _("Similar to SQLite, but now uses the eix database to get the package information.\nThis should be much faster on startup, but requires that your eix database is always up-to-date.\nAdditionally, this is the only database allowing searching in descriptions."),
+                    _("Similar to SQLite, but now uses the eix database to get the package information.\nThis should be much faster on startup, but requires that your eix database is always up-to-date.\nAdditionally, it allows searching in descriptions right from the start."),
                     "eix_sql", "EixSQLDatabase",
                     "sql")),
         ("sql",
@@ -33,10 +33,16 @@ types = [
                     _("Uses an SQLite-database to store package information.\nMay take longer to generate at the first time, but has advantages if portato is re-started with an unchanged portage tree. Additionally it allows to use fast SQL expressions for fetching the data."),
                     "sql", "SQLDatabase",
                     "dict")),
+        ("mmap",
+                DBType(
+                    _("Memory-mapped file"),
+                    _("Stores package information in a binary file, which is mapped into memory on startup.\nStarts nearly instantly, as only the changed categories are fetched from portage, and does not need SQLite. Searching is only possible in the package names."),
+                    "mapped", "MappedDatabase",
+                    "dict")),
         ("dict",
                 DBType(
                     _("Hashmap"),
-                    _("Uses an in-memory hashmap to store package information.\nHas been used since at least version 0.3.3, but all information has to be regenerated on each startup."),
+                    _("Uses an in-memory hashmap to store package information.\nHas been used since at least version 0.3.3, but all information has to be regenerated on each startup.\nSearching in descriptions is possible once they have been read from the metadata cache in the background."),
                     "hash", "HashDatabase",
                     None))
         ]
@@ -46,11 +52,11 @@ types = OrderedDict(types)
 class Database(db.Database):
     DEFAULT = "dict"
 
-    def __new__ (cls, type = None):
+    def __new__ (cls, type = None, background = False):
         try:
             if not '_the_instance' in cls.__dict__:
                 dbcls = cls._generate(type)
-                cls._the_instance = dbcls(cls._get_session())
+                cls._the_instance = dbcls(cls._get_session(), background)
             elif type is not None:
                 raise DatabaseInstantiationError("Database instantiation called with 'type' argument multiple times.")
         except (ImportError, DatabaseInitError) as e:
@@ -59,7 +65,7 @@ class Database(db.Database):
             error(_("Error: %s"), e)
 
             if db.alt is not None:
-                return cls.__new__(cls, db.alt)
+                return cls.__new__(cls, db.alt, background)
             else:
                 error(_("No alternative database given. Aborting."))
                 raise DatabaseInstantiationError("Cannot load database.")
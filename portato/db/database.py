@@ -12,15 +12,127 @@
 
 
 
-from threading import RLock
+import os
+import re
+import gzip
+import json
+import hashlib
+from threading import Thread, Condition, Lock, local, current_thread
 from functools import wraps
-from ..helper import warning
+from contextlib import closing
+from itertools import islice
+from inspect import getcallargs
+from collections import OrderedDict, defaultdict
+from types import GeneratorType
+from ..helper import warning, debug, error
+from ..backend import system
 
-from .exceptions import UnsupportedSearchTypeError
+from .exceptions import UnsupportedSearchTypeError, SnapshotError
 
 class UnsupportedSearchTypeError(Exception):
     pass
 
+class RWLock (object):
+    """A reentrant reader-writer lock: Any number of threads can hold it shared, but only one exclusively.
+
+    The thread holding the lock exclusively can acquire it again - shared or exclusively. Waiting writers
+    are preferred over new readers, unless the reader already holds the lock shared (it would deadlock otherwise).
+    Upgrading a shared lock to an exclusive one is not possible."""
+
+    def __init__ (self):
+        self._cond = Condition(Lock())
+        self._readers = 0 # number of shared acquisitions of all threads
+        self._writer = None # thread holding the lock exclusively
+        self._writes = 0 # number of exclusive acquisitions of the writer
+        self._waiting = 0 # number of waiting writers
+        self._local = local() # number of shared acquisitions of the current thread
+
+    def _shared_count (self):
+        return getattr(self._local, "count", 0)
+
+    def acquire_shared (self):
+        me = current_thread()
+        count = self._shared_count()
+
+        with self._cond:
+            if self._writer is not me:
+                while self._writer is not None or (self._waiting and not count):
+                    self._cond.wait()
+
+            self._readers += 1
+
+        self._local.count = count + 1
+
+    def release_shared (self):
+        self._local.count = self._shared_count() - 1
+
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_exclusive (self):
+        me = current_thread()
+
+        with self._cond:
+            if self._writer is me:
+                self._writes += 1
+                return
+
+            if self._shared_count():
+                raise RuntimeError("Cannot upgrade a shared lock to an exclusive one.")
+
+            self._waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+
+            self._writer = me
+            self._writes = 1
+
+    def release_exclusive (self):
+        with self._cond:
+            self._writes -= 1
+            if not self._writes:
+                self._writer = None
+                self._cond.notify_all()
+
+def locked_iter (acquire, release, it, batch):
+    """Iterates over the given generator, running it under the lock.
+    The lock is acquired for each batch of items - and not held while the caller works on them.
+
+    @param acquire: acquires the lock
+    @type acquire: function
+    @param release: releases the lock
+    @type release: function
+    @param it: the generator
+    @type it: generator
+    @param batch: number of items fetched while holding the lock
+    @type batch: int"""
+
+    try:
+        while True:
+            acquire()
+            try:
+                items = list(islice(it, batch))
+            finally:
+                release()
+
+            for item in items:
+                yield item
+
+            if len(items) < batch:
+                break
+    finally:
+        # run the cleanup of the generator (e.g. closing cursors) under the lock too
+        acquire()
+        try:
+            it.close()
+        finally:
+            release()
+
 class PkgData (object):
     __slots__ = ("cat", "pkg", "inst", "disabled")
 
@@ -39,10 +151,125 @@ class PkgData (object):
     def __repr__ (self):
         return "<Package (%(cat)s, %(pkg)s, %(inst)s)>" % {"cat" : self.cat, "pkg" : self.pkg, "inst" : self.inst}
 
+class CategoryStats (object):
+    __slots__ = ("total", "installed", "disabled", "matching", "matching_installed")
+
+    def __init__ (self, total = 0, installed = 0, disabled = 0, matching = 0, matching_installed = 0):
+        self.total = total
+        self.installed = installed
+        self.disabled = disabled
+        self.matching = matching # not disabled and matching the restriction
+        self.matching_installed = matching_installed
+
+    def __iter__ (self):
+        return iter((self.total, self.installed, self.disabled, self.matching, self.matching_installed))
+
+    def __repr__ (self):
+        return "<CategoryStats (%s)>" % ", ".join("%s=%d" % (n, getattr(self, n)) for n in self.__slots__)
+
+class VersionData (object):
+    __slots__ = ("cat", "pkg", "version", "slot", "keywords", "iuse", "overlay", "masked", "inst")
+
+    def __init__ (self, cat, pkg, version, slot = "0", keywords = "", iuse = "", overlay = "", masked = False, inst = False):
+        self.cat = cat
+        self.pkg = pkg
+        self.version = version
+        self.slot = slot
+        self.keywords = keywords
+        self.iuse = iuse
+        self.overlay = overlay
+        self.masked = masked
+        self.inst = inst
+
+    def get_cpv (self):
+        return "%s/%s-%s" % (self.cat, self.pkg, self.version)
+
+    def __repr__ (self):
+        return "<Version (%(cpv)s, %(slot)s, %(inst)s)>" % {"cpv" : self.get_cpv(), "slot" : self.slot, "inst" : self.inst}
+
+class ResultCache (object):
+    """A bounded cache of query results, dropping the least recently used ones first.
+
+    Calls made while computing a result for the cache (e.g. a subclass calling the method of its superclass)
+    are not cached themselves."""
+
+    def __init__ (self, size):
+        """Constructor.
+
+        @param size: maximum number of results stored
+        @type size: int"""
+
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = Lock()
+        self._local = local()
+        self._generation = 0 # increased on each invalidation
+
+    def __len__ (self):
+        return len(self._results)
+
+    def call (self, key, f):
+        """Returns the result stored for the key - or calls C{f} to compute and store it.
+
+        @param key: the key of the result
+        @type key: tuple
+        @param f: the function computing the result
+        @type f: function
+        @returns: the result as a list
+        @rtype: list"""
+
+        if getattr(self._local, "computing", False):
+            return list(f())
+
+        with self._lock:
+            try:
+                result = self._results.pop(key)
+            except KeyError:
+                self.misses += 1
+                generation = self._generation
+            else:
+                self.hits += 1
+                self._results[key] = result # now the most recently used
+                return result
+
+        self._local.computing = True
+        try:
+            result = list(f())
+        finally:
+            self._local.computing = False
+
+        with self._lock:
+            # do not store results computed before an invalidation
+            if generation == self._generation:
+                self._results[key] = result
+                while len(self._results) > self.size:
+                    self._results.popitem(last = False)
+
+        return result
+
+    def invalidate (self, predicate = None):
+        """Removes results.
+
+        @param predicate: called with each key - the result is removed if True; if None, all results are removed
+        @type predicate: function"""
+
+        with self._lock:
+            self._generation += 1
+            if predicate is None:
+                self._results.clear()
+            else:
+                for key in [k for k in self._results if predicate(k)]:
+                    del self._results[key]
+
 class Database (object):
 
     ALL = _("ALL")
 
+    # the installed packages database -- relative to ROOT
+    VDB_PATH = "var/db/pkg"
+
     SEARCH_NAME = 1
     SEARCH_DESCRIPTION = 2
 
@@ -53,21 +280,137 @@ class Database (object):
             }
 
 
+    # number of items of a returned generator fetched while holding the lock
+    LOCK_BATCH = 256
+
+    # number of results kept by the result cache
+    CACHE_SIZE = 64
+
+    # version of the files written by export_snapshot
+    EXPORT_FORMAT = 1
+
+    # the events passed to the listeners (see add_listener)
+    (
+            CATEGORY_ADDED,
+            CATEGORY_REMOVED,
+            PACKAGE_ADDED,
+            PACKAGE_REMOVED,
+            PACKAGE_CHANGED,
+            PACKAGE_DISABLED,
+            SEARCH_TYPES_CHANGED
+    ) = range(7)
+
     def __init__ (self):
-        self._lock = RLock()
+        self._lock = RWLock()
+        self.result_cache = ResultCache(self.CACHE_SIZE)
         self.type = self.SEARCH_NAME
+        self._pending = [] # categories to be loaded by populate_background
+        self._loader = None
+        self._stop_loading = False
+        self._listeners = []
 
     @staticmethod
-    def lock (f):
+    def _locked (f, exclusive):
         @wraps(f)
         def wrapper (self, *args, **kwargs):
-            with self._lock:
+            if exclusive:
+                acquire, release = self._lock.acquire_exclusive, self._lock.release_exclusive
+            else:
+                acquire, release = self._lock.acquire_shared, self._lock.release_shared
+
+            acquire()
+            try:
                 r = f(self, *args, **kwargs)
+            finally:
+                release()
+
+            # generators (e.g. generator methods) are run later -- take the lock for them too
+            if isinstance(r, GeneratorType):
+                r = locked_iter(acquire, release, r, self.LOCK_BATCH)
                 
             return r
         
         return wrapper
 
+    @staticmethod
+    def lock (f):
+        """Decorator running the method with the database locked exclusively. Use it for methods modifying the database."""
+        return Database._locked(f, True)
+
+    @staticmethod
+    def shared (f):
+        """Decorator running the method with the database locked shared. Use it for methods only reading the database."""
+        return Database._locked(f, False)
+
+    @staticmethod
+    def cached (f):
+        """Decorator storing the results of the method in the L{ResultCache}. The result is returned as an iterator.
+        The key consists of the method, its arguments, the search type and the current restriction.
+        
+        For methods taking a category as first argument (like L{get_cat}), results are removed by
+        L{invalidate_cache} for this category only. All other results are removed on each invalidation.
+        
+        Apply it below the lock decorators, so that results are computed and invalidated under the lock."""
+
+        @wraps(f)
+        def wrapper (self, *args, **kwargs):
+            callargs = getcallargs(f, self, *args, **kwargs)
+            del callargs["self"]
+            callargs.pop("connection", None)
+
+            key = (f.__name__, tuple(sorted(callargs.iteritems())), self._type, self.restrict_key())
+            return iter(self.result_cache.call(key, lambda: f(self, *args, **kwargs)))
+
+        return wrapper
+
+    def restrict_key (self):
+        """Returns a hashable representation of the current restriction, used in the keys of the result cache.
+
+        @returns: the representation or None if there is no restriction
+        @rtype: object"""
+        return self.restrict or None
+
+    def invalidate_cache (self, cat = None):
+        """Removes the cached results which are affected by a change of the given category.
+        Has to be called by all methods changing the database.
+
+        @param cat: the changed category; if None, all results are removed
+        @type cat: string"""
+
+        if not cat:
+            self.result_cache.invalidate()
+        else:
+            affected = (None, "", cat, self.ALL)
+            def predicate (key):
+                if key[0] != "get_cat": # results not per category
+                    return True
+
+                args = dict(key[1])
+                return args.get("cat", args.get("category")) in affected
+
+            self.result_cache.invalidate(predicate)
+
+    def prepare_search (self, restrict, cancelled = None):
+        """Computes the results of a restriction, so that setting it afterwards is fast.
+        The current restriction is not changed: the caller sets it, when it accepts the results.
+        Used by L{SearchSession<search.SearchSession>} - the default does not compute anything in advance.
+
+        @param restrict: the restriction to compute the results of
+        @type restrict: string
+        @param cancelled: checked regularly - if it returns True, the computation is aborted
+        @type cancelled: function
+        @returns: False if the computation has been cancelled
+        @rtype: boolean"""
+
+        return True
+
+    def invalidate_searches (self):
+        """Removes the cached results of restrictions other than the current one.
+        To be called after the restriction has been changed."""
+
+        current = self.restrict_key()
+        self.result_cache.invalidate(lambda key: key[3] is not None and key[3] != current)
+
     def search_types (self):
         """The types of search supported by the database.
 
@@ -94,6 +437,60 @@ class Database (object):
         """
         raise NotImplentedError
 
+    def populate_background (self, callback = None, threadClass = Thread):
+        """Loads the categories, which have been left out on construction, in a separate thread.
+        The categories are loaded one after the other and the lock is only held for a single category,
+        so the categories already loaded can be queried meanwhile.
+
+        @param callback: called (in the loading thread) after each category as C{callback(cat, loaded, total)};
+                         C{cat} is None when loading has finished
+        @type callback: function
+        @param threadClass: the class of the thread to start
+        @type threadClass: Thread
+        @returns: the started thread or None if there is nothing to load
+        @rtype: Thread
+        """
+
+        cats = self._pending
+        self._pending = []
+        total = len(cats)
+
+        if not cats:
+            if callback: callback(None, 0, 0)
+            return None
+
+        def load ():
+            loaded = 0
+            try:
+                for cat in cats:
+                    if self._stop_loading:
+                        debug("Loading the database has been stopped after %d of %d categories.", loaded, total)
+                        return
+
+                    self.reload(cat)
+                    loaded += 1
+                    if callback: callback(cat, loaded, total)
+
+                self.populate_finished()
+            finally:
+                if callback: callback(None, loaded, total)
+
+        self._loader = threadClass(name = "Database-Populate-Thread", target = load)
+        self._loader.setDaemon(True)
+        self._loader.start()
+
+        return self._loader
+
+    def populate_finished (self):
+        """Called after L{populate_background} has loaded all categories."""
+        pass
+
+    def is_loading (self):
+        """Returns whether categories are still being loaded in the background.
+
+        @rtype: boolean"""
+        return bool(self._pending) or (self._loader is not None and self._loader.isAlive())
+
     def get_cat (self, cat = None, byName = True, showDisabled = False):
         """Returns the packages in the category.
         
@@ -108,6 +505,48 @@ class Database (object):
         """
         raise NotImplentedError
 
+    def get_cat_range (self, cat = None, offset = 0, limit = None, byName = True, showDisabled = False, installed = False):
+        """Returns a window of the packages in the category, in the order of L{get_cat}.
+        Allows to show big categories (like C{ALL}) piece by piece.
+
+        This default implementation skips through the result of L{get_cat} -- backends should override it.
+
+        @param cat: category to return the packages from; if None it defaults to C{ALL}
+        @type cat: string
+        @param offset: number of packages to skip
+        @type offset: int
+        @param limit: maximum number of packages to return; if None, all remaining packages are returned
+        @type limit: int
+        @param byName: selects whether to return the list sorted by name or by installation
+        @type byName: boolean
+        @param showDisabled: should disabled packages be returned
+        @type showDisabled: boolean
+        @param installed: only return installed packages
+        @type installed: boolean
+        @return: an iterator over the packages
+        @rtype: L{PkgData}<iterator>
+        """
+        pkgs = self.get_cat(cat, byName, showDisabled)
+        if installed:
+            pkgs = (p for p in pkgs if p.inst)
+
+        return islice(pkgs, offset, None if limit is None else offset + limit)
+
+    def count_cat (self, cat = None, showDisabled = False, installed = False):
+        """Returns the number of packages in the category, i.e. the number of packages returned by
+        L{get_cat_range} for the whole category.
+
+        @param cat: category to count the packages in; if None it defaults to C{ALL}
+        @type cat: string
+        @param showDisabled: should disabled packages be counted
+        @type showDisabled: boolean
+        @param installed: only count installed packages
+        @type installed: boolean
+        @returns: the number of packages
+        @rtype: int
+        """
+        return sum(1 for p in self.get_cat_range(cat, showDisabled = showDisabled, installed = installed))
+
     def get_categories (self, installed = False):
         """Returns all categories.
         
@@ -118,6 +557,27 @@ class Database (object):
         """
         raise NotImplentedError
 
+    def get_category_stats (self):
+        """Returns the number of packages in each category. The key L{ALL} holds the sums.
+
+        A package is counted as matching, if it is not disabled and matches the current restriction.
+        Without a restriction all non-disabled packages are matching.
+
+        @returns: category -> statistics
+        @rtype: dict(string -> L{CategoryStats})
+        """
+        raise NotImplentedError
+
+    def get_versions (self, cp):
+        """Returns the versions of a package as stored in the database.
+
+        @param cp: the package
+        @type cp: string
+        @returns: the versions sorted from lowest to highest or None if the database does not store versions
+        @rtype: L{VersionData}[]
+        """
+        return None
+
     def disable (self, cpv):
         """Marks the CPV as disabled.
 
@@ -132,3 +592,264 @@ class Database (object):
         @type cat: string
         """
         raise NotImplentedError
+
+    def reload_many (self, categories):
+        """Reloads the given categories. Backends should override this to fetch all of them at once.
+
+        @param categories: the categories
+        @type categories: string<iterable>
+        """
+        for cat in categories:
+            self.reload(cat)
+
+    def generate_cats_expr (self, cats):
+        """Generates an expression for L{system.find_packages} matching all packages of the given categories.
+
+        @param cats: the categories
+        @type cats: string[]
+        @returns: expression
+        @rtype: string
+        """
+        if len(cats) == 1:
+            return cats[0]+"/*"
+        else:
+            return "^(?:%s)/.*" % "|".join(re.escape(cat) for cat in cats)
+
+    def add_listener (self, listener):
+        """Registers a function to be informed about changes of the database - called as C{listener(event, data)}:
+
+            - C{CATEGORY_ADDED}, C{CATEGORY_REMOVED}: data is the name of the category
+            - C{PACKAGE_ADDED}, C{PACKAGE_REMOVED}: data is the package as L{PkgData}
+            - C{PACKAGE_CHANGED}: the installed flag of the package has changed - data is the package as L{PkgData}
+            - C{PACKAGE_DISABLED}: data is the package as L{PkgData}
+            - C{SEARCH_TYPES_CHANGED}: the result of L{search_types} has changed - data is the new value
+
+        A category exists as long as it has packages, which are not disabled. Disabled packages count as removed,
+        so a package re-enabled by reloading its category is reported as added.
+
+        The listeners are called in the thread changing the database, while it is locked. They can query the
+        database then, but should hand over longer work (e.g. updating the GUI) to another thread.
+
+        @param listener: the function to call
+        @type listener: function"""
+
+        self._listeners = self._listeners + [listener] # copy, as the list might be iterated meanwhile
+
+    def remove_listener (self, listener):
+        """Removes a listener registered with L{add_listener}.
+
+        @param listener: the function to remove
+        @type listener: function"""
+
+        self._listeners = [l for l in self._listeners if l != listener]
+
+    def notify (self, event, data):
+        """Calls the listeners with the event. Errors of the listeners are logged and ignored."""
+        for listener in self._listeners:
+            try:
+                listener(event, data)
+            except Exception:
+                error(_("Error in a database listener:"), exc_info = True)
+
+    def get_installed_flags (self, categories = None):
+        """Returns the installed flag of each package, which is not disabled - regardless of the current restriction.
+        Used to find the changes made by reloading (see L{notify_changes}).
+
+        @param categories: the categories to return the packages of - None for all
+        @type categories: string<iterable>
+        @returns: cp -> installed
+        @rtype: dict
+        """
+        raise NotImplentedError
+
+    def watch_changes (self, categories = None):
+        """Returns the state to be passed to L{notify_changes} after the categories have been changed.
+
+        @param categories: the categories about to be changed - None for all
+        @type categories: string<iterable>
+        @returns: the state or None if there are no listeners to inform"""
+
+        if not self._listeners:
+            return None
+
+        if categories is not None:
+            categories = list(categories)
+
+        return (categories, self.get_installed_flags(categories))
+
+    def notify_changes (self, watched):
+        """Informs the listeners about the changes made since L{watch_changes}.
+
+        @param watched: the state returned by L{watch_changes}"""
+
+        if watched is None:
+            return
+
+        categories, old = watched
+        new = self.get_installed_flags(categories)
+
+        def cats (flags):
+            return set(cp.split("/", 1)[0] for cp in flags)
+
+        old_cats = cats(old)
+        new_cats = cats(new)
+
+        for cat in sorted(new_cats - old_cats):
+            self.notify(self.CATEGORY_ADDED, cat)
+
+        for cp, inst in old.iteritems():
+            if cp not in new:
+                self.notify(self.PACKAGE_REMOVED, PkgData(*cp.split("/", 1), inst = inst))
+
+        for cp, inst in new.iteritems():
+            if cp not in old:
+                self.notify(self.PACKAGE_ADDED, PkgData(*cp.split("/", 1), inst = inst))
+            elif old[cp] != inst:
+                self.notify(self.PACKAGE_CHANGED, PkgData(*cp.split("/", 1), inst = inst))
+
+        for cat in sorted(old_cats - new_cats):
+            self.notify(self.CATEGORY_REMOVED, cat)
+
+    def tree_key (self):
+        """Returns the key identifying the state of the portage tree, independent of the host: the timestamp
+        of the last sync and a fingerprint of the packages in each overlay.
+
+        @returns: the key - containing only strings, so it can be stored in a snapshot
+        @rtype: dict
+        """
+        try:
+            with open(os.path.join(system.get_global_settings("PORTDIR"), "metadata/timestamp")) as f:
+                timestamp = f.read().strip()
+        except IOError:
+            timestamp = None
+
+        categories = system.list_categories()
+        overlays = {}
+        for overlay in system.get_global_settings("PORTDIR_OVERLAY").split():
+            h = hashlib.md5()
+            for cat in categories:
+                try:
+                    entries = sorted(os.listdir(os.path.join(overlay, cat)))
+                except OSError: # category not in this overlay
+                    continue
+
+                h.update("%s %s\n" % (cat, " ".join(entries)))
+
+            overlays[overlay] = h.hexdigest()
+
+        return {"timestamp" : timestamp, "overlays" : overlays}
+
+    def export_snapshot (self, path):
+        """Writes the packages of the portage tree into a compressed snapshot, which can be imported by L{import_snapshot}
+        on hosts with the same tree (and any type of database). Disabled packages are left out, as well as everything
+        depending on the host, like the installed flags.
+
+        @param path: the file to write
+        @type path: string
+        @raises SnapshotError: the database is not complete
+        """
+        if self.is_loading():
+            raise SnapshotError(_("Cannot export the database while it is still loading."))
+
+        packages = defaultdict(list)
+        for cp in self.get_installed_flags():
+            cat, pkg = cp.split("/", 1)
+            packages[cat].append(pkg)
+
+        for pkgs in packages.itervalues():
+            pkgs.sort()
+
+        snapshot = {"format" : self.EXPORT_FORMAT, "key" : self.tree_key(), "packages" : packages}
+        with closing(gzip.open(path, "wb")) as f:
+            json.dump(snapshot, f)
+
+        debug("Exported %d packages into '%s'.", sum(len(pkgs) for pkgs in packages.itervalues()), path)
+
+    def import_snapshot (self, path):
+        """Replaces the packages by the ones in a snapshot written by L{export_snapshot}.
+        The installed flags are computed from the installed packages database of this host.
+
+        @param path: the snapshot
+        @type path: string
+        @raises SnapshotError: the snapshot is invalid or has been taken from another portage tree
+        """
+        try:
+            with closing(gzip.open(path, "rb")) as f:
+                snapshot = json.load(f)
+
+            format, key, packages = snapshot["format"], snapshot["key"], snapshot["packages"]
+        except (ValueError, KeyError, TypeError, EOFError) as e:
+            raise SnapshotError(_("Invalid snapshot '%(path)s': %(error)s") % {"path" : path, "error" : e})
+
+        if format != self.EXPORT_FORMAT:
+            raise SnapshotError(_("Snapshot '%(path)s' has format %(format)s instead of %(expected)s.") % {"path" : path, "format" : format, "expected" : self.EXPORT_FORMAT})
+
+        if key != self.tree_key():
+            raise SnapshotError(_("Snapshot '%s' has been taken from another portage tree.") % path)
+
+        installed = set(system.find_packages(pkgSet = system.SET_INSTALLED, with_version = False))
+        try:
+            # the names in the tree are plain ASCII -- anything else has not been written by export_snapshot
+            rows = [(str(cat), str(pkg), "%s/%s" % (cat, pkg) in installed) for cat, pkgs in packages.iteritems() for pkg in pkgs]
+        except (UnicodeError, AttributeError, TypeError) as e:
+            raise SnapshotError(_("Invalid snapshot '%(path)s': %(error)s") % {"path" : path, "error" : e})
+
+        watched = self.watch_changes()
+        self.replace_packages(rows)
+        self._pending = [] # nothing is left to load
+        self.notify_changes(watched)
+
+        debug("Imported %d packages from '%s'.", len(rows), path)
+
+    def replace_packages (self, packages):
+        """Replaces all packages of the database. Used by L{import_snapshot}.
+
+        @param packages: the new packages
+        @type packages: (cat, pkg, installed)<iterable>
+        """
+        raise NotImplentedError
+
+    def category_fingerprints (self, categories = None):
+        """Computes a fingerprint for each category, made of the mtime and the entries of the category's
+        directories in the portage tree, the overlays and the installed packages database. The mtimes of the
+        entries are part of it as well: a new version only changes the directory of its package.
+
+        @param categories: the categories to compute the fingerprints for - None for all
+        @type categories: string<iterable>
+        @returns: category -> fingerprint
+        @rtype: dict
+        """
+        trees = [system.get_global_settings("PORTDIR")]
+        trees.extend(system.get_global_settings("PORTDIR_OVERLAY").split())
+        trees.append(os.path.join(system.get_global_settings("ROOT"), self.VDB_PATH))
+
+        if categories is None:
+            categories = system.list_categories()
+
+        fingerprints = {}
+        for cat in categories:
+            h = hashlib.md5()
+            for tree in trees:
+                path = os.path.join(tree, cat)
+                try:
+                    mtime = os.stat(path).st_mtime
+                    entries = sorted(os.listdir(path))
+                except OSError: # category not in this tree
+                    continue
+
+                h.update("%s %s\n" % (path, mtime))
+                for entry in entries:
+                    try:
+                        h.update("%s %s\n" % (entry, os.stat(os.path.join(path, entry)).st_mtime))
+                    except OSError: # removed meanwhile
+                        pass
+
+            fingerprints[cat] = h.digest()
+
+        return fingerprints
+
+    def close (self):
+        """Closes the database, i.e. frees all resources held. Called on shutdown."""
+        self._stop_loading = True
+        if self._loader is not None:
+            self._loader.join() # finishes the current category
@@ -18,10 +18,12 @@ except ImportError:
     from pysqlite2 import dbapi2 as sql
 
 import os
+import re
 
 from .sql import SQLDatabase
-from .exceptions import DatabaseInitError
-from ..eix import EixReader
+from .database import Database
+from .exceptions import DatabaseInitError, SnapshotError
+from ..eix import EixReader, parser
 from ..helper import debug, warning
 from ..backend import system
 
@@ -32,7 +34,16 @@ class EixSQLDatabase (SQLDatabase):
 
     CACHE_FILE = "/var/cache/eix"
 
-    def __init__ (self, session):
+    # full text search modules to try -- in order of preference
+    FTS_MODULES = ("fts5", "fts4")
+
+    # search expressions containing one of these cannot be served by the full text index
+    REGEX_CHARS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+    # fills the full text index from the packages
+    FTS_INSERT = "INSERT INTO packages_fts (rowid, name, cat, descr) SELECT packages.id, packages.name, categories.name, descr FROM " + SQLDatabase.PACKAGES
+
+    def __init__ (self, session, background = False):
 
         self.cache = session.get("cache", self.CACHE_FILE)
         if not os.path.exists(self.cache):
@@ -45,35 +56,201 @@ class EixSQLDatabase (SQLDatabase):
         debug("Using '%s' as eix cache file.", self.cache)
         
         session["cache"] = self.cache
+
+        self.fts = None
+        self._eix_index = None # (mtime, index) of the cache
+        self._fts_match = None
+        self._fts_restrict = None
         
-        SQLDatabase.__init__(self, session)
+        SQLDatabase.__init__(self, session, background)
+
+    def create_tables (self, connection):
+        SQLDatabase.create_tables(self, connection)
+
+        # the full text index mirroring packages(name, cat, descr) -- its rowid is the id of the package
+        c = connection.execute("SELECT sql FROM sqlite_master WHERE name = 'packages_fts'")
+        row = c.fetchone()
+        c.close()
+
+        if row is not None:
+            for mod in self.FTS_MODULES:
+                if mod in row[0].lower():
+                    self.fts = mod
+                    break
+        else:
+            for mod in self.FTS_MODULES:
+                try:
+                    connection.execute("CREATE VIRTUAL TABLE packages_fts USING %s (name, cat, descr)" % mod)
+                except sql.OperationalError:
+                    debug("Full text search module '%s' not available.", mod)
+                else:
+                    self.fts = mod
+                    connection.execute(self.FTS_INSERT)
+                    break
+
+        if self.fts is None:
+            warning(_("SQLite does not support full text search. Falling back to slow description search."))
+        else:
+            debug("Using '%s' for description search.", self.fts)
 
     def search_types(self):
         return self.SEARCH_NAME | self.SEARCH_DESCRIPTION
 
     def updated (self):
-        mtime = os.stat(self.cache).st_mtime
+        # the session only holds str(mtime), so compare with the same precision
+        mtime = str(os.stat(self.cache).st_mtime)
         old = float(self.session.get("mtime", 0))
         
-        self.session["mtime"] = str(mtime)
+        self.session["mtime"] = mtime
+
+        return old < float(mtime)
 
-        return old < mtime
+    def updated_since_migration (self):
+        # format 2 used the same check -- but do not touch the session, which is done by updated
+        return float(self.session.get("mtime", 0)) < float(str(os.stat(self.cache).st_mtime))
+
+    def changed_categories (self, fingerprints):
+        # packages, descriptions, versions and the full text index are read from the eix cache, which is
+        # rewritten as a whole -- the directories of the tree do not tell which categories it changed
+        if self.was_updated:
+            debug("The eix cache has been updated.")
+            return None
+
+        return SQLDatabase.changed_categories(self, fingerprints)
 
     def generate_cat_expr (self, cat):
         # be a noop
         return cat
 
-    @SQLDatabase.con
-    def populate (self, category = None, connection = None):
-        inst = set(system.find_packages(pkgSet = system.SET_INSTALLED, key = category, with_version = False))
+    def generate_cats_expr (self, cats):
+        # keep the list -- the categories are looked up one by one in the cache
+        return list(cats)
+
+    def version_rows (self, header, cat, pkg, inst_cpv):
+        """
+        Returns the rows of the versions table for a package of the eix cache.
+
+        @param header: the header of the cache
+        @param cat: the category of the package
+        @type cat: string
+        @param pkg: the package
+        @param inst_cpv: the installed versions
+        @type inst_cpv: set
+        @rtype: tuple<iterator>
+        """
+        for pos, v in enumerate(pkg.versions):
+            useflags = v.useflags or pkg.useflags # IUSE might only be stored per package
+            if v.overlay < len(header.overlays):
+                overlay = header.overlays[v.overlay].path
+            else:
+                overlay = ""
+
+            yield (cat, pkg.name, v.version, pos,
+                    header.slots[v.slot] or "0",
+                    " ".join(header.keywords[k] for k in v.keywords),
+                    " ".join(header.useflags[u] for u in useflags),
+                    overlay,
+                    bool(v.mask & (parser.MASK_PACKAGE | parser.MASK_PROFILE)),
+                    "%s/%s-%s" % (cat, pkg.name, v.version) in inst_cpv)
+
+    def insert_versions (self, category, connection):
+        # only needed after migrating -- insert_packages reads the versions together with the packages
+        key = SQLDatabase.generate_cats_expr(self, category) if isinstance(category, list) else category
+        inst_cpv = set(system.find_packages(pkgSet = system.SET_INSTALLED, key = key, only_cpv = True))
+
+        def _get():
+            with EixReader(self.cache, mapped = True) as eix:
+                for c in (category if isinstance(category, list) else [category]):
+                    for cat, pkg in eix.iter_packages(c):
+                        for row in self.version_rows(eix.header, cat, pkg, inst_cpv):
+                            yield row
+
+        self.insert_rows("INSERT INTO versions (cat_id, name, version, pos, slot, keywords, iuse, overlay, masked, inst) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", _get(), connection)
+
+    def insert_packages (self, category, connection):
+        if isinstance(category, list): # several categories
+            categories = category
+            key = SQLDatabase.generate_cats_expr(self, categories)
+        else:
+            categories = [category]
+            key = category
+
+        inst = set(system.find_packages(pkgSet = system.SET_INSTALLED, key = key, with_version = False))
+        inst_cpv = set(system.find_packages(pkgSet = system.SET_INSTALLED, key = key, only_cpv = True))
+        versions = []
 
         def _get():
-            with EixReader(self.cache) as eix:
-                for cat in eix.categories:
-                    if category is None or cat.name == category:
-                        for pkg in cat.packages:
-                            p = "%s/%s" % (cat.name, pkg.name)
-                            yield (cat.name, pkg.name, pkg.description, p in inst, False)
-
-        connection.executemany("INSERT INTO packages (cat, name, descr, inst, disabled) VALUES (?, ?, ?, ?, ?)", _get())
-        connection.commit()
+            mtime = os.stat(self.cache).st_mtime
+            index = None
+            if self._eix_index is not None and self._eix_index[0] == mtime:
+                index = self._eix_index[1]
+
+            with EixReader(self.cache, mapped = True, index = index) as eix:
+                for c in categories:
+                    for cat, pkg in eix.iter_packages(c):
+                        p = "%s/%s" % (cat, pkg.name)
+                        versions.extend(self.version_rows(eix.header, cat, pkg, inst_cpv))
+                        yield (cat, pkg.name, pkg.description, p in inst, False)
+
+                if category is not None: # the index has been used -- keep it for the next reload
+                    self._eix_index = (mtime, eix.index)
+
+        self.insert_rows("INSERT INTO packages (cat_id, name, descr, inst, disabled) VALUES (?, ?, ?, ?, ?)", _get(), connection)
+        self.insert_rows("INSERT INTO versions (cat_id, name, version, pos, slot, keywords, iuse, overlay, masked, inst) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", versions, connection)
+
+        if self.fts:
+            if category is None:
+                connection.execute(self.FTS_INSERT)
+            else:
+                connection.execute(self.FTS_INSERT + " WHERE categories.name IN (%s)" % ", ".join("?" * len(categories)), categories)
+
+    def delete_packages (self, cat, connection):
+        # remove the index entries, while the packages are still there to be found
+        if self.fts:
+            if cat:
+                connection.execute("DELETE FROM packages_fts WHERE rowid IN (SELECT id FROM packages WHERE cat_id = %s)" % self.CAT_ID, (cat,))
+            else:
+                connection.execute("DELETE FROM packages_fts")
+
+        SQLDatabase.delete_packages(self, cat, connection)
+
+    def replace_packages (self, packages, connection = None):
+        # the packages and their descriptions are always read from the eix cache
+        raise SnapshotError(_("The eix database cannot import snapshots - share the eix cache instead."))
+
+    def cat_order (self, category, byName):
+        # rank the results of a description search over all packages
+        if self.fts != "fts5" or not self._fts_match or self._fts_restrict != self.restrict or (category and category != self.ALL):
+            return SQLDatabase.cat_order(self, category, byName)
+
+        join = "LEFT JOIN (SELECT rowid AS pkg_id, rank FROM packages_fts WHERE descr MATCH ?) AS fts ON packages.id = fts.pkg_id"
+        order = "fts.rank IS NULL, fts.rank, packages.name"
+        if not byName:
+            order = "inst DESC, " + order
+
+        return (join, (self._fts_match,), order)
+
+    def generate_descr_expr (self, restrict):
+        self._fts_match = None
+        
+        terms = re.findall(r"\w+", restrict, re.U)
+        if not self.fts or not terms or self.REGEX_CHARS.search(restrict):
+            return SQLDatabase.generate_descr_expr(self, restrict)
+
+        # all words as prefixes -- quoted, as otherwise words like AND, OR or NOT are taken as operators
+        # fts5 only accepts the prefix marker after the string, fts4 only inside it
+        if self.fts == "fts5":
+            pattern = '"%s"*'
+        else:
+            pattern = '"%s*"'
+
+        self._fts_match = " ".join(pattern % t.replace('"', '""') for t in terms)
+        return ("packages.id IN (SELECT rowid FROM packages_fts WHERE descr MATCH ?)", (self._fts_match,))
+
+    @Database.lock
+    def set_restrict (self, restrict):
+        self._fts_match = None
+        SQLDatabase.set_restrict(self, restrict)
+        self._fts_restrict = self._restrict # the restriction the match belongs to
+
+    restrict = property(SQLDatabase.get_restrict, set_restrict)
@@ -24,3 +24,6 @@ class UnsupportedSearchTypeError(DatabaseError):
 
 class DatabaseInitError (DatabaseError):
     pass
+
+class SnapshotError (DatabaseError):
+    pass
@@ -12,135 +12,1028 @@
 
 
 
+import os
 import re
-from collections import defaultdict
+import time
+import marshal
+from array import array
+from collections import defaultdict, namedtuple
+from threading import Thread, Lock
+from multiprocessing.pool import ThreadPool
 
-from ..helper import info
+from ..constants import SESSION_DIR
+from ..helper import info, debug, error
 from ..backend import system
-from .database import Database, PkgData
+from .database import Database, PkgData, CategoryStats
+
+class TrigramIndex (object):
+    """An index mapping each trigram of a string to the set of keys whose string contains it.
+    Used to answer plain substring queries without looking at every key."""
+
+    N = 3
+
+    def __init__ (self):
+        self._grams = defaultdict(set)
+
+    def grams (self, s):
+        """Returns the set of (lowercased) trigrams of the string."""
+        s = s.lower()
+        return set(s[i:i+self.N] for i in xrange(len(s) - self.N + 1))
+
+    def add (self, key, s):
+        for g in self.grams(s):
+            self._grams[g].add(key)
+
+    def dump (self):
+        """Returns the index as a plain dict, suitable for C{marshal}."""
+        return dict(self._grams)
+
+    @classmethod
+    def restore (cls, grams):
+        index = cls()
+        index._grams.update(grams)
+        return index
+
+    def remove (self, key, s):
+        for g in self.grams(s):
+            keys = self._grams.get(g)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._grams[g]
+
+    def candidates (self, query):
+        """Returns the keys which possibly contain the query as a substring.
+
+        @param query: the substring to look for
+        @type query: string
+        @returns: the set of candidate keys or None if the query is too short to be answered by the index
+        @rtype: set"""
+
+        grams = self.grams(query)
+        if not grams:
+            return None
+
+        sets = sorted((self._grams.get(g, ()) for g in grams), key = len)
+        result = set(sets[0])
+        for keys in sets[1:]:
+            if not result: break
+            result.intersection_update(keys)
+
+        return result
+
+class Bitset (object):
+    """A growing set of flags indexed by integers, using one bit per flag."""
+
+    __slots__ = ("_bits",)
+
+    def __init__ (self, data = ""):
+        self._bits = bytearray(data)
+
+    def __getitem__ (self, i):
+        byte = i >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << (i & 7)))
+
+    def __setitem__ (self, i, value):
+        byte = i >> 3
+        if byte >= len(self._bits):
+            if not value: return
+            self._bits.extend(bytearray(byte - len(self._bits) + 1))
+
+        if value:
+            self._bits[byte] |= 1 << (i & 7)
+        else:
+            self._bits[byte] &= ~(1 << (i & 7)) & 0xFF
+
+    def tostring (self):
+        return str(self._bits)
+
+class PackageStore (object):
+    """A columnar store of packages. Each package is identified by an integer id, which indexes
+    the columns: the interned category id, the name, the lowercased name used for sorting and the
+    installed and disabled flags. The packages of a category are kept as an array of ids sorted by name."""
+
+    def __init__ (self, all):
+        """Constructor.
+
+        @param all: the name of the pseudo category holding all packages
+        @type all: string"""
+
+        self.all = all
+        self._cats = [] # cat id -> name
+        self._cat_ids = {} # name -> cat id
+        self._cat_of = array("H") # pkg id -> cat id
+        self._names = [] # pkg id -> name (None if the slot is free)
+        self._keys = [] # pkg id -> lowercased name
+        self._inst = Bitset()
+        self._disabled = Bitset()
+        self._ids = {} # cat -> pkg -> pkg id
+        self._lists = {} # cat -> array of pkg ids
+        self._free = [] # ids of removed packages, reused on add
+        self._counts = {} # cat -> [total, installed, disabled, disabled and installed]
+        self._lists[all] = array("i")
+
+    def dump (self):
+        """Returns the contents of the store as a tuple of builtin types, suitable for C{marshal}.
+
+        @rtype: tuple"""
+        lists = dict((cat, l.tostring()) for cat, l in self._lists.iteritems())
+        return (self._cats, self._cat_of.tostring(), self._names, self._keys,
+                self._inst.tostring(), self._disabled.tostring(), lists, self._free)
+
+    @classmethod
+    def restore (cls, all, state):
+        """Creates a store from the result of L{dump}.
+
+        @param all: the name of the pseudo category holding all packages
+        @type all: string
+        @param state: the dumped contents
+        @type state: tuple
+        @rtype: L{PackageStore}"""
+
+        store = cls(all)
+        cats, cat_of, store._names, store._keys, inst, disabled, lists, store._free = state
+
+        store._cats = [intern(c) for c in cats]
+        store._cat_ids = dict((c, cid) for cid, c in enumerate(store._cats))
+        store._cat_of.fromstring(cat_of)
+        store._inst = Bitset(inst)
+        store._disabled = Bitset(disabled)
+
+        for cat, data in lists.iteritems():
+            l = store._lists[cat] = array("i")
+            l.fromstring(data)
+
+        names = store._names
+        for cat in store._cats:
+            ids = store._lists.get(cat, ())
+            store._ids[cat] = dict((names[id], id) for id in ids)
+            if ids:
+                counts = store._counts[cat] = [0, 0, 0, 0]
+                for id in ids:
+                    store._count(counts, id, 1)
+
+        return store
+
+    def _count (self, counts, id, n):
+        # add n times the package to the counters
+        inst = self._inst[id]
+        disabled = self._disabled[id]
+
+        counts[0] += n
+        if inst: counts[1] += n
+        if disabled: counts[2] += n
+        if inst and disabled: counts[3] += n
+
+    def _cat_id (self, cat):
+        try:
+            return self._cat_ids[cat]
+        except KeyError:
+            cid = self._cat_ids[cat] = len(self._cats)
+            self._cats.append(intern(cat))
+            self._ids[self._cats[cid]] = {}
+            return cid
+
+    def add (self, cat, pkg, inst = False):
+        """Adds a package. The lists are not sorted afterwards, see L{sort}.
+
+        @returns: the id of the new package
+        @rtype: int"""
+
+        cid = self._cat_id(cat)
+        key = pkg.lower()
+        if key == pkg: key = pkg # do not store the same string twice
+
+        if self._free:
+            id = self._free.pop()
+            self._cat_of[id] = cid
+            self._names[id] = pkg
+            self._keys[id] = key
+            self._inst[id] = inst
+            self._disabled[id] = False
+        else:
+            id = len(self._names)
+            self._cat_of.append(cid)
+            self._names.append(pkg)
+            self._keys.append(key)
+            if inst: # new bits are unset anyways
+                self._inst[id] = True
+
+        cat = self._cats[cid]
+        self._ids[cat][pkg] = id
+
+        l = self._lists.get(cat)
+        if l is None:
+            l = self._lists[cat] = array("i")
+            self._counts[cat] = [0, 0, 0, 0]
+        l.append(id)
+        self._lists[self.all].append(id)
+
+        self._counts[cat][0] += 1
+        if inst: self._counts[cat][1] += 1
+
+        return id
+
+    def remove_categories (self, cats):
+        """Removes all packages of the given categories.
+
+        @returns: the ids and cat/pkg strings of the removed packages
+        @rtype: (int, string)[]"""
+
+        removed = []
+        for cat in cats:
+            ids = self._lists.pop(cat, None)
+            if not ids: continue
+
+            removed.extend((id, self.get_cp(id)) for id in ids)
+            self._ids[cat].clear()
+            del self._counts[cat]
+
+        if not removed:
+            return removed
+
+        for id, cp in removed:
+            self._names[id] = self._keys[id] = None
+            self._free.append(id)
+
+        dead = set(id for id, cp in removed)
+        self._lists[self.all] = array("i", (id for id in self._lists[self.all] if id not in dead))
+
+        return removed
+
+    def sort (self, cats = None):
+        """Sorts the package lists of the given categories (and of C{all}) by name.
+
+        @param cats: the categories to sort - if None all are sorted
+        @type cats: string<iterable>"""
+
+        if cats is None:
+            cats = self._lists.keys()
+        else:
+            cats = set(cats)
+            cats.add(self.all)
+
+        # new packages are appended to the sorted lists: sorting these two runs is a single merge
+        key = self._keys.__getitem__
+        for cat in cats:
+            if cat in self._lists:
+                self._lists[cat] = array("i", sorted(self._lists[cat], key = key))
+
+    def categories (self):
+        return self._lists.iterkeys()
+
+    def ids (self, cat):
+        """Returns the ids of the packages in the category sorted by name."""
+        return self._lists.get(cat, ())
+
+    def find (self, cp):
+        """Returns the id of the package or None if it is not stored."""
+        cat, pkg = cp.split("/", 1)
+        try:
+            return self._ids[cat].get(pkg)
+        except KeyError:
+            return None
+
+    def get (self, id):
+        """Returns the package with the given id as L{PkgData}."""
+        return PkgData(self._cats[self._cat_of[id]], self._names[id], self._inst[id], self._disabled[id])
+
+    def get_cat (self, id):
+        return self._cats[self._cat_of[id]]
+
+    def get_cp (self, id):
+        return self._cats[self._cat_of[id]] + "/" + self._names[id]
+
+    def get_name (self, id):
+        return self._names[id]
+
+    def key (self, id):
+        return self._keys[id]
+
+    def is_installed (self, id):
+        return self._inst[id]
+
+    def is_disabled (self, id):
+        return self._disabled[id]
+
+    def set_disabled (self, id, value = True):
+        """Sets the disabled flag of the package.
+
+        @returns: whether the flag has been changed
+        @rtype: boolean"""
+        if self._disabled[id] == value:
+            return False
+
+        counts = self._counts[self.get_cat(id)]
+        self._count(counts, id, -1)
+        self._disabled[id] = value
+        self._count(counts, id, 1)
+        return True
+
+    def count (self, cat):
+        """Returns the counters of the category - summed up for C{ALL}.
+
+        @returns: total, installed, disabled, disabled and installed
+        @rtype: int[4]"""
+        if cat == Database.ALL:
+            return map(sum, zip(*self._counts.values())) or [0] * 4
+        else:
+            return self._counts.get(cat, [0] * 4)
+
+    def counts (self):
+        """Returns the counters of all categories.
+
+        @returns: category and (total, installed, disabled, disabled and installed)
+        @rtype: (string, int[4])<iterator>"""
+        return self._counts.iteritems()
+
+class DescriptionStore (object):
+    """The descriptions of the packages, indexed by the package ids of a L{PackageStore}.
+    Each distinct description is only stored once, as the packages of a split upstream project often share it."""
+
+    def __init__ (self):
+        self._texts = [] # text id -> description
+        self._text_ids = {} # description -> text id
+        self._of = array("i") # pkg id -> text id (-1 if unknown)
+
+    def get (self, id):
+        """Returns the description of the package or None if it is not known."""
+        if id < len(self._of):
+            tid = self._of[id]
+            if tid >= 0:
+                return self._texts[tid]
+
+        return None
+
+    def set (self, id, text):
+        tid = self._text_ids.get(text)
+        if tid is None:
+            tid = self._text_ids[text] = len(self._texts)
+            self._texts.append(text)
+
+        if id >= len(self._of):
+            self._of.extend([-1] * (id - len(self._of) + 1))
+
+        self._of[id] = tid
+
+    def forget (self, ids):
+        """Removes the descriptions of the packages - to be called when their ids are freed."""
+        for id in ids:
+            if id < len(self._of):
+                self._of[id] = -1
+
+# the version part of an ebuild name in the metadata cache (e.g. "-1.0_rc2-r1")
+VERSION_SUFFIX = re.compile(r"-\d+(?:\.\d+)*[a-z]?(?:_(?:alpha|beta|pre|rc|p)\d*)*(?:-r\d+)?$")
+
+# the line holding the description in the entries of the old flat cache
+FLAT_DESCRIPTION_LINE = 7
+
+def read_cache_entry (path, flat):
+    """Reads the description out of an entry of the metadata cache.
+
+    @param path: the path of the entry
+    @type path: string
+    @param flat: whether the entry is in the old line based format (C{metadata/cache}) instead of the
+                 key/value one (C{metadata/md5-cache})
+    @type flat: boolean
+    @returns: the description or None if it cannot be read
+    @rtype: string"""
+
+    try:
+        with open(path) as f:
+            if flat:
+                for i, line in enumerate(f):
+                    if i == FLAT_DESCRIPTION_LINE:
+                        return line.rstrip("\n")
+            else:
+                for line in f:
+                    if line.startswith("DESCRIPTION="):
+                        return line[len("DESCRIPTION="):].rstrip("\n")
+    except IOError as e:
+        debug("Cannot read cache entry '%s': %s", path, e)
+
+    return None
+
+def read_descriptions (caches, cat, names):
+    """Reads the descriptions of the packages of a category out of the metadata caches of the portage trees.
+    For each package, the entry of the last version (in the order of the file names) is used.
+
+    @param caches: the caches to look into as (path, flat) - the first one knowing a package wins
+    @type caches: (string, boolean)[]
+    @param cat: the category
+    @type cat: string
+    @param names: the names of the packages to look for
+    @type names: string<iterable>
+    @returns: pkg -> description
+    @rtype: dict"""
+
+    names = set(names)
+    descrs = {}
+    for path, flat in caches:
+        try:
+            entries = sorted(os.listdir(os.path.join(path, cat)))
+        except OSError: # category not in this tree
+            continue
+
+        files = {}
+        for entry in entries:
+            m = VERSION_SUFFIX.search(entry)
+            if m is None: continue
+
+            pkg = entry[:m.start()]
+            if pkg in names and pkg not in descrs:
+                files[pkg] = entry
+
+        for pkg, entry in files.iteritems():
+            descr = read_cache_entry(os.path.join(path, cat, entry), flat)
+            if descr is not None:
+                descrs[pkg] = descr
+
+    return descrs
+
+# the packages matching a restriction in a search type: cat -> [id_list] and cat -> [matching, matching and installed]
+Search = namedtuple("Search", "restrict type matches counts")
 
 class HashDatabase (Database):
-    """An internal database which holds a simple dictionary cat -> [package_list]."""
+    """An internal database which holds the packages in a L{PackageStore}."""
 
     lock = Database.lock
+    shared = Database.shared
+
+    # the version of the snapshot layout -- increase on each change
+    SNAPSHOT_FORMAT = 1
+    SNAPSHOT_FILE = "hash.db"
+
+    # a search expression not containing any of these is a plain substring
+    REGEX_CHARS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+    # number of packages checked by a search between looking whether it has been cancelled
+    CANCEL_INTERVAL = 512
+
+    # number of threads reading the descriptions out of the metadata cache
+    DESCRIPTION_THREADS = 4
+
+    def __init__ (self, session, background = False):
+        """Constructor.
+
+        @param background: do not populate, but leave this to L{populate_background}
+        @type background: boolean"""
 
-    def __init__ (self, session):
-        """Constructor."""
+        # already needed by search_types, which is called by the constructor of Database
+        self._descriptions_loaded = False
         Database.__init__(self)
         self.session = session
 
+        # the descriptions are read from the metadata cache in the background (see load_descriptions)
+        self.with_descriptions = session.get("descriptions", "1") == "1"
+        session["descriptions"] = "1" if self.with_descriptions else "0"
+        self._descr_queue = set() # categories whose descriptions are to be read
+        self._descr_lock = Lock()
+        self._descr_loader = None
+
         self.__initialize()
-        self.populate()
+
+        self._snapshot_key = self.snapshot_key()
+        if not self.load_snapshot(self._snapshot_key):
+            if background:
+                self._pending = system.list_categories()
+            else:
+                self.populate()
+                self.save_snapshot(self._snapshot_key)
+
+        if not self._pending:
+            self.load_descriptions()
 
     def search_types(self):
-        return Database.SEARCH_NAME
+        if self._descriptions_loaded:
+            return Database.SEARCH_NAME | Database.SEARCH_DESCRIPTION
+        else:
+            return Database.SEARCH_NAME
 
     def __initialize (self):
-        self._db = defaultdict(list)
+        self._store = PackageStore(self.ALL)
         self.inst_cats = set([self.ALL])
+        self._index = TrigramIndex() # trigram -> pkg ids
+        self._descriptions = DescriptionStore()
         self._restrict = None
+        # the last computed L{Search} for the current restriction and the one computed by prepare_search
+        # -- only replaced as a whole, as they are computed under the shared lock
+        self._search = None
+        self._prepared = None
+
+    def snapshot_key (self):
+        """Returns the values a snapshot is validated against: the timestamp of the portage tree,
+        the list of overlays and the mtime of the installed packages database (which is updated
+        by portage on each merge and unmerge).
 
-    def __sort_key (self, x):
-        return x.pkg.lower()
+        @rtype: tuple"""
+
+        def mtime (path):
+            try:
+                return os.stat(path).st_mtime
+            except OSError:
+                return None
+
+        timestamp = os.path.join(system.get_global_settings("PORTDIR"), "metadata/timestamp")
+        overlays = tuple(system.get_global_settings("PORTDIR_OVERLAY").split())
+        vdb = os.path.join(system.get_global_settings("ROOT"), self.VDB_PATH)
+
+        return (mtime(timestamp), overlays, mtime(vdb))
+
+    @lock
+    def load_snapshot (self, key):
+        """Replaces the contents of the database by the snapshot in L{SESSION_DIR}, if it is valid.
+
+        @param key: the current key as returned by L{snapshot_key}
+        @type key: tuple
+        @returns: whether the snapshot has been loaded
+        @rtype: boolean"""
+
+        path = os.path.join(SESSION_DIR, self.SNAPSHOT_FILE)
+        try:
+            with open(path, "rb") as f:
+                format, snapkey, store, index, inst_cats = marshal.load(f)
+        except IOError:
+            debug("No snapshot of the hash database found.")
+            return False
+        except (EOFError, ValueError, TypeError):
+            debug("Snapshot of the hash database is corrupted or in an unknown format.")
+            return False
+
+        if format != self.SNAPSHOT_FORMAT:
+            debug("Snapshot of the hash database has format '%s' instead of '%s'.", format, self.SNAPSHOT_FORMAT)
+            return False
+
+        if snapkey != key:
+            debug("Snapshot of the hash database is outdated.")
+            return False
+
+        self._store = PackageStore.restore(self.ALL, store)
+        self._index = TrigramIndex.restore(index)
+        self._descriptions = DescriptionStore() # not part of the snapshot
+        self.inst_cats = inst_cats
+        self._search = self._prepared = None
+
+        self.__queue_descriptions(cat for cat in self._store.categories() if cat != self.ALL)
+
+        debug("Loaded snapshot of the hash database.")
+        return True
+
+    @shared
+    def save_snapshot (self, key):
+        """Writes the contents of the database into a snapshot in L{SESSION_DIR}.
+
+        @param key: the key as returned by L{snapshot_key} - computed before the database had been populated
+        @type key: tuple"""
+
+        path = os.path.join(SESSION_DIR, self.SNAPSHOT_FILE)
+        data = (self.SNAPSHOT_FORMAT, key, self._store.dump(), self._index.dump(), self.inst_cats)
+
+        try:
+            with open(path+".tmp", "wb") as f:
+                marshal.dump(data, f)
+            os.rename(path+".tmp", path) # do not leave a half-written snapshot
+        except (IOError, OSError) as e:
+            info(_("Cannot write snapshot of the hash database: %s"), e)
+
+    def populate_finished (self):
+        self.save_snapshot(self._snapshot_key)
+        self.load_descriptions()
+
+    def __queue_descriptions (self, categories):
+        """Marks the descriptions of the categories to be read by the next run of L{load_descriptions}."""
+        if self.with_descriptions:
+            with self._descr_lock:
+                self._descr_queue.update(categories)
+
+    def description_caches (self):
+        """Returns the metadata caches of the portage tree and the overlays, as taken by L{read_descriptions}.
+
+        @rtype: (string, boolean)[]"""
+
+        trees = [system.get_global_settings("PORTDIR")] + system.get_global_settings("PORTDIR_OVERLAY").split()
+        caches = []
+        for tree in trees:
+            md5 = os.path.join(tree, "metadata", "md5-cache")
+            if os.path.isdir(md5):
+                caches.append((md5, False))
+            else:
+                caches.append((os.path.join(tree, "metadata", "cache"), True))
+
+        return caches
+
+    def load_descriptions (self):
+        """Starts reading the descriptions of the queued categories in a separate thread, unless one is already running.
+        After the first run, searching in the descriptions is supported, which is announced by C{SEARCH_TYPES_CHANGED}."""
+
+        with self._descr_lock:
+            if self._descr_loader is not None or not self._descr_queue:
+                return
+
+            self._descr_loader = Thread(name = "Database-Description-Thread", target = self.__load_descriptions)
+            self._descr_loader.setDaemon(True)
+            self._descr_loader.start()
+
+    def close (self):
+        Database.close(self)
+
+        loader = self._descr_loader
+        if loader is not None:
+            loader.join() # stops after the current category
+
+    def __load_descriptions (self):
+        caches = [(path, flat) for path, flat in self.description_caches() if os.path.isdir(path)]
+        if not caches:
+            debug("No metadata cache found: Searching in the descriptions is not possible.")
+            with self._descr_lock:
+                self._descr_queue.clear()
+                self._descr_loader = None
+            return
+
+        def read (job):
+            cat, names = job
+            return cat, read_descriptions(caches, cat, names)
+
+        pool = ThreadPool(self.DESCRIPTION_THREADS)
+        try:
+            while True:
+                with self._descr_lock: # categories queued meanwhile are handled in the next round
+                    cats = list(self._descr_queue)
+                    self._descr_queue.clear()
+                    if not cats or self._stop_loading:
+                        self._descr_loader = None
+                        return
+
+                start = time.time()
+                jobs = [(cat, self.__get_names(cat)) for cat in cats]
+                for cat, descrs in pool.imap_unordered(read, jobs):
+                    if self._stop_loading: break
+                    self.__set_descriptions(cat, descrs)
+
+                debug("Read the descriptions of %d categories in %.3f seconds.", len(cats), time.time() - start)
+
+                if not self._descriptions_loaded and not self._stop_loading:
+                    self.__descriptions_loaded()
+        except Exception:
+            error(_("Error while reading the package descriptions:"), exc_info = True)
+            with self._descr_lock:
+                self._descr_loader = None
+        finally:
+            pool.close()
+
+    @lock
+    def __descriptions_loaded (self):
+        self._descriptions_loaded = True
+        self.notify(self.SEARCH_TYPES_CHANGED, self.search_types())
+
+    @shared
+    def __get_names (self, cat):
+        store = self._store
+        return [store.get_name(id) for id in store.ids(cat)]
+
+    @lock
+    def __set_descriptions (self, cat, descrs):
+        store = self._store
+        for pkg, descr in descrs.iteritems():
+            id = store.find("%s/%s" % (cat, pkg)) # the category might have been reloaded meanwhile
+            if id is not None:
+                self._descriptions.set(id, descr)
+
+        if self._type & self.SEARCH_DESCRIPTION:
+            self._search = self._prepared = None
+            self.invalidate_cache(cat)
 
     @lock
     def populate (self, category = None):
         
         # get the lists
         packages = system.find_packages(category, with_version = False)
-        installed = system.find_packages(category, system.SET_INSTALLED, with_version = False)
+        installed = set(system.find_packages(category, system.SET_INSTALLED, with_version = False))
         
-        # cycle through packages
-        for p in packages:
-            cat, pkg = p.split("/")
-            inst = p in installed
-            t = PkgData(cat, pkg, inst, False)
-            self._db[cat].append(t)
-            self._db[self.ALL].append(t)
+        self.__add_packages((p.split("/") + [p in installed]) for p in packages)
+
+    def __add_packages (self, packages):
+        """Adds the packages given as (cat, pkg, installed)."""
+
+        cats = set()
+        for cat, pkg, inst in packages:
+            id = self._store.add(cat, pkg, inst)
+            self._index.add(id, "%s/%s" % (cat, pkg))
+            cats.add(cat)
 
             if inst:
                 self.inst_cats.add(cat)
 
-        for key in self._db: # sort alphabetically
-            self._db[key].sort(key = self.__sort_key)
+        self._store.sort(cats) # sort alphabetically
+        self._search = self._prepared = None
+        self.__queue_descriptions(cats)
 
     @lock
+    def replace_packages (self, packages):
+        self.invalidate_cache()
+        self.__initialize()
+        self.__add_packages(packages)
+
+        self._snapshot_key = self.snapshot_key()
+        self.save_snapshot(self._snapshot_key)
+
+        if not self.is_loading():
+            self.load_descriptions()
+
+    def __match (self, restrict, type, id):
+        """Returns whether the package matches the restriction in the given search type."""
+        if type & self.SEARCH_NAME and restrict.search(self._store.get_cp(id)):
+            return True
+
+        if type & self.SEARCH_DESCRIPTION:
+            descr = self._descriptions.get(id)
+            return bool(descr) and restrict.search(descr) is not None
+
+        return False
+
+    def __get_search (self, restrict = None, cancelled = None, prepare = False):
+        """Returns the packages matching the restriction in the current search type.
+        The result is computed once per restriction and search type: For plain substrings in the names,
+        only the candidates returned by the trigram index are checked against the regex. If the substring
+        extends the one of the last computed result, only the packages in this result are checked.
+
+        Several readers might compute the result at the same time: each one works on its own objects and
+        publishes the finished result in a single assignment.
+
+        @param restrict: the restriction - the current one if None
+        @type restrict: compiled regex
+        @param cancelled: checked regularly - if it returns True, the computation is aborted
+        @type cancelled: function
+        @param prepare: keep the result as the prepared one, instead of the one of the current restriction
+        @type prepare: boolean
+        @returns: the result or None if cancelled
+        @rtype: L{Search}"""
+
+        type = self._type
+        if restrict is None:
+            restrict = self._restrict
+
+        # compare the patterns, as the restriction is compiled again, when the prepared one is set
+        searches = [search for search in (self._search, self._prepared) if search is not None and search.type == type]
+        for search in searches:
+            if search.restrict.pattern == restrict.pattern:
+                if not prepare and search is not self._search:
+                    self._search = search
+                return search
+
+        store = self._store
+        query = restrict.pattern
+        last = None # the result to narrow down -- the one of the longest substring
+        if not self.REGEX_CHARS.search(query):
+            for search in searches:
+                pattern = search.restrict.pattern
+                if not self.REGEX_CHARS.search(pattern) and pattern.lower() in query.lower() \
+                        and (last is None or len(pattern) > len(last.restrict.pattern)):
+                    last = search
+
+        if last is not None:
+            ids = last.matches.get(self.ALL, []) # already sorted
+        elif self.REGEX_CHARS.search(query) or type & self.SEARCH_DESCRIPTION: # the index only covers plain names
+            ids = store.ids(self.ALL)
+        else:
+            candidates = self._index.candidates(query)
+            if candidates is None:
+                ids = store.ids(self.ALL)
+            else:
+                ids = sorted(candidates, key = store.key)
+
+        matches = defaultdict(list)
+        counts = defaultdict(lambda: [0, 0]) # cat -> [matching, matching and installed] - without the disabled ones
+        for i, id in enumerate(ids):
+            if cancelled is not None and not i % self.CANCEL_INTERVAL and cancelled():
+                return None
+
+            if self.__match(restrict, type, id):
+                cat = store.get_cat(id)
+                matches[cat].append(id)
+                matches[self.ALL].append(id)
+
+                if not store.is_disabled(id):
+                    c = counts[cat]
+                    c[0] += 1
+                    if store.is_installed(id): c[1] += 1
+
+        search = Search(restrict, type, dict(matches), dict(counts))
+        if prepare:
+            self._prepared = search
+        else:
+            self._search = search
+
+        return search
+
+    def __get_match_counts (self):
+        """Returns the number of non-disabled packages matching the current restriction per category.
+
+        @returns: cat -> [matching, matching and installed]
+        @rtype: dict"""
+        return self.__get_search().counts
+
+    def prepare_search (self, restrict, cancelled = None):
+        if not restrict:
+            return True
+
+        try:
+            regex = re.compile(restrict, re.I)
+        except re.error: # reported, when the restriction is set
+            return True
+
+        return self.__prepare_search(regex, cancelled)
+
+    @shared
+    def __prepare_search (self, regex, cancelled):
+        return self.__get_search(regex, cancelled, prepare = True) is not None
+
+    def __get_ids (self, cat, byName, showDisabled, installed = False):
+        """Returns the ids of the packages in the category in the order of L{get_cat}.
+        Has to be called while holding the lock, as the ids are not stable."""
+        if not cat:
+            cat = self.ALL
+
+        store = self._store
+
+        if self.restrict:
+            ids = self.__get_search().matches.get(cat, [])
+        else:
+            ids = store.ids(cat)
+
+        if not showDisabled and store.count(cat)[2]:
+            ids = [id for id in ids if not store.is_disabled(id)]
+
+        if installed:
+            ids = [id for id in ids if store.is_installed(id)]
+        elif not byName:
+            ids = [id for id in ids if store.is_installed(id)] + [id for id in ids if not store.is_installed(id)]
+
+        return ids
+
+    @shared
+    @Database.cached
     def get_cat (self, cat = None, byName = True, showDisabled = False):
+        # collect the packages while holding the lock, as the ids are not stable
+        return iter(map(self._store.get, self.__get_ids(cat, byName, showDisabled)))
+
+    @shared
+    @Database.cached
+    def get_cat_range (self, cat = None, offset = 0, limit = None, byName = True, showDisabled = False, installed = False):
+        ids = self.__get_ids(cat, byName, showDisabled, installed)
+        return iter(map(self._store.get, ids[offset : None if limit is None else offset + limit]))
+
+    @shared
+    def count_cat (self, cat = None, showDisabled = False, installed = False):
         if not cat:
             cat = self.ALL
 
-        def get_pkgs():
-            if byName:
-                for pkg in self._db[cat]:
-                    if showDisabled or not pkg.disabled:
-                        yield pkg
+        if self.restrict:
+            if showDisabled:
+                return len(self.__get_ids(cat, True, True, installed))
+
+            counts = self.__get_match_counts()
+            if cat == self.ALL:
+                m, minst = map(sum, zip(*counts.values())) or (0, 0)
             else:
-                ninst = []
-                for pkg in self._db[cat]:
-                    if not showDisabled and pkg.disabled: continue
+                m, minst = counts.get(cat, (0, 0))
 
-                    if pkg.inst:
-                        yield pkg
-                    else:
-                        ninst.append(pkg)
+            return minst if installed else m
 
-                for pkg in ninst:
-                    yield pkg
+        total, inst, disabled, disabled_inst = self._store.count(cat)
+        if showDisabled:
+            return inst if installed else total
+        else:
+            return inst - disabled_inst if installed else total - disabled
 
-        try:
+    @shared
+    def get_category_stats (self):
+        stats = {}
+        sums = [0] * 5
+
+        if self.restrict:
+            matching = self.__get_match_counts()
+
+        for cat, (total, inst, disabled, disabled_inst) in self._store.counts():
             if self.restrict:
-                return (pkg for pkg in get_pkgs() if self.restrict.search(pkg.cat+"/"+pkg.pkg))
+                m, minst = matching.get(cat, (0, 0))
             else:
-                return get_pkgs()
+                m, minst = total - disabled, inst - disabled_inst
 
-        except KeyError: # cat is in category list - but not in portage
-            info(_("Catched KeyError => %s seems not to be an available category. Have you played with rsync-excludes?"), cat)
+            s = stats[cat] = CategoryStats(total, inst, disabled, m, minst)
+            sums = map(sum, zip(sums, s))
 
-    @lock
+        stats[self.ALL] = CategoryStats(*sums)
+        return stats
+
+    @shared
+    @Database.cached
     def get_categories (self, installed = False):
         if not self.restrict:
             if installed:
                 cats = self.inst_cats
             else:
-                cats = iter(self._db.keys())
+                cats = list(self._store.categories())
 
         else:
-            if installed:
-                cats = set((pkg.cat for pkg in self.get_cat(self.ALL) if pkg.inst))
-            else:
-                cats = set((pkg.cat for pkg in self.get_cat(self.ALL)))
+            idx = 1 if installed else 0
+            cats = set(cat for cat, counts in self.__get_match_counts().iteritems() if counts[idx])
 
             if len(cats)>1:
                 cats.add(self.ALL)
 
-        return (cat for cat in cats)
+        return iter(list(cats)) # copy, as inst_cats might be changed meanwhile
 
     @lock
     def reload (self, cat = None):
         if cat:
-            del self._db[cat]
-            try:
-                self.inst_cats.remove(cat)
-            except KeyError: # not in inst_cats - can be ignored
-                pass
-            
-            self._db[self.ALL] = [x for x in self._db[self.ALL] if x.cat != cat]
-            self.populate(cat+"/*")
+            self.reload_many([cat])
         else:
+            watched = self.watch_changes()
+            self.invalidate_cache()
             self.__initialize()
+
+            # the descriptions are read again -- until then, they cannot be searched
+            if self._descriptions_loaded:
+                self._descriptions_loaded = False
+                self.notify(self.SEARCH_TYPES_CHANGED, self.search_types())
+
             self.populate()
+            self.notify_changes(watched)
+
+            if not self.is_loading():
+                self.load_descriptions()
+
+    @lock
+    def reload_many (self, categories):
+        categories = list(set(categories))
+        if not categories: return
+
+        watched = self.watch_changes(categories)
+
+        for cat in categories:
+            self.invalidate_cache(cat)
+
+        removed = self._store.remove_categories(categories)
+        for id, cp in removed:
+            self._index.remove(id, cp)
+
+        self._descriptions.forget(id for id, cp in removed)
+        self.inst_cats.difference_update(categories)
+        
+        # one query for all categories
+        self.populate(self.generate_cats_expr(categories))
+        self.notify_changes(watched)
+
+        if not self.is_loading():
+            self.load_descriptions()
+
+    @shared
+    def get_installed_flags (self, categories = None):
+        store = self._store
+        flags = {}
+        for cat in (categories if categories is not None else [self.ALL]):
+            for id in store.ids(cat):
+                if not store.is_disabled(id):
+                    flags[store.get_cp(id)] = store.is_installed(id)
+
+        return flags
 
     @lock
     def disable (self, cpv):
-        cat, pkg = cpv.split("/")
+        id = self._store.find(cpv)
+        if id is None:
+            raise ValueError("%s is not in the database" % cpv)
+
+        store = self._store
+        if store.set_disabled(id):
+            cat = store.get_cat(id)
+
+            # keep the counters of the current search up to date -- a prepared one is computed again
+            search = self._search
+            if search is not None and self.__match(search.restrict, search.type, id):
+                counts = search.counts.get(cat)
+                if counts is not None:
+                    counts[0] -= 1
+                    if store.is_installed(id): counts[1] -= 1
+
+            if self._prepared is not search:
+                self._prepared = None
 
-        c = self._db[cat]
-        p = c[c.index(PkgData(cat, pkg))]
-        p.disabled = True
+            self.invalidate_cache(cat)
+            self.notify(self.PACKAGE_DISABLED, store.get(id))
+
+            total, inst, disabled, disabled_inst = store.count(cat)
+            if total == disabled:
+                self.notify(self.CATEGORY_REMOVED, cat)
 
     def get_restrict (self):
         return self._restrict
 
+    def restrict_key (self):
+        # the compiled expressions are not necessarily the same objects for the same pattern
+        return self._restrict.pattern if self._restrict else None
+
     @lock
     def set_restrict (self, restrict):
         if not restrict:
@@ -153,4 +1046,6 @@ class HashDatabase (Database):
             else: # only set self._restrict if no error occurred
                 self._restrict = regex
 
+        self.invalidate_searches()
+
     restrict = property(get_restrict, set_restrict)
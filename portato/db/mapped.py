@@ -0,0 +1,872 @@
+# -*- coding: utf-8 -*-
+#
+# File: portato/db/mapped.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+
+
+import os
+import re
+import mmap
+import heapq
+import struct
+import marshal
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+
+from ..constants import SESSION_DIR
+from ..helper import info, debug
+from ..backend import system
+from .database import Database, PkgData, CategoryStats
+from .exceptions import DatabaseError
+
+# the packages matching a restriction: cat -> [(cat, pkg, installed)] and cat -> [matching, matching and installed]
+Search = namedtuple("Search", "restrict matches counts")
+
+class ClosedStore (object):
+    """Takes the place of the L{MappedStore} after the database has been closed."""
+
+    def __getattr__ (self, name):
+        raise DatabaseError(_("The package database has been closed."))
+
+class MappedStore (object):
+    """A read-only view on a package file written by L{write}. The file is mapped into memory:
+    the names of the packages are only read from it when needed, only the (small) numeric columns
+    are copied into arrays on opening.
+
+    Layout of the file (in native byte order, as it is only a cache for the local machine)::
+
+        header      magic, format, number of categories, number of packages, length of meta
+        meta        marshalled (categories, fingerprints) -- the categories sorted by name
+        cat_first   I[ncats+1]  first package of each category -- the packages are sorted by category and name
+        cat_inst    I[ncats]    number of installed packages per category
+        offsets     I[npkgs+1]  start of each package's "cat/pkg" in the names
+        cat_of      H[npkgs]    category of each package
+        inst        B[npkgs]    installed flag of each package
+        by_name     I[npkgs]    the packages sorted by name (over all categories)
+        names       the "cat/pkg" of each package followed by a newline
+    """
+
+    MAGIC = "PMAP"
+    FORMAT = 1
+    HEADER = struct.Struct("=4sIIII")
+
+    def __init__ (self, path):
+        """Maps the file.
+
+        @param path: the file written by L{write}
+        @type path: string
+        @raises ValueError: the file is not a valid package file"""
+
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        try:
+            try:
+                magic, format, ncats, npkgs, metalen = self.HEADER.unpack_from(self._map)
+            except struct.error:
+                raise ValueError("truncated header")
+
+            if magic != self.MAGIC or format != self.FORMAT:
+                raise ValueError("unknown format")
+
+            pos = self.HEADER.size
+            self.categories, self.fingerprints = marshal.loads(self._map[pos:pos+metalen])
+            pos += metalen
+
+            columns = []
+            for typecode, n in (("I", ncats+1), ("I", ncats), ("I", npkgs+1), ("H", npkgs), ("B", npkgs), ("I", npkgs)):
+                a = array(typecode)
+                size = a.itemsize * n
+                a.fromstring(self._map[pos:pos+size])
+                columns.append(a)
+                pos += size
+
+            self.cat_first, self.cat_inst, self.offsets, self.cat_of, self.inst, self.by_name = columns
+            self._start = pos # of the names
+
+            if len(self.categories) != ncats or pos + self.offsets[-1] != len(self._map):
+                raise ValueError("truncated file")
+        except (ValueError, EOFError, TypeError) as e:
+            self.close()
+            raise ValueError(str(e))
+
+    @classmethod
+    def write (cls, path, packages, fingerprints):
+        """Writes the packages into a new file. The file is replaced at once, so a mapping of the old one stays valid.
+
+        @param path: the file to write
+        @type path: string
+        @param packages: the packages as (cat, pkg, installed)
+        @type packages: (string, string, boolean)[]
+        @param fingerprints: stored with the packages (see L{Database.category_fingerprints})
+        @type fingerprints: dict"""
+
+        packages = sorted(packages, key = lambda p: (p[0], p[1].lower()))
+        cats = sorted(set(p[0] for p in packages))
+        index = dict((cat, i) for i, cat in enumerate(cats))
+
+        cat_first = array("I", [0] * (len(cats)+1))
+        cat_inst = array("I", [0] * len(cats))
+        offsets = array("I")
+        cat_of = array("H")
+        inst = array("B")
+        names = []
+
+        pos = 0
+        for id, (cat, pkg, installed) in enumerate(packages):
+            c = index[cat]
+            cat_first[c+1] = id+1
+            if installed: cat_inst[c] += 1
+
+            cp = "%s/%s\n" % (cat, pkg)
+            offsets.append(pos)
+            cat_of.append(c)
+            inst.append(bool(installed))
+            names.append(cp)
+            pos += len(cp)
+
+        offsets.append(pos)
+        by_name = array("I", sorted(xrange(len(packages)), key = lambda id: (packages[id][1].lower(), packages[id][0])))
+
+        meta = marshal.dumps((cats, fingerprints))
+        with open(path+".tmp", "wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.FORMAT, len(cats), len(packages), len(meta)))
+            f.write(meta)
+            for column in (cat_first, cat_inst, offsets, cat_of, inst, by_name):
+                column.tofile(f)
+            f.write("".join(names))
+
+        os.rename(path+".tmp", path) # do not leave a half-written file
+
+    def close (self):
+        self._map.close()
+
+    def __len__ (self):
+        return len(self.cat_of)
+
+    def category_range (self, cat):
+        """Returns the ids of the packages of the category.
+
+        @returns: the first id and the id after the last one - None if the category is not stored
+        @rtype: (int, int)"""
+        i = bisect_left(self.categories, cat)
+        if i < len(self.categories) and self.categories[i] == cat:
+            return (self.cat_first[i], self.cat_first[i+1])
+        else:
+            return None
+
+    def installed (self, cat):
+        """Returns the number of installed packages of the category."""
+        i = bisect_left(self.categories, cat)
+        if i < len(self.categories) and self.categories[i] == cat:
+            return self.cat_inst[i]
+        else:
+            return 0
+
+    def get_cp (self, id):
+        return self._map[self._start + self.offsets[id] : self._start + self.offsets[id+1] - 1]
+
+    def get (self, id):
+        """Returns the package as (cat, pkg, installed)."""
+        cat = self.categories[self.cat_of[id]]
+        return (cat, self.get_cp(id)[len(cat)+1:], bool(self.inst[id]))
+
+    def find (self, cat, pkg):
+        """Returns the id of the package - looked up by a binary search in the category.
+
+        @returns: the id or None if the package is not stored
+        @rtype: int"""
+        r = self.category_range(cat)
+        if r is None:
+            return None
+
+        lo, hi = r
+        end = hi
+        key = pkg.lower()
+        skip = len(cat)+1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_cp(mid)[skip:].lower() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        # several packages might only differ in case
+        while lo < end:
+            name = self.get_cp(lo)[skip:]
+            if name == pkg:
+                return lo
+            elif name.lower() != key:
+                break
+            lo += 1
+
+        return None
+
+    def search (self, names_regex, regex, cancelled = None, interval = 512):
+        """Returns the ids of the packages whose "cat/pkg" matches. All names are searched at once:
+        C{names_regex} is run over the newline separated names. As it might match over the end of a name,
+        each package found is checked again with C{regex}.
+
+        @param names_regex: the expression compiled with C{re.M}
+        @param regex: the expression
+        @param cancelled: checked regularly - if it returns True, the search is aborted
+        @type cancelled: function
+        @param interval: number of packages found between checks of C{cancelled}
+        @type interval: int
+        @returns: the ids in the order of the file - None if cancelled
+        @rtype: int[]"""
+
+        ids = []
+        start = self._start
+        offsets = self.offsets
+        end = len(self._map)
+        n = len(self)
+
+        if not n:
+            return ids
+
+        # the names do not start after a newline, so "^" would not match at the first one
+        if regex.search(self.get_cp(0)):
+            ids.append(0)
+
+        pos = start + offsets[1]
+        while pos < end:
+            m = names_regex.search(self._map, pos, end)
+            if m is None:
+                break
+
+            id = bisect_right(offsets, m.start() - start) - 1
+            if id >= n: # empty match after the last name
+                break
+
+            if regex.search(self.get_cp(id)):
+                ids.append(id)
+                if cancelled is not None and not len(ids) % interval and cancelled():
+                    return None
+
+            pos = start + offsets[id+1]
+
+        return ids
+
+class MappedDatabase (Database):
+    """A database keeping the packages in a file, which is mapped into memory (see L{MappedStore}).
+    So loading is just mapping the file - only the categories, whose fingerprint has changed, are fetched
+    from portage.
+
+    Changed categories are not written into the file directly: they are kept in memory and override the
+    contents of the file (copy-on-write). The file is rewritten by L{save}, e.g. on closing."""
+
+    # the file in SESSION_DIR
+    FILE = "packages.map"
+
+    # a search expression not containing any of these is a plain substring
+    REGEX_CHARS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+    # number of packages found by a search between looking whether it has been cancelled
+    CANCEL_INTERVAL = 512
+
+    lock = Database.lock
+    shared = Database.shared
+
+    def __init__ (self, session, background = False):
+        """Constructor.
+
+        @param background: do not fetch the changed categories, but leave this to L{populate_background}
+        @type background: boolean"""
+        Database.__init__(self)
+        self.session = session
+        self.path = os.path.join(SESSION_DIR, self.FILE)
+
+        self.__initialize()
+
+        try:
+            self._store = MappedStore(self.path)
+        except (IOError, OSError, ValueError) as e:
+            debug("Cannot use the package file '%s': %s", self.path, e)
+
+        if self._store is None:
+            if background:
+                self._pending = system.list_categories()
+            else:
+                self.populate()
+        else:
+            fingerprints = self.category_fingerprints()
+            old = self._store.fingerprints
+            changed = sorted(cat for cat in set(old) | set(fingerprints) if old.get(cat) != fingerprints.get(cat))
+
+            if not changed:
+                debug("No category has been changed.")
+            elif background:
+                self._pending = changed
+            else:
+                info(_("Reloading %d changed categories..."), len(changed))
+                self.reload_many(changed)
+                self.save()
+
+    def search_types(self):
+        return Database.SEARCH_NAME
+
+    def __initialize (self):
+        self._store = None
+        self._changed = {} # cat -> packages as (key, pkg, installed) sorted by key -- overriding the store
+        self._fingerprints = {} # cat -> fingerprint of the changed categories
+        self._disabled = {} # cp -> installed
+        self._restrict = None
+        # the last computed L{Search} for the current restriction and the one computed by prepare_search
+        # -- only replaced as a whole, as they are computed under the shared lock
+        self._search = None
+        self._prepared = None
+
+    def __fetch (self, expr):
+        """Fetches the packages from portage.
+
+        @param expr: the packages to fetch (see L{generate_cats_expr}) - None for all
+        @type expr: string
+        @returns: cat -> packages as (key, pkg, installed) sorted by key
+        @rtype: dict"""
+
+        packages = system.find_packages(expr, with_version = False)
+        installed = set(system.find_packages(expr, system.SET_INSTALLED, with_version = False))
+
+        return self.__group((p.split("/") + [p in installed]) for p in packages)
+
+    def __group (self, packages):
+        """Groups the packages given as (cat, pkg, installed) by category.
+
+        @returns: cat -> packages as (key, pkg, installed) sorted by key
+        @rtype: dict"""
+
+        cats = defaultdict(list)
+        for cat, pkg, inst in packages:
+            cats[cat].append((pkg.lower(), pkg, inst))
+
+        for pkgs in cats.itervalues():
+            pkgs.sort()
+
+        return cats
+
+    @lock
+    def populate (self, category = None):
+        if category is not None:
+            cats = self.__fetch(category)
+            self._changed.update(cats)
+            self._fingerprints.update(self.category_fingerprints(cats.keys()))
+        else:
+            fingerprints = self.category_fingerprints() # before fetching: later changes are found next time
+            self.__write_all(self.__fetch(None), fingerprints)
+
+        self._search = self._prepared = None
+
+    def __write_all (self, cats, fingerprints):
+        """Replaces the file by one containing the given packages only.
+
+        @param cats: the packages as returned by L{__group}
+        @type cats: dict
+        @param fingerprints: the fingerprints of the categories
+        @type fingerprints: dict"""
+
+        packages = [(cat, pkg, inst) for cat, pkgs in cats.iteritems() for key, pkg, inst in pkgs]
+
+        try:
+            MappedStore.write(self.path, packages, fingerprints)
+            store = MappedStore(self.path)
+        except (IOError, OSError, ValueError) as e:
+            info(_("Cannot write the package file: %s"), e)
+            # keep everything in memory
+            self.__replace_store(None)
+            self._changed = cats
+            self._fingerprints = fingerprints
+        else:
+            self.__replace_store(store)
+
+    @lock
+    def replace_packages (self, packages):
+        fingerprints = self.category_fingerprints()
+
+        self.invalidate_cache()
+        self._disabled = {}
+        self.__write_all(self.__group(packages), fingerprints)
+        self._search = self._prepared = None
+
+    def __replace_store (self, store):
+        if self._store is not None:
+            self._store.close()
+
+        self._store = store
+        self._changed = {}
+        self._fingerprints = {}
+
+    @lock
+    def save (self):
+        """Writes the changed categories into the file - if there are any."""
+        if not self._changed and self._store is not None:
+            return
+
+        packages = []
+        fingerprints = {}
+        store = self._store
+
+        if store is not None:
+            for cat in store.categories:
+                if cat not in self._changed:
+                    packages.extend(store.get(id) for id in xrange(*store.category_range(cat)))
+
+            fingerprints.update((cat, fp) for cat, fp in store.fingerprints.iteritems() if cat not in self._changed)
+
+        for cat, pkgs in self._changed.iteritems():
+            packages.extend((cat, pkg, inst) for key, pkg, inst in pkgs)
+
+        fingerprints.update(self._fingerprints)
+
+        try:
+            MappedStore.write(self.path, packages, fingerprints)
+            store = MappedStore(self.path)
+        except (IOError, OSError, ValueError) as e:
+            info(_("Cannot write the package file: %s"), e)
+        else:
+            self.__replace_store(store)
+            debug("Wrote %d packages into the package file.", len(packages))
+
+    def populate_finished (self):
+        self.save()
+
+    def close (self):
+        if isinstance(self._store, ClosedStore):
+            return
+
+        Database.close(self)
+        self.save()
+        if self._store is not None:
+            self._store.close()
+        self._store = ClosedStore()
+
+    #
+    # access to the packages -- all as (cat, pkg, installed)
+    #
+
+    def __categories (self):
+        cats = set(cat for cat, pkgs in self._changed.iteritems() if pkgs)
+        if self._store is not None:
+            cats.update(cat for cat in self._store.categories if cat not in self._changed)
+        return cats
+
+    def __packages (self, cat):
+        """Returns the packages of the category sorted by name."""
+        if cat in self._changed:
+            return [(cat, pkg, inst) for key, pkg, inst in self._changed[cat]]
+        elif self._store is not None:
+            r = self._store.category_range(cat)
+            if r is not None:
+                return map(self._store.get, xrange(*r))
+
+        return []
+
+    def __all (self):
+        """Returns all packages sorted by name."""
+        store = self._store
+        changed = self._changed
+
+        if store is not None:
+            get = store.get
+            cats = store.categories
+            cat_of = store.cat_of
+            stored = (get(id) for id in store.by_name if cats[cat_of[id]] not in changed)
+        else:
+            stored = ()
+
+        if not changed:
+            return list(stored)
+
+        # merge the changed categories in
+        stored = ((pkg.lower(), cat, pkg, inst) for cat, pkg, inst in stored)
+        others = sorted((key, cat, pkg, inst) for cat, pkgs in changed.iteritems() for key, pkg, inst in pkgs)
+        return [(cat, pkg, inst) for key, cat, pkg, inst in heapq.merge(stored, others)]
+
+    def __counts (self, cat):
+        """Returns the total number and the number of installed packages of the category."""
+        if cat in self._changed:
+            pkgs = self._changed[cat]
+            return (len(pkgs), sum(1 for key, pkg, inst in pkgs if inst))
+        elif self._store is not None:
+            r = self._store.category_range(cat)
+            if r is not None:
+                return (int(r[1] - r[0]), int(self._store.installed(cat)))
+
+        return (0, 0)
+
+    def __disabled_counts (self):
+        """Returns the number of disabled and disabled installed packages per category."""
+        counts = defaultdict(lambda: [0, 0])
+        for cp, inst in self._disabled.iteritems():
+            c = counts[cp.split("/", 1)[0]]
+            c[0] += 1
+            if inst: c[1] += 1
+
+        return counts
+
+    def __get_search (self, restrict = None, cancelled = None, prepare = False):
+        """Returns the packages matching the restriction.
+        The result is computed once per restriction: the names in the store are searched at once and
+        the changed categories one after the other. If a plain substring extends the one of the last
+        computed result, only the packages in this result are checked.
+
+        Several readers might compute the result at the same time: each one works on its own objects and
+        publishes the finished result in a single assignment.
+
+        @param restrict: the restriction - the current one if None
+        @type restrict: compiled regex
+        @param cancelled: checked regularly - if it returns True, the computation is aborted
+        @type cancelled: function
+        @param prepare: keep the result as the prepared one, instead of the one of the current restriction
+        @type prepare: boolean
+        @returns: the result or None if cancelled
+        @rtype: L{Search}"""
+
+        if restrict is None:
+            restrict = self._restrict
+
+        # compare the patterns, as the restriction is compiled again, when the prepared one is set
+        searches = [search for search in (self._search, self._prepared) if search is not None]
+        for search in searches:
+            if search.restrict.pattern == restrict.pattern:
+                if not prepare and search is not self._search:
+                    self._search = search
+                return search
+
+        query = restrict.pattern
+        last = None # the result to narrow down -- the one of the longest substring
+        if not self.REGEX_CHARS.search(query):
+            for search in searches:
+                pattern = search.restrict.pattern
+                if not self.REGEX_CHARS.search(pattern) and pattern.lower() in query.lower() \
+                        and (last is None or len(pattern) > len(last.restrict.pattern)):
+                    last = search
+
+        if last is not None:
+            found = [p for p in last.matches.get(self.ALL, []) if restrict.search("%s/%s" % p[:2])]
+        else:
+            found = []
+            store = self._store
+            if store is not None:
+                ids = store.search(self.__compile_names(restrict.pattern), restrict, cancelled, self.CANCEL_INTERVAL)
+                if ids is None:
+                    return None
+
+                found.extend(p for p in map(store.get, ids) if p[0] not in self._changed)
+
+            for cat, pkgs in self._changed.iteritems():
+                if cancelled is not None and cancelled():
+                    return None
+
+                found.extend((cat, pkg, inst) for key, pkg, inst in pkgs if restrict.search("%s/%s" % (cat, pkg)))
+
+            found.sort(key = lambda p: (p[1].lower(), p[0]))
+
+        matches = defaultdict(list)
+        counts = defaultdict(lambda: [0, 0]) # cat -> [matching, matching and installed] - without the disabled ones
+        for p in found:
+            cat, pkg, inst = p
+            matches[cat].append(p)
+
+            if "%s/%s" % (cat, pkg) not in self._disabled:
+                c = counts[cat]
+                c[0] += 1
+                if inst: c[1] += 1
+
+        for pkgs in matches.itervalues():
+            pkgs.sort(key = lambda p: p[1].lower())
+
+        matches[self.ALL] = found
+
+        search = Search(restrict, dict(matches), dict(counts))
+        if prepare:
+            self._prepared = search
+        else:
+            self._search = search
+
+        return search
+
+    def __get_match_counts (self):
+        return self.__get_search().counts
+
+    def prepare_search (self, restrict, cancelled = None):
+        if not restrict:
+            return True
+
+        try:
+            regex = re.compile(restrict, re.I)
+        except re.error: # reported, when the restriction is set
+            return True
+
+        return self.__prepare_search(regex, cancelled)
+
+    @shared
+    def __prepare_search (self, regex, cancelled):
+        return self.__get_search(regex, cancelled, prepare = True) is not None
+
+    def __select (self, cat, byName, showDisabled, installed = False):
+        """Returns the packages in the category in the order of L{get_cat}."""
+        if not cat:
+            cat = self.ALL
+
+        if self.restrict:
+            pkgs = self.__get_search().matches.get(cat, [])
+        elif cat == self.ALL:
+            pkgs = self.__all()
+        else:
+            pkgs = self.__packages(cat)
+
+        disabled = self._disabled
+        if not showDisabled and disabled:
+            pkgs = [p for p in pkgs if "%s/%s" % p[:2] not in disabled]
+
+        if installed:
+            pkgs = [p for p in pkgs if p[2]]
+        elif not byName:
+            pkgs = [p for p in pkgs if p[2]] + [p for p in pkgs if not p[2]]
+
+        return pkgs
+
+    def __pkg_data (self, pkgs):
+        disabled = self._disabled
+        return [PkgData(cat, pkg, inst, "%s/%s" % (cat, pkg) in disabled) for cat, pkg, inst in pkgs]
+
+    @shared
+    @Database.cached
+    def get_cat (self, cat = None, byName = True, showDisabled = False):
+        return iter(self.__pkg_data(self.__select(cat, byName, showDisabled)))
+
+    @shared
+    @Database.cached
+    def get_cat_range (self, cat = None, offset = 0, limit = None, byName = True, showDisabled = False, installed = False):
+        if not cat:
+            cat = self.ALL
+
+        store = self._store
+        stop = None if limit is None else offset + limit
+
+        # the packages in the store can be taken from it directly, if no filter is needed
+        if store is not None and byName and not installed and not self.restrict and (showDisabled or not self._disabled):
+            if cat == self.ALL and not self._changed:
+                return iter(self.__pkg_data(map(store.get, store.by_name[offset:stop])))
+
+            r = store.category_range(cat) if cat not in self._changed else None
+            if r is not None:
+                first, last = r
+                last = last if stop is None else min(last, first + stop)
+                return iter(self.__pkg_data(map(store.get, xrange(first + offset, last))))
+
+        return iter(self.__pkg_data(self.__select(cat, byName, showDisabled, installed)[offset:stop]))
+
+    @shared
+    def count_cat (self, cat = None, showDisabled = False, installed = False):
+        if not cat:
+            cat = self.ALL
+
+        if self.restrict and not showDisabled:
+            counts = self.__get_match_counts()
+            if cat == self.ALL:
+                m, minst = map(sum, zip(*counts.values())) or (0, 0)
+            else:
+                m, minst = counts.get(cat, (0, 0))
+
+            return minst if installed else m
+        elif self.restrict:
+            return len(self.__select(cat, True, True, installed))
+
+        if cat == self.ALL:
+            cats = self.__categories()
+        else:
+            cats = [cat]
+
+        disabled = self.__disabled_counts()
+        count = 0
+        for c in cats:
+            total, inst = self.__counts(c)
+            dis, dis_inst = disabled.get(c, (0, 0)) if not showDisabled else (0, 0)
+            count += inst - dis_inst if installed else total - dis
+
+        return count
+
+    @shared
+    def get_category_stats (self):
+        stats = {}
+        sums = [0] * 5
+        disabled = self.__disabled_counts()
+
+        if self.restrict:
+            matching = self.__get_match_counts()
+
+        for cat in self.__categories():
+            total, inst = self.__counts(cat)
+            dis, dis_inst = disabled.get(cat, (0, 0))
+
+            if self.restrict:
+                m, minst = matching.get(cat, (0, 0))
+            else:
+                m, minst = total - dis, inst - dis_inst
+
+            s = stats[cat] = CategoryStats(total, inst, dis, m, minst)
+            sums = map(sum, zip(sums, s))
+
+        stats[self.ALL] = CategoryStats(*sums)
+        return stats
+
+    @shared
+    @Database.cached
+    def get_categories (self, installed = False):
+        if self.restrict:
+            idx = 1 if installed else 0
+            cats = [cat for cat, counts in self.__get_match_counts().iteritems() if counts[idx]]
+        else:
+            disabled = self.__disabled_counts()
+            cats = []
+            for cat in self.__categories():
+                total, inst = self.__counts(cat)
+                dis, dis_inst = disabled.get(cat, (0, 0))
+
+                if (inst - dis_inst if installed else total - dis) > 0:
+                    cats.append(cat)
+
+        cats.sort()
+        if len(cats) > 1:
+            cats.insert(0, self.ALL)
+
+        return iter(cats)
+
+    @lock
+    def reload (self, cat = None):
+        if cat:
+            self.reload_many([cat])
+        else:
+            watched = self.watch_changes()
+            self.invalidate_cache()
+            self.__initialize()
+            self.populate()
+            self.notify_changes(watched)
+
+    @lock
+    def reload_many (self, categories):
+        categories = list(set(categories))
+        if not categories: return
+
+        watched = self.watch_changes(categories)
+
+        # before fetching: later changes are found next time
+        # removed categories get no fingerprint, so they are not regarded as changed again
+        known = set(system.list_categories())
+        fingerprints = self.category_fingerprints([cat for cat in categories if cat in known])
+        cats = self.__fetch(self.generate_cats_expr(categories))
+
+        for cat in categories:
+            self._changed[cat] = cats.get(cat, [])
+            if cat in fingerprints:
+                self._fingerprints[cat] = fingerprints[cat]
+            else:
+                self._fingerprints.pop(cat, None)
+            self.invalidate_cache(cat)
+
+        # the packages are new
+        prefixes = tuple(cat+"/" for cat in categories)
+        for cp in [cp for cp in self._disabled if cp.startswith(prefixes)]:
+            del self._disabled[cp]
+
+        self._search = self._prepared = None
+        self.notify_changes(watched)
+
+    @shared
+    def get_installed_flags (self, categories = None):
+        if categories is None:
+            categories = self.__categories()
+
+        flags = {}
+        for cat in categories:
+            for c, pkg, inst in self.__packages(cat):
+                cp = "%s/%s" % (c, pkg)
+                if cp not in self._disabled:
+                    flags[cp] = inst
+
+        return flags
+
+    @lock
+    def disable (self, cpv):
+        cat, pkg = cpv.split("/", 1)
+
+        if cat in self._changed:
+            pkgs = self._changed[cat]
+            key = pkg.lower()
+            i = bisect_left(pkgs, (key,))
+            while i < len(pkgs) and pkgs[i][0] == key and pkgs[i][1] != pkg:
+                i += 1
+            found = pkgs[i] if i < len(pkgs) and pkgs[i][1] == pkg else None
+            inst = found is not None and found[2]
+        else:
+            id = self._store.find(cat, pkg) if self._store is not None else None
+            found = id
+            inst = id is not None and bool(self._store.inst[id])
+
+        if found is None:
+            raise ValueError("%s is not in the database" % cpv)
+
+        if cpv in self._disabled:
+            return
+
+        self._disabled[cpv] = inst
+
+        # keep the counters of the current search up to date -- a prepared one is computed again
+        search = self._search
+        if search is not None and search.restrict.search(cpv):
+            counts = search.counts.get(cat)
+            if counts is not None:
+                counts[0] -= 1
+                if inst: counts[1] -= 1
+
+        if self._prepared is not search:
+            self._prepared = None
+
+        self.invalidate_cache(cat)
+        self.notify(self.PACKAGE_DISABLED, PkgData(cat, pkg, inst, True))
+
+        if self._listeners:
+            total = self.__counts(cat)[0]
+            if total == self.__disabled_counts()[cat][0]:
+                self.notify(self.CATEGORY_REMOVED, cat)
+
+    def get_restrict (self):
+        return self._restrict
+
+    def restrict_key (self):
+        return self._restrict.pattern if self._restrict else None
+
+    @lock
+    def set_restrict (self, restrict):
+        if not restrict:
+            self._restrict = None
+        else:
+            try:
+                regex = re.compile(restrict, re.I)
+            except re.error as e:
+                info(_("Error while compiling search expression: '%s'."), str(e))
+            else: # only set self._restrict if no error occurred
+                self._restrict = regex
+
+        self.invalidate_searches()
+
+    def __compile_names (self, restrict):
+        """Compiles the restriction to run over all names in the store at once.
+        Derived from the restriction each time - re caches the compiled expressions."""
+        if "\\A" in restrict or "\\Z" in restrict: # only match at the start / end of all names
+            return re.compile(".+", re.M)
+        else:
+            return re.compile(restrict, re.I | re.M)
+
+    restrict = property(get_restrict, set_restrict)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# File: portato/db/search.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+
+
+import time
+from threading import Thread, Condition
+
+from ..helper import debug, error
+
+class SearchSession (object):
+    """An incremental search on a database, e.g. while the user is typing the search expression.
+
+    The search is run in a separate thread, once the expression has not been changed for C{delay} seconds.
+    A search outdated by a newer expression is cancelled. The database computes the results in advance
+    and narrows down the last ones if possible (see L{Database.prepare_search<database.Database.prepare_search>}).
+
+    Only the hash and the mapped database do so. The SQL databases cannot query without setting the
+    restriction, so for them the session only delays the search until the user stopped typing: the query
+    is run, when the callback sets the restriction - each time over all packages."""
+
+    def __init__ (self, db, callback, delay = 0.2, threadClass = Thread):
+        """Constructor.
+
+        @param db: the database to search in
+        @type db: L{database.Database}
+        @param callback: called (in the search thread) with the expression, after its results are ready -
+                         the restriction of the database is not changed, this is left to the callback
+        @type callback: function
+        @param delay: seconds to wait for further changes before starting the search
+        @type delay: float
+        @param threadClass: the class of the search thread
+        @type threadClass: Thread"""
+
+        self.db = db
+        self.callback = callback
+        self.delay = delay
+
+        self._cond = Condition()
+        self._text = None
+        self._changed = 0 # time of the last change
+        self._generation = 0 # increased on each change
+        self._closed = False
+
+        self._thread = threadClass(name = "Search-Thread", target = self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def search (self, text):
+        """Requests a search for the given expression. Any search for an older expression is dropped.
+
+        @param text: the search expression - empty to remove the restriction
+        @type text: string"""
+
+        with self._cond:
+            self._text = text
+            self._changed = time.time()
+            self._generation += 1
+            self._cond.notify()
+
+    def close (self):
+        """Stops the search thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _outdated (self, generation):
+        return self._closed or self._generation != generation
+
+    def _run (self):
+        done = 0 # the generation handled last
+
+        while True:
+            with self._cond:
+                while not self._closed and self._generation == done:
+                    self._cond.wait()
+
+                # wait until the user stopped typing
+                while not self._closed:
+                    remaining = self._changed + self.delay - time.time()
+                    if remaining <= 0: break
+                    self._cond.wait(remaining)
+
+                if self._closed:
+                    return
+
+                generation = self._generation
+                text = self._text
+
+            done = generation
+            try:
+                finished = self.db.prepare_search(text, lambda: self._outdated(generation))
+            except Exception as e:
+                error(_("Error while searching for '%s': %s"), text, e)
+                continue
+
+            if not finished or self._outdated(generation):
+                debug("Search for '%s' has been cancelled.", text)
+            else:
+                self.callback(text)
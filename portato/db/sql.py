@@ -22,30 +22,325 @@ except ImportError:
 
 import hashlib
 import os
+import struct
+import sys
+import time
+import weakref
 
 from functools import wraps
+from collections import defaultdict
+from threading import Thread, local, Lock, Condition, current_thread
+from Queue import Queue, Empty
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 from ..constants import SESSION_DIR
 from ..helper import info, error, debug
 from ..backend import system
-from .database import Database, PkgData
+from .database import Database, PkgData, VersionData, CategoryStats
+
+MANIFEST_MAGIC = "PMF\x01"
+
+def read_manifest (path):
+    """
+    Reads a manifest written by L{write_manifest}.
+
+    @param path: the file to read
+    @type path: string
+    @returns: the stored mapping or None if the file does not exist or is not a manifest
+    @rtype: dict
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except IOError:
+        return None
+
+    if not data.startswith(MANIFEST_MAGIC):
+        return None
+
+    try:
+        pos = len(MANIFEST_MAGIC)
+        (n,) = struct.unpack_from("!I", data, pos)
+        pos += 4
+
+        manifest = {}
+        for i in xrange(n):
+            klen, vlen = struct.unpack_from("!HB", data, pos)
+            pos += 3
+            key = data[pos:pos+klen].decode("utf-8")
+            pos += klen
+            manifest[key] = data[pos:pos+vlen]
+            pos += vlen
+    except struct.error:
+        debug("Manifest '%s' is truncated.", path)
+        return None
+
+    return manifest
+
+def write_manifest (path, manifest):
+    """
+    Writes a mapping of names to digests into a compact binary file.
+
+    @param path: the file to write
+    @type path: string
+    @param manifest: name -> digest
+    @type manifest: dict
+    """
+    parts = [MANIFEST_MAGIC, struct.pack("!I", len(manifest))]
+    for key, value in manifest.iteritems():
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        parts.append(struct.pack("!HB", len(key), len(value)))
+        parts.append(key)
+        parts.append(value)
+
+    with open(path, "wb") as f:
+        f.write("".join(parts))
+
+def subdirectories (path, forbidden = ()):
+    """
+    Returns the names of all subdirectories of the path -- not following symlinks.
+
+    @param path: the directory
+    @type path: string
+    @param forbidden: names to skip
+    @type forbidden: string[]
+    @rtype: string<iterator>
+    """
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.name not in forbidden and entry.is_dir(follow_symlinks = False):
+                yield entry.path
+    else:
+        for name in os.listdir(path):
+            p = os.path.join(path, name)
+            if name not in forbidden and os.path.isdir(p) and not os.path.islink(p):
+                yield p
+
+def fetch_batched (cursor, size):
+    """
+    Iterates over the rows of a cursor, fetching them in batches. The cursor is closed afterwards.
+
+    @param cursor: the cursor
+    @type cursor: sqlite3.Cursor
+    @param size: number of rows per batch
+    @type size: int
+    @returns: the rows
+    @rtype: tuple<iterator>
+    """
+    try:
+        rows = cursor.fetchmany(size)
+        while rows:
+            for row in rows:
+                yield row
+            rows = cursor.fetchmany(size)
+    finally:
+        cursor.close()
+
+def generate_batched (rows, size, threadClass = Thread):
+    """
+    Generates the rows in a separate thread and returns them in batches.
+    So the next batch is generated, while the caller processes the current one.
+    Exceptions raised by the generator are passed on to the caller.
+
+    @param rows: the rows -- usually a generator
+    @type rows: iterable
+    @param size: number of rows per batch
+    @type size: int
+    @param threadClass: the class of the generating thread
+    @type threadClass: Thread
+    @returns: the batches
+    @rtype: list<iterator>
+    """
+    queue = Queue(2) # do not generate too far ahead
+    stopped = []
+
+    def generate ():
+        try:
+            batch = []
+            for row in rows:
+                if stopped: return
+
+                batch.append(row)
+                if len(batch) >= size:
+                    queue.put((batch, None))
+                    batch = []
+
+            queue.put((batch, None))
+            queue.put((None, None))
+        except:
+            queue.put((None, sys.exc_info()))
+
+    thread = threadClass(name = "Database-Generator-Thread", target = generate)
+    thread.setDaemon(True)
+    thread.start()
+
+    finished = False # the thread has put its last item
+    try:
+        while True:
+            batch, exc = queue.get()
+            if exc is not None:
+                finished = True
+                raise exc[0], exc[1], exc[2]
+            elif batch is None:
+                finished = True
+                break
+            elif batch:
+                yield batch
+    finally:
+        if finished:
+            thread.join()
+        else:
+            # the caller has stopped early -- do not leave the thread blocked on the queue
+            stopped.append(True)
+            while thread.isAlive():
+                try:
+                    queue.get_nowait()
+                except Empty:
+                    thread.join(0.01)
+
+def connected (f):
+    """
+    Decorator passing the connection of the current thread as C{connection} - if none is given.
+    """
+    @wraps(f)
+    def wrapper (self, *args, **kwargs):
+        if not "connection" in kwargs:
+            kwargs["connection"] = self.connections.get()
+
+        return f(self, *args, **kwargs)
+    
+    return wrapper
+
+class ConnectionManager (object):
+    """
+    Keeps one connection to the database file per thread.
+    The connections are opened on first use in a thread. The ones of finished threads are closed,
+    when the next connection is opened - all others, when L{close} is called.
+    """
+
+    STATEMENT_CACHE = 128
+
+    def __init__ (self, path):
+        """
+        Constructor.
+
+        @param path: path to the database file
+        @type path: string
+        """
+        self.path = path
+        self._local = local()
+        self._connections = [] # (weakref to the thread, connection)
+        self._lock = Lock()
+
+    def get (self):
+        """
+        Returns the connection of the current thread.
+
+        @rtype: sqlite3.Connection
+        """
+        con = getattr(self._local, "connection", None)
+
+        if con is None:
+            thread = current_thread()
+            debug("Opening database connection for thread '%s'.", thread.name)
+
+            # a connection is only used by the thread which opened it,
+            # but all of them are closed by the thread shutting down
+            con = sql.connect(self.path, check_same_thread = False, cached_statements = self.STATEMENT_CACHE)
+
+            # readers and the writer do not block each other -- and in this mode, syncing less often is safe
+            try:
+                con.execute("PRAGMA journal_mode = WAL")
+            except sql.OperationalError as e: # stays in the default mode
+                debug("Cannot switch to WAL mode: %s", e)
+            con.execute("PRAGMA synchronous = NORMAL")
+
+            self._local.connection = con
+
+            with self._lock:
+                self.__close_finished()
+                self._connections.append((weakref.ref(thread), con))
+
+        return con
+
+    def __close_finished (self):
+        """
+        Closes the connections of the threads, which have finished. Must be called with the lock held.
+        """
+        connections = []
+        for ref, con in self._connections:
+            thread = ref()
+            if thread is None or not thread.is_alive():
+                con.close()
+            else:
+                connections.append((ref, con))
+
+        if len(connections) < len(self._connections):
+            debug("Closed %d database connection(s) of finished threads.", len(self._connections) - len(connections))
+            self._connections = connections
+
+    def close (self):
+        """
+        Closes all connections.
+        """
+        with self._lock:
+            for ref, con in self._connections:
+                con.close()
+
+            debug("Closed %d database connection(s).", len(self._connections))
+            self._connections = []
+            self._local = local()
 
 class SQLDatabase (Database):
     
-    FORMAT = "2"
+    FORMAT = "3"
     FORBIDDEN = (".bzr", ".svn", ".git", "CVS", ".hg", "_darcs")
+    FETCH_SIZE = 256
+    BULK_SIZE = 1024 # rows per insert when populating
+    HASH_THREADS = 4
     lock = Database.lock
 
-    def __init__ (self, session):
-        """Constructor."""
+    # the packages together with the names of their categories
+    PACKAGES = "packages JOIN categories ON categories.id = packages.cat_id"
+
+    # the columns making up a L{PkgData}
+    PKG_COLUMNS = "categories.name, packages.name, inst, packages.disabled"
+
+    # the id of the category given as parameter
+    CAT_ID = "(SELECT id FROM categories WHERE name = ?)"
+
+    # name and definition of the indices -- they are dropped while populating
+    INDICES = (
+            # covering get_cat for a single category and the counting of the packages per category
+            ("packages_cat_name", "packages (cat_id, disabled, name, inst)"),
+            # covering the pages of all packages in both orders -- and of the installed ones
+            ("packages_name", "packages (disabled, name, inst, cat_id)"),
+            ("packages_inst_name", "packages (disabled, inst DESC, name, cat_id)"),
+        )
+
+    def __init__ (self, session, background = False):
+        """Constructor.
+
+        @param background: do not (re)populate, but leave this to L{populate_background}
+        @type background: boolean"""
         Database.__init__(self)
 
-        self._restrict = ""
+        self._restrict = None
         self.session = session
         
         updateFormat = False
-        if "format" not in session or session["format"] != self.FORMAT:
-            debug("Need to update database format from '%s' to '%s'", session.get("format", "undefined"), self.FORMAT)
+        oldFormat = session.get("format")
+        if oldFormat != self.FORMAT:
+            debug("Need to update database format from '%s' to '%s'", oldFormat or "undefined", self.FORMAT)
             session["format"] = self.FORMAT
             updateFormat = True
 
@@ -57,117 +352,508 @@ class SQLDatabase (Database):
         else:
             debug("package.db not existant")
 
-        pkg_conn = sql.connect(pkgdb)
-        pkg_conn.row_factory = sql.Row
+        self.connections = ConnectionManager(pkgdb)
+        pkg_conn = self.connections.get()
+
+        keepMigrated = False
         if pkgdb_existed and updateFormat:
-            debug("Dropping old table")
-            pkg_conn.execute("DROP TABLE packages")
+            if self.migrate(oldFormat, pkg_conn):
+                updateFormat = False
+                # the migrated packages can only be kept, if the tree has not changed since they were stored
+                keepMigrated = not self.updated_since_migration()
+
+        self.create_tables(pkg_conn)
+        pkg_conn.commit()
+
+        needsPopulate = session.get("populated", "1") != "1"
+        if needsPopulate:
+            debug("Loading the database in the background has not been finished last time")
+        
+        self.was_updated = self.updated()
+        if keepMigrated and not needsPopulate:
+            debug("The migrated packages are up to date.")
+            if not self.has_versions(pkg_conn):
+                info(_("Reading the versions of the packages..."))
+                self.insert_versions(None, pkg_conn)
+                pkg_conn.commit()
+
+            # from now on, the changed categories can be repopulated
+            self.save_fingerprints(self.category_fingerprints())
+
+        elif self.was_updated or not pkgdb_existed or updateFormat or needsPopulate:
+            fingerprints = self.category_fingerprints()
+            changed = self.changed_categories(fingerprints)
+
+            if changed is None or not pkgdb_existed or updateFormat or needsPopulate:
+                info(_("Cleaning database..."))
+                self.delete_packages(None, pkg_conn) # empty db at beginning
+                pkg_conn.commit()
+                if background:
+                    self._pending = system.list_categories()
+                else:
+                    info(_("Populating database..."))
+                    self.populate(connection = pkg_conn)
+            elif changed:
+                if background:
+                    self._pending = sorted(changed)
+                else:
+                    info(_("Repopulating %d changed categories..."), len(changed))
+                    self.repopulate(changed, pkg_conn)
+            else:
+                debug("No category has been changed.")
+
+            if self._pending:
+                # the fingerprints are only valid after all categories have been loaded
+                self._fingerprints = fingerprints
+                session["populated"] = "0"
+            else:
+                self.save_fingerprints(fingerprints)
+
+    def populate_finished (self):
+        self.save_fingerprints(self._fingerprints)
+        self.session["populated"] = "1"
+
+    def create_tables (self, connection):
+        """
+        Creates the tables needed by the database, if they do not exist yet.
+
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        """
+
+        # the counters of the packages are kept up to date on each change
+        connection.execute("""
+        CREATE TABLE IF NOT EXISTS categories
+        (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL,
+            total INTEGER DEFAULT 0,
+            installed INTEGER DEFAULT 0,
+            disabled INTEGER DEFAULT 0,
+            disabled_installed INTEGER DEFAULT 0
+        )""")
 
-        pkg_conn.execute("""
+        # the id is given explicitly, so it is kept on VACUUM (the full text index refers to it)
+        connection.execute("""
         CREATE TABLE IF NOT EXISTS packages
         (
-            name TEXT,
-            cat TEXT,
+            id INTEGER PRIMARY KEY,
+            cat_id INTEGER NOT NULL REFERENCES categories (id),
+            name TEXT NOT NULL,
             descr TEXT DEFAULT "",
             inst INTEGER,
             disabled INTEGER
         )""")
 
-        pkg_conn.commit()
-        
-        self.was_updated = self.updated()
-        if self.was_updated or not pkgdb_existed or updateFormat:
-            info(_("Cleaning database..."))
-            pkg_conn.execute("DELETE FROM packages") # empty db at beginning
-            info(_("Populating database..."))
-            self.populate(connection = pkg_conn)
-            
-        pkg_conn.close()
+        self.create_indices(connection)
 
-    def search_types(self):
-        return self.SEARCH_NAME
+        # stored sorted by package -- the versions of a package are read at once
+        connection.execute("""
+        CREATE TABLE IF NOT EXISTS versions
+        (
+            cat_id INTEGER NOT NULL REFERENCES categories (id),
+            name TEXT NOT NULL,
+            version TEXT,
+            pos INTEGER NOT NULL,
+            slot TEXT,
+            keywords TEXT,
+            iuse TEXT,
+            overlay TEXT,
+            masked INTEGER,
+            inst INTEGER,
+            PRIMARY KEY (cat_id, name, pos)
+        ) WITHOUT ROWID""")
 
-    def updated (self):
-        changed = False
+    def create_indices (self, connection):
+        """
+        Creates the indices listed in L{INDICES}, if they do not exist yet.
+
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        """
+        for name, definition in self.INDICES:
+            connection.execute("CREATE INDEX IF NOT EXISTS %s ON %s" % (name, definition))
+
+    def begin_bulk_load (self, connection, full = False):
+        """
+        Prepares the database for inserting lots of packages: the changes are not synced to disk
+        and, if the whole database is populated, the indices are dropped. Commits any pending changes.
+        Call L{end_bulk_load} afterwards.
+
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        @param full: whether the whole (empty) database is populated
+        @type full: boolean
+        """
+        connection.commit()
+        connection.execute("PRAGMA synchronous = OFF")
+
+        if full:
+            for name, definition in self.INDICES:
+                connection.execute("DROP INDEX IF EXISTS %s" % name)
+
+    def end_bulk_load (self, connection, full = False):
+        """
+        Restores the normal operation after L{begin_bulk_load}. Commits any pending changes.
+
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        @param full: the value given to L{begin_bulk_load}
+        @type full: boolean
+        """
+        if full:
+            self.create_indices(connection)
+
+        connection.commit()
+        connection.execute("PRAGMA synchronous = NORMAL")
+
+    def migrate (self, old, connection):
+        """
+        Converts the tables of an older format into the current one. If this is not possible, the tables are dropped.
+        Format 2 only has the C{packages(name, cat, descr, inst, disabled)} table - the versions are not stored
+        then and have to be inserted afterwards (see L{has_versions}).
+
+        @param old: the format of the existing tables
+        @type old: string
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        @returns: whether the packages could be kept
+        @rtype: boolean
+        """
+
+        c = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = set(row[0] for row in c.fetchall())
+        c.close()
+
+        columns = set()
+        if "packages" in tables:
+            c = connection.execute("PRAGMA table_info(packages)")
+            columns = set(row[1] for row in c.fetchall())
+            c.close()
+
+        if old != "2" or not set(["name", "cat", "descr", "inst", "disabled"]) <= columns:
+            debug("Dropping old tables")
+            self.drop_tables(connection)
+            return False
+
+        # development versions of format 2 also stored the versions
+        versions = "versions" in tables
+
+        info(_("Migrating database from format '%s' to '%s'..."), old, self.FORMAT)
+        try:
+            # free the names of the tables and indices
+            connection.execute("ALTER TABLE packages RENAME TO packages_old")
+            if versions:
+                connection.execute("ALTER TABLE versions RENAME TO versions_old")
+                connection.execute("DROP INDEX IF EXISTS versions_cp") # not needed anymore
+            connection.execute("DROP TABLE IF EXISTS category_stats")
+            self.drop_fts(connection) # refers to the old ids
+
+            SQLDatabase.create_tables(self, connection)
+
+            if versions:
+                connection.execute("INSERT INTO categories (name) SELECT DISTINCT cat FROM packages_old UNION SELECT DISTINCT cat FROM versions_old")
+            else:
+                connection.execute("INSERT INTO categories (name) SELECT DISTINCT cat FROM packages_old")
+
+            connection.execute("""
+                INSERT INTO packages (cat_id, name, descr, inst, disabled)
+                SELECT categories.id, packages_old.name, descr, inst, packages_old.disabled
+                FROM packages_old JOIN categories ON categories.name = packages_old.cat""")
+
+            if versions:
+                connection.execute("""
+                    INSERT INTO versions (cat_id, name, version, pos, slot, keywords, iuse, overlay, masked, inst)
+                    SELECT categories.id, versions_old.name, version, pos, slot, keywords, iuse, overlay, masked, inst
+                    FROM versions_old JOIN categories ON categories.name = versions_old.cat""")
+                connection.execute("DROP TABLE versions_old")
+
+            connection.execute("DROP TABLE packages_old")
+            self.update_category_stats(None, connection)
+            connection.commit()
+
+            connection.execute("VACUUM") # give back the space of the old tables
+        except sql.Error as e:
+            error(_("Migrating the database failed: %s"), e)
+            connection.rollback()
+            self.drop_tables(connection)
+            return False
+
+        return True
+
+    def has_versions (self, connection):
+        """
+        Returns whether the versions table holds any versions.
+
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        @rtype: boolean
+        """
+        c = connection.execute("SELECT 1 FROM versions LIMIT 1")
+        row = c.fetchone()
+        c.close()
+
+        return row is not None
+
+    def updated_since_migration (self):
+        """
+        Checks the tree against the C{portdirs.db} written by format 2, i.e. whether the tree has changed since
+        the packages just migrated (see L{migrate}) have been stored. Has to be called before L{updated}, which
+        replaces the file.
+
+        Format 2 pickled the MD5 hexdigests of the timestamp of the tree and of the names and mtimes of all files
+        in each overlay.
+
+        @returns: whether the tree has changed - True if this cannot be told
+        @rtype: boolean
+        """
+        dbpath = os.path.join(SESSION_DIR, "portdirs.db")
+        try:
+            with open(dbpath, "rb") as f:
+                db = pickle.load(f)
+        except Exception as e: # missing, or anything but a pickle
+            debug("Cannot read portdirs.db of the old format: %s", e)
+            return True
+
+        if not isinstance(db, dict):
+            return True
 
         def walk (path):
-            debug("Walking %s", path)
-            
             for root, dirs, files in os.walk(path):
                 for f in files:
-                    path = os.path.join(root, f)
-                    yield "%s %s" % (f, os.stat(path).st_mtime)
-                
+                    yield "%s %s" % (f, os.stat(os.path.join(root, f)).st_mtime)
+
                 for forbidden in self.FORBIDDEN:
                     if forbidden in dirs:
                         dirs.remove(forbidden)
 
+        timestamp = os.path.join(system.get_global_settings("PORTDIR"), "metadata/timestamp")
+        hashes = {"ROOT" : hashlib.md5("%s %s" % (timestamp, os.stat(timestamp).st_mtime)).hexdigest()}
+
         overlays = system.get_global_settings("PORTDIR_OVERLAY").split()
-        hashes = {}
+        if set(db.keys()) != set(overlays) | set(["ROOT"]) or db["ROOT"] != hashes["ROOT"]:
+            return True
+
         for overlay in overlays:
-            hashes[overlay] = hashlib.md5("".join(walk(overlay))).hexdigest()
-        
+            if db[overlay] != hashlib.md5("".join(walk(overlay))).hexdigest():
+                debug("Overlay '%s' has been changed since the migrated packages have been stored.", overlay)
+                return True
+
+        return False
+
+    def drop_tables (self, connection):
+        """
+        Drops all tables of the database.
+
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        """
+        self.drop_fts(connection)
+        for table in ("packages_old", "versions_old", "packages", "versions", "category_stats", "categories"):
+            connection.execute("DROP TABLE IF EXISTS %s" % table)
+        connection.commit()
+
+    def drop_fts (self, connection):
+        """
+        Drops the full text index of the packages.
+
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        """
+        try:
+            connection.execute("DROP TABLE IF EXISTS packages_fts")
+        except sql.OperationalError as e: # the module of the table is not available
+            debug("Cannot drop the full text index: %s", e)
+
+    def search_types(self):
+        return self.SEARCH_NAME
+
+    def changed_categories (self, fingerprints):
+        """
+        Compares the category fingerprints to the ones stored in C{categories.db}.
+
+        @param fingerprints: the current fingerprints
+        @type fingerprints: dict
+        @returns: the categories that have changed; None if there had been no fingerprints stored
+        @rtype: set
+        """
+        old = read_manifest(os.path.join(SESSION_DIR, "categories.db"))
+
+        if old is None:
+            debug("categories.db not existant")
+            return None
+
+        changed = set(cat for cat in set(old) | set(fingerprints) if old.get(cat) != fingerprints.get(cat))
+        debug("Changed categories: %s", ", ".join(sorted(changed)))
+        return changed
+
+    def save_fingerprints (self, fingerprints):
+        """
+        Stores the category fingerprints in C{categories.db}.
+
+        @param fingerprints: the fingerprints as returned by L{category_fingerprints}
+        @type fingerprints: dict
+        """
+        write_manifest(os.path.join(SESSION_DIR, "categories.db"), fingerprints)
+
+    def hash_tree (self, path):
+        """
+        Hashes the names and mtimes of all directories below the path.
+        As files are only created, removed or renamed inside their directory, this catches all changes
+        relevant for the database, without the need to stat each file.
+
+        @param path: the root of the tree
+        @type path: string
+        @returns: the digest
+        @rtype: string
+        """
+        h = hashlib.md5()
+        stack = [path]
+
+        while stack:
+            d = stack.pop()
+            try:
+                h.update("%s %s\n" % (d, os.stat(d).st_mtime))
+                subdirs = sorted(subdirectories(d, self.FORBIDDEN), reverse = True)
+            except OSError as e:
+                debug("Cannot read '%s': %s", d, e)
+                continue
+
+            stack.extend(subdirs)
+
+        return h.digest()
+
+    def updated (self):
+        start = time.time()
+
+        overlays = system.get_global_settings("PORTDIR_OVERLAY").split()
         timestamp = os.path.join(system.get_global_settings("PORTDIR"), "metadata/timestamp")
-        hashes["ROOT"] = hashlib.md5("%s %s" % (timestamp, os.stat(timestamp).st_mtime)).hexdigest()
-    
+
         dbpath = os.path.join(SESSION_DIR, "portdirs.db")
-        db_existed = os.path.exists(dbpath)
+        db = read_manifest(dbpath)
+
+        if "pickle" in self.session: # marker of the old pickle format -- now we have the magic number for this
+            del self.session["pickle"]
+
+        hashes = {}
+        hashes["ROOT"] = hashlib.md5("%s %s" % (timestamp, os.stat(timestamp).st_mtime)).digest()
+
+        cond = Condition()
+        state = {"changed" : False, "remaining" : len(overlays)}
+
+        def check (key, h):
+            if db is None:
+                return True
+            elif key not in db:
+                debug("Overlay '%s' has been added.", key)
+                return True
+            elif db[key] != h:
+                debug("Overlay '%s' has been changed.", key)
+                return True
+            else:
+                return False
 
-        if db_existed and "pickle" not in self.session:
-            debug("Removing old portdirs.db, as this looks like old DBM format. If it is not - well - no real harm ;)")
-            os.remove(dbpath)
-            db_existed = False
+        def finish ():
+            # called after all overlays have been hashed -- maybe after we already returned
+            if state["changed"]:
+                write_manifest(dbpath, hashes)
 
-        self.session["pickle"] = "1" # no need for a certain value
+        def hash_overlay (overlay):
+            try:
+                h = self.hash_tree(overlay)
+            except Exception as e: # never leave the waiting thread hanging
+                error("Error while checking overlay '%s': %s", overlay, e)
+                h = ""
 
-        if db_existed:
-            debug("portdirs.db already existant")
-            with open(dbpath, "rb") as dbfile:
-                db = pickle.load(dbfile)
+            with cond:
+                hashes[overlay] = h
+                if check(overlay, h):
+                    state["changed"] = True
 
-            # the following could be simplified - losing the debug possibilities
-            # so we keep it as is :)
-            # there shouldn't be so much overlays, that this would result
-            # in performance loss
+                state["remaining"] -= 1
+                if state["remaining"] == 0:
+                    finish()
 
-            for key in set(db.keys()) - set(hashes.keys()):
+                cond.notify()
+
+        if db is None:
+            debug("portdirs.db not existant or in an old format")
+
+        state["changed"] = check("ROOT", hashes["ROOT"])
+        if db is not None:
+            for key in set(db.keys()) - set(overlays) - set(["ROOT"]):
                 debug("Overlay '%s' has been removed", key)
-                changed = True
-            
-            for key in hashes.keys():
+                state["changed"] = True
 
-                if key not in db:
-                    debug("Overlay '%s' has been added.", key)
-                    changed = True
+        if overlays:
+            pool = ThreadPool(min(len(overlays), self.HASH_THREADS))
+            for overlay in overlays:
+                pool.apply_async(hash_overlay, (overlay,))
+            pool.close() # the workers terminate after the last overlay
 
-                elif db[key] != hashes[key]:
-                    debug("Overlay '%s' has been changed.", key)
-                    changed = True
-            
+            # wait until all overlays are checked or one has changed
+            with cond:
+                while not state["changed"] and state["remaining"] > 0:
+                    cond.wait()
+
+                changed = state["changed"]
+                remaining = state["remaining"]
         else:
-            debug("portdirs.db not existant")
-            changed = True
-        
-        if changed:
-            with open(dbpath, "wb") as dbfile:
-                db = pickle.dump(hashes, dbfile, protocol = -1)
+            changed = state["changed"]
+            remaining = 0
+            finish()
 
+        debug("Change detection took %.3f seconds (changed: %s, overlays left unchecked: %d).", time.time() - start, changed, remaining)
         return changed
 
     def con (f):
-        @wraps(f)
-        def wrapper (*args, **kwargs):
-            if not "connection" in kwargs:
-                con= sql.connect(os.path.join(SESSION_DIR, "package.db"))
-                con.row_factory = sql.Row
-                kwargs["connection"] = con
-
-            return f(*args, **kwargs)
-        
-        return Database.lock(wrapper)
+        """Decorator passing the connection of the current thread and locking the database exclusively."""
+        return Database.lock(connected(f))
+
+    def shared_con (f):
+        """Decorator passing the connection of the current thread and locking the database shared."""
+        return Database.shared(connected(f))
+
+    def close (self):
+        Database.close(self)
+        self.connections.close()
+
+    def get_restrict_clause (self):
+        """
+        Returns the SQL expression for the current restriction.
+
+        @returns: the expression (to be appended to a WHERE clause) and its parameters
+        @rtype: (string, tuple)
+        """
+        if self._restrict:
+            return self._restrict
+        else:
+            return ("", ())
 
     @con
     def populate (self, category = None, connection = None):
+        full = category is None
+        self.begin_bulk_load(connection, full)
+        try:
+            self.insert_packages(category, connection)
+        except:
+            connection.rollback()
+            raise
+        finally:
+            self.end_bulk_load(connection, full)
+
+        self.update_category_stats(None, connection)
+        connection.commit()
+
+    def insert_packages (self, category, connection):
+        """
+        Inserts the packages into the database without committing.
+
+        @param category: An optional category expression (see L{generate_cat_expr}) - so only packages of this category are inserted.
+        @type category: string
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        """
         def _get():
             # get the lists
             inst = set(system.find_packages(pkgSet = system.SET_INSTALLED, key=category, with_version = False))
@@ -176,37 +862,290 @@ class SQLDatabase (Database):
 
                 yield (cat, pkg, p in inst, False)
 
-        connection.executemany("INSERT INTO packages (cat, name, inst, disabled) VALUES (?, ?, ?, ?)", _get())
-        connection.commit()
+        self.insert_rows("INSERT INTO packages (cat_id, name, inst, disabled) VALUES (?, ?, ?, ?)", _get(), connection)
+        self.insert_versions(category, connection)
 
-    @con
-    def get_cat (self, category = None, byName = True, showDisabled = False, connection = None):
-        sort = "ORDER BY name"
-        if not byName:
-            sort = "ORDER BY inst DESC, name"
+    def insert_rows (self, statement, rows, connection):
+        """
+        Inserts rows, whose first column is the name of a category, without committing.
+        The name is replaced by the id of the category.
 
-        disabled = "1=1"
-        if not showDisabled:
-            disabled = "disabled = 0"
+        The rows are generated in a separate thread (see L{generate_batched}), while the ones before are inserted.
+
+        @param statement: the INSERT statement
+        @type statement: string
+        @param rows: the rows
+        @type rows: tuple<iterable>
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        """
+        ids = {}
+        for batch in generate_batched(rows, self.BULK_SIZE):
+            if any(row[0] not in ids for row in batch):
+                ids = self.category_ids(set(row[0] for row in batch), connection)
+
+            connection.executemany(statement, [(ids[row[0]],) + row[1:] for row in batch])
+
+    def category_ids (self, categories, connection):
+        """
+        Returns the ids of the categories - adding the ones not known yet.
+
+        @param categories: the categories needed
+        @type categories: string<iterable>
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        @returns: name -> id for all categories in the database
+        @rtype: dict
+        """
+        connection.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)", ((cat,) for cat in categories))
+
+        c = connection.execute("SELECT name, id FROM categories")
+        ids = dict(c.fetchall())
+        c.close()
+
+        return ids
+
+    def insert_versions (self, category, connection):
+        """
+        Inserts the versions of the packages into the database without committing.
+        The versions of each package are numbered from lowest to highest.
+
+        @param category: An optional category expression (see L{generate_cat_expr}) - so only versions of this category are inserted.
+        @type category: string
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        """
+        def _get():
+            inst = set(system.find_packages(pkgSet = system.SET_INSTALLED, key = category, only_cpv = True))
+
+            cps = defaultdict(list)
+            for cpv in system.find_packages(key = category, masked = True, only_cpv = True):
+                cat, pkg = system.split_cpv(cpv)[:2]
+                cps[(cat, pkg)].append(cpv)
+
+            # do not go through the wrapper for each single version
+            sort_package_list = system.sort_package_list
+            new_package = system.new_package
+
+            for (cat, pkg), cpvs in cps.iteritems():
+                for pos, cpv in enumerate(sort_package_list(cpvs, only_cpv = True)):
+                    p = new_package(cpv)
+                    iuse = (flag.lstrip("+-") for flag in p.get_package_settings("IUSE").split())
+
+                    yield (cat, pkg, p.get_version(), pos,
+                            p.get_slot() or "0",
+                            p.get_package_settings("KEYWORDS"),
+                            " ".join(iuse),
+                            p.get_overlay_path() if p.is_in_overlay() else "",
+                            p.is_masked(),
+                            cpv in inst)
+
+        self.insert_rows("INSERT INTO versions (cat_id, name, version, pos, slot, keywords, iuse, overlay, masked, inst) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", _get(), connection)
+
+    def delete_packages (self, cat, connection):
+        """
+        Deletes the packages from the database without committing.
 
-        if not category or category == self.ALL:
-            c = connection.execute("SELECT cat, name, inst, disabled FROM packages WHERE %s %s %s" % (disabled, self.restrict, sort))
+        @param cat: An optional category - so only packages of this category are deleted.
+        @type cat: string
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        """
+        if cat:
+            connection.execute("DELETE FROM packages WHERE cat_id = %s" % self.CAT_ID, (cat,))
+            connection.execute("DELETE FROM versions WHERE cat_id = %s" % self.CAT_ID, (cat,))
+            connection.execute("UPDATE categories SET total = 0, installed = 0, disabled = 0, disabled_installed = 0 WHERE name = ?", (cat,))
+        else:
+            connection.execute("DELETE FROM packages")
+            connection.execute("DELETE FROM versions")
+            connection.execute("DELETE FROM categories")
+
+    def update_category_stats (self, categories, connection):
+        """
+        Recounts the packages of the given categories into the C{categories} table without committing.
+
+        @param categories: the categories to recount - None for all
+        @type categories: string[]
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        """
+        # each count is served by the index on (cat_id, disabled, ...)
+        count = """
+            UPDATE categories SET
+                total = (SELECT COUNT(*) FROM packages WHERE cat_id = categories.id),
+                installed = (SELECT COUNT(*) FROM packages WHERE cat_id = categories.id AND inst = 1),
+                disabled = (SELECT COUNT(*) FROM packages WHERE cat_id = categories.id AND packages.disabled = 1),
+                disabled_installed = (SELECT COUNT(*) FROM packages WHERE cat_id = categories.id AND packages.disabled = 1 AND inst = 1)"""
+
+        if categories is None:
+            connection.execute(count)
+        else:
+            categories = list(categories)
+            connection.execute(count + " WHERE name IN (%s)" % ", ".join("?" * len(categories)), categories)
+
+    def repopulate (self, categories, connection):
+        """
+        Replaces the packages of the given categories with freshly fetched ones - in one transaction.
+
+        @param categories: the categories to refresh
+        @type categories: string<iterator>
+        @param connection: the connection to use
+        @type connection: sqlite3.Connection
+        """
+        categories = list(categories)
+        if not categories: return
+
+        self.begin_bulk_load(connection)
+        try:
+            for cat in categories:
+                self.delete_packages(cat, connection)
+            
+            # one query for all categories
+            if len(categories) == 1:
+                self.insert_packages(self.generate_cat_expr(categories[0]), connection)
+            else:
+                self.insert_packages(self.generate_cats_expr(categories), connection)
+
+            self.update_category_stats(categories, connection)
+        except:
+            connection.rollback()
+            raise
+        finally:
+            self.end_bulk_load(connection) # commits
+
+    def cat_order (self, category, byName):
+        """
+        Returns the sort order of the packages of a category, as used by L{get_cat}.
+
+        @param category: the category
+        @type category: string
+        @param byName: sort by name or by installation
+        @type byName: boolean
+        @returns: a join needed for sorting, its parameters and the ORDER BY expression
+        @rtype: (string, tuple, string)
+        """
+        if byName:
+            return ("", (), "packages.name")
         else:
-            c = connection.execute("SELECT cat, name, inst, disabled FROM packages WHERE cat = ? AND %s %s %s" % (disabled, self.restrict ,sort), (category,))
+            return ("", (), "inst DESC, packages.name")
+
+    def cat_query (self, columns, category = None, byName = True, showDisabled = False, installed = False, sort = True):
+        """
+        Builds the query selecting the packages of a category - shared by L{get_cat}, L{get_cat_range} and L{count_cat}.
+
+        @param columns: the columns to select
+        @type columns: string
+        @param sort: whether to sort the packages (see L{cat_order})
+        @type sort: boolean
+        @returns: the query and its parameters
+        @rtype: (string, tuple)
+        """
+        join, params, order = ("", (), None)
+        if sort:
+            join, params, order = self.cat_order(category, byName)
+
+        where = ["1=1"]
+        if category and category != self.ALL:
+            where.append("cat_id = " + self.CAT_ID)
+            params += (category,)
+
+        if not showDisabled:
+            where.append("packages.disabled = 0")
+
+        if installed:
+            where.append("inst = 1")
+
+        restrict, rparams = self.get_restrict_clause()
+        query = "SELECT %s FROM %s %s WHERE %s %s" % (columns, self.PACKAGES, join, " AND ".join(where), restrict)
+        if order:
+            query += " ORDER BY " + order
+
+        return (query, params + rparams)
+
+    @shared_con
+    @Database.cached
+    def get_cat (self, category = None, byName = True, showDisabled = False, connection = None):
+        c = connection.execute(*self.cat_query(self.PKG_COLUMNS, category, byName, showDisabled))
         
-        for pkg in c:
-            yield PkgData(pkg["cat"], pkg["name"], pkg["inst"], pkg["disabled"])
+        # do not keep the cursor (and thus SQLite's read lock) open while the caller iterates
+        rows = list(fetch_batched(c, self.FETCH_SIZE))
+        for row in rows:
+            yield PkgData(*row)
+
+    @shared_con
+    @Database.cached
+    def get_cat_range (self, category = None, offset = 0, limit = None, byName = True, showDisabled = False, installed = False, connection = None):
+        query, params = self.cat_query(self.PKG_COLUMNS, category, byName, showDisabled, installed)
+        c = connection.execute(query + " LIMIT ? OFFSET ?", params + (-1 if limit is None else limit, offset))
+
+        rows = list(fetch_batched(c, self.FETCH_SIZE))
+        for row in rows:
+            yield PkgData(*row)
+
+    @shared_con
+    def count_cat (self, category = None, showDisabled = False, installed = False, connection = None):
+        c = connection.execute(*self.cat_query("COUNT(*)", category, showDisabled = showDisabled, installed = installed, sort = False))
+        count = c.fetchone()[0]
         c.close()
+        return count
 
-    @con
+    @shared_con
+    def get_versions (self, cp, connection = None):
+        cat, pkg = cp.split("/")
+        c = connection.execute("SELECT version, slot, keywords, iuse, overlay, masked, inst FROM versions WHERE cat_id = %s AND name = ? ORDER BY pos" % self.CAT_ID, (cat, pkg))
+
+        versions = [VersionData(cat, pkg, *row) for row in fetch_batched(c, self.FETCH_SIZE)]
+        if not versions: # not in the database -- let the caller ask portage
+            return None
+
+        return versions
+
+    @shared_con
+    def get_category_stats (self, connection = None):
+        c = connection.execute("SELECT name, total, installed, disabled, disabled_installed FROM categories WHERE total > 0")
+        counts = c.fetchall()
+        c.close()
+
+        restrict, params = self.get_restrict_clause()
+        if restrict:
+            c = connection.execute("SELECT categories.name, COUNT(*), SUM(inst = 1) FROM %s WHERE packages.disabled = 0 %s GROUP BY cat_id" % (self.PACKAGES, restrict), params)
+            matching = dict((cat, (m, minst)) for cat, m, minst in c.fetchall())
+            c.close()
+
+        stats = {}
+        sums = [0] * 5
+        for cat, total, inst, disabled, disabled_inst in counts:
+            if restrict:
+                m, minst = matching.get(cat, (0, 0))
+            else:
+                m, minst = total - disabled, inst - disabled_inst
+
+            s = stats[cat] = CategoryStats(total, inst, disabled, m, minst)
+            sums = map(sum, zip(sums, s))
+
+        stats[self.ALL] = CategoryStats(*sums)
+        return stats
+
+    @shared_con
+    @Database.cached
     def get_categories (self, installed = False, connection = None):
 
-        if installed:
-            where = "inst = 1"
+        restrict, params = self.get_restrict_clause()
+        if restrict:
+            if installed:
+                where = "inst = 1"
+            else:
+                where = "1 = 1"
+
+            c = connection.execute("SELECT categories.name FROM %s WHERE packages.disabled = 0 AND %s %s GROUP BY categories.name" % (self.PACKAGES, where, restrict), params)
         else:
-            where = "1 = 1"
+            # the counters make scanning the packages unnecessary
+            if installed:
+                where = "installed > disabled_installed"
+            else:
+                where = "total > disabled"
 
-        c = connection.execute("SELECT cat FROM packages WHERE disabled = 0 AND %s %s GROUP BY cat" % (where, self.restrict))
+            c = connection.execute("SELECT name FROM categories WHERE %s ORDER BY name" % where)
 
         l = c.fetchall()
         c.close()
@@ -214,8 +1153,8 @@ class SQLDatabase (Database):
         if len(l) > 1:
             yield self.ALL
         
-        for cat in l:
-            yield cat["cat"]
+        for (cat,) in l:
+            yield cat
 
     def generate_cat_expr (self, cat):
         """
@@ -231,22 +1170,100 @@ class SQLDatabase (Database):
 
         return cat+"/*"
 
+    def generate_descr_expr (self, restrict):
+        """
+        Generates an SQL expression matching all packages whose description matches the search expression.
+
+        @param restrict: the search expression
+        @type restrict: string
+
+        @returns: SQL expression and its parameters
+        @rtype: (string, tuple)
+        """
+
+        return ("descr LIKE ?", ("%%%s%%" % restrict.replace(".*","%").replace(".","_"),))
+
+    @con
+    def replace_packages (self, packages, connection = None):
+        fingerprints = self.category_fingerprints()
+
+        self.invalidate_cache()
+        self.begin_bulk_load(connection, True)
+        try:
+            self.delete_packages(None, connection)
+            self.insert_rows("INSERT INTO packages (cat_id, name, inst, disabled) VALUES (?, ?, ?, 0)", packages, connection)
+        except:
+            connection.rollback()
+            raise
+        finally:
+            self.end_bulk_load(connection, True)
+
+        # the versions are left to portage, until the categories are reloaded
+        self.update_category_stats(None, connection)
+        connection.commit()
+
+        self.save_fingerprints(fingerprints)
+        self.session["populated"] = "1"
+
     @con
     def reload (self, cat = None, connection = None):
+        watched = self.watch_changes([cat] if cat else None)
+        self.invalidate_cache(cat)
         if cat:
-            connection.execute("DELETE FROM packages WHERE cat = ?", (cat,))
-            connection.commit()
-            self.populate(self.generate_cat_expr(cat), connection = connection)
+            self.repopulate([cat], connection)
         else:
-            connection.execute("DELETE FROM packages")
+            self.delete_packages(None, connection)
             connection.commit()
             self.populate(connection = connection)
 
+        self.notify_changes(watched)
+
+    @con
+    def reload_many (self, categories, connection = None):
+        categories = list(set(categories))
+        watched = self.watch_changes(categories)
+        for cat in categories:
+            self.invalidate_cache(cat)
+
+        self.repopulate(categories, connection)
+        self.notify_changes(watched)
+
+    @shared_con
+    def get_installed_flags (self, categories = None, connection = None):
+        query = "SELECT categories.name, packages.name, inst FROM %s WHERE packages.disabled = 0" % self.PACKAGES
+
+        rows = []
+        if categories is None:
+            rows = connection.execute(query).fetchall()
+        else:
+            for cat in categories:
+                rows.extend(connection.execute(query + " AND cat_id = " + self.CAT_ID, (cat,)).fetchall())
+
+        return dict(("%s/%s" % (cat, pkg), bool(inst)) for cat, pkg, inst in rows)
+
     @con
     def disable (self, cpv, connection = None):
         cat, pkg = cpv.split("/")
-        connection.execute("UPDATE packages SET disabled = 1 WHERE cat = ? AND name = ?", (cat, pkg))
+        c = connection.execute("UPDATE packages SET disabled = 1 WHERE cat_id = %s AND name = ? AND disabled = 0" % self.CAT_ID, (cat, pkg))
+        if c.rowcount > 0:
+            connection.execute("""
+                UPDATE categories SET
+                    disabled = disabled + ?,
+                    disabled_installed = disabled_installed + (SELECT COUNT(*) FROM packages WHERE cat_id = categories.id AND packages.name = ? AND inst = 1)
+                WHERE name = ?""", (c.rowcount, pkg, cat))
         connection.commit()
+        self.invalidate_cache(cat)
+
+        if c.rowcount > 0 and self._listeners:
+            inst = connection.execute("SELECT inst FROM packages WHERE cat_id = %s AND name = ?" % self.CAT_ID, (cat, pkg)).fetchone()[0]
+            self.notify(self.PACKAGE_DISABLED, PkgData(cat, pkg, bool(inst), True))
+
+            if not connection.execute("SELECT total - disabled FROM categories WHERE name = ?", (cat,)).fetchone()[0]:
+                self.notify(self.CATEGORY_REMOVED, cat)
+
+    def prepare_search (self, restrict, cancelled = None):
+        # the queries are built from the current restriction -- they are run, when the caller sets it
+        return True
 
     def get_restrict (self):
         return self._restrict
@@ -254,25 +1271,34 @@ class SQLDatabase (Database):
     @lock
     def set_restrict (self, restrict):
         if not restrict:
-            self._restrict = ""
+            self._restrict = None
         else:
-            restrict = restrict.replace(".*","%").replace(".","_")
+            like = restrict.replace(".*","%").replace(".","_")
             rest = ""
+            params = ()
 
             if self._type & self.SEARCH_NAME:
-                if "/" in restrict:
-                    rest = "(name LIKE '%s%%' AND cat LIKE '%s')" % tuple(restrict.split("/",1))
+                if "/" in like:
+                    cat, name = like.split("/",1)
+                    rest = "(packages.name LIKE ? AND categories.name LIKE ?)"
+                    params = (name+"%", cat)
                 else:
-                    rest = "(name LIKE '%%%(restrict)s%%' OR cat LIKE '%(restrict)s%%')" % {"restrict":restrict}
+                    rest = "(packages.name LIKE ? OR categories.name LIKE ?)"
+                    params = ("%"+like+"%", like+"%")
             
             if self._type & self.SEARCH_DESCRIPTION:
-                r = "descr LIKE '%%%(restrict)s%%'" % {"restrict":restrict}
+                r, p = self.generate_descr_expr(restrict)
                 if rest:
                     rest = "(%s OR %s)" % (r, rest)
+                    params = p + params
                 else:
                     rest = r
+                    params = p
+
+            self._restrict = ("AND " + rest, params)
 
-            self._restrict = "AND " + rest
+        self.invalidate_searches()
 
     restrict = property(get_restrict, set_restrict)
     con = staticmethod(con)
+    shared_con = staticmethod(shared_con)
@@ -28,6 +28,13 @@ class EixReader(object):
     Note that the file used internally stays open during the whole operation.
     So please call `close()` when you are finished.
 
+    If the file is mapped into memory (see the ``mapped`` parameter), the data is decoded directly
+    from the mapping and the descriptions are only decoded when accessed.
+
+    The categories are read on demand: Either all at once (`categories`), one after the other
+    (`iter_categories`, `iter_packages`) or a single one by seeking directly to it (`category`).
+    The latter uses an index of the categories' offsets, which is built on first use.
+
     The ``EixReader`` supports the context manager protocol, so you can the ``with ... as ...``.
 
     :CVariables:
@@ -37,42 +44,122 @@ class EixReader(object):
 
     :IVariables:
 
-        file : file
+        file : file or `parser.mapped_file`
             The eix cache file.
 
         header : `parser.header`
             The header of the eix cache.
 
         categories : `parser.category` []
-            The list of categories.
+            The list of categories. It is read completely on first access.
     """
 
     supported_versions = (28,)
         
-    def __init__ (self, filename):
+    def __init__ (self, filename, mapped = False, index = None):
         """
         :param filename: Path to the cache file
         :type filename: string
+        :param mapped: Map the cache file into memory instead of reading it via ``file``
+        :type mapped: bool
+        :param index: A category index (see `index`) built earlier for the very same file
+        :type index: dict
         """
 
-        self.file = open(filename, "r")
+        if mapped:
+            self.file = parser.mapped_file(filename)
+        else:
+            self.file = open(filename, "r")
         
         try:
             version = parser.number(self.file)
 
             if version not in self.supported_versions:
-                raise UnsupportedVersionError(self.version)
+                raise UnsupportedVersionError(version)
 
             debug("Started EixReader for version %s.", version)
 
             self.file.seek(0)
 
             self.header = parser.header(self.file)
-            self.categories = parser.vector(self.file, parser.category, nelems = self.header.ncats)
+            self._start = self.file.tell() # where the first category begins
+            self._index = index
+            self._categories = None
         except:
             self.close()
             raise
 
+    @property
+    def categories (self):
+        if self._categories is None:
+            self._categories = list(self.iter_categories())
+
+        return self._categories
+
+    @property
+    def index (self):
+        """
+        The mapping of category names to the offsets of the categories in the file.
+
+        :rtype: dict
+        """
+        if self._index is None:
+            self.file.seek(self._start)
+            self._index = dict(parser.category_index(self.file, self.header.ncats))
+            debug("Built index for %d categories.", len(self._index))
+
+        return self._index
+
+    def iter_categories (self):
+        """
+        Iterates over the categories, reading one category at a time.
+
+        :rtype: `parser.category` <iterator>
+        """
+        pos = self._start
+        for i in xrange(self.header.ncats):
+            self.file.seek(pos) # someone else might have moved the file in between
+            cat = parser.category(self.file)
+            pos = self.file.tell()
+
+            yield cat
+
+    def iter_packages (self, category = None):
+        """
+        Iterates over the packages, reading one category at a time.
+
+        :param category: If given, only the packages of this category are returned.
+        :type category: string
+        :returns: category name and package
+        :rtype: (string, `parser.package`) <iterator>
+        """
+        if category is None:
+            cats = self.iter_categories()
+        else:
+            cat = self.category(category)
+            cats = [cat] if cat is not None else []
+
+        for cat in cats:
+            for pkg in cat.packages:
+                yield (cat.name, pkg)
+
+    def category (self, name):
+        """
+        Reads a single category by seeking directly to it.
+
+        :param name: the name of the category
+        :type name: string
+        :returns: the category or None if it does not exist
+        :rtype: `parser.category`
+        """
+        try:
+            offset = self.index[name]
+        except KeyError:
+            return None
+
+        self.file.seek(offset)
+        return parser.category(self.file)
+
     def __enter__ (self):
         return self
 
@@ -29,10 +29,19 @@ cdef extern from "stdio.h":
     
     int EOF
     int SEEK_CUR
+    int SEEK_SET
 
 cdef extern from "Python.h":
     FILE* PyFile_AsFile(object)
 
+cdef extern from "sys/mman.h":
+    void* mmap(void* addr, size_t length, int prot, int flags, int fd, long offset)
+    int munmap(void* addr, size_t length)
+
+    int PROT_READ
+    int MAP_PRIVATE
+    void* MAP_FAILED
+
 ctypedef unsigned char UChar
 ctypedef long long LLong
 
@@ -41,7 +50,25 @@ from cpython.mem cimport PyMem_Malloc, PyMem_Free
 from cpython.exc cimport PyErr_NoMemory
 from cpython.string cimport PyString_FromStringAndSize
 
-from portato.eix.exceptions import EndOfFileException
+import os
+from portato.eix.exceptions import EndOfFileException, EixError
+
+# the prefixes of the different types of version parts
+VERSION_PREFIXES = (
+        "", # garbage
+        "_alpha", "_beta", "_pre", "_rc",
+        "-r", # revision
+        ".", # inter revision
+        "_p", # patch
+        "", # char
+        ".", # primary
+        "") # first
+
+# bits of `version.mask`
+MASK_PACKAGE = 0x01
+MASK_PROFILE = 0x02
+MASK_SYSTEM = 0x04
+MASK_WORLD = 0x08
 
 #
 # Helper
@@ -55,19 +82,165 @@ cdef int _get_byte (FILE* file) except -1:
 
     return c
 
+#
+# Memory mapped files
+#
+
+cdef class mapped_file:
+    """
+    A cache file mapped into memory. It can be passed to all functions and types of this module
+    instead of a normal file object: Numbers and strings are then decoded directly from the mapped buffer.
+    
+    Packages read from a mapped file only keep the offset of their description and decode it on access.
+    Therefore the mapping is released only after the last of these packages is gone -- and not by `close()`.
+
+    :IVariables:
+
+        name : string
+            The name of the mapped file.
+
+        size : int
+            The size of the file.
+    """
+
+    cdef UChar* data
+    cdef readonly Py_ssize_t size
+    cdef Py_ssize_t pos
+    cdef readonly object name
+
+    def __cinit__ (self):
+        self.data = NULL
+        self.size = 0
+        self.pos = 0
+
+    def __init__ (self, filename):
+        """
+        :param filename: Path to the file
+        :type filename: string
+        """
+        cdef void* p
+        cdef Py_ssize_t size
+
+        self.name = filename
+
+        with open(filename, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                raise EndOfFileException(filename)
+
+            p = mmap(NULL, size, PROT_READ, MAP_PRIVATE, f.fileno(), 0)
+
+        if p == MAP_FAILED:
+            raise EixError(_("Cannot map '%s' into memory.") % filename)
+
+        self.data = <UChar*>p
+        self.size = size
+
+    def __dealloc__ (self):
+        if self.data is not NULL:
+            munmap(self.data, self.size)
+            self.data = NULL
+
+    def tell (self):
+        """
+        Returns the current position in the file.
+
+        :rtype: int
+        """
+        return self.pos
+
+    def seek (self, Py_ssize_t offset, int whence = 0):
+        """
+        Sets the current position -- like `file.seek`.
+        """
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+
+        if offset < 0 or offset > self.size:
+            raise EndOfFileException(self.name)
+
+        self.pos = offset
+
+    def close (self):
+        """
+        Does nothing, as the mapping is released, when it is not referenced anymore. Only for compatibility with `file`.
+        """
+        pass
+
+    cdef inline int _byte (self) except -1:
+        if self.pos >= self.size:
+            raise EndOfFileException(self.name)
+
+        self.pos += 1
+        return self.data[self.pos - 1]
+
+    cdef int _skip (self, LLong n) except -1:
+        if n < 0 or n > self.size - self.pos:
+            raise EndOfFileException(self.name)
+
+        self.pos += <Py_ssize_t>n
+        return 0
+
+    cdef LLong _number (self) except? -1:
+        cdef UChar n
+        cdef LLong value
+        cdef int i
+
+        cdef unsigned short count = 1
+
+        n = <UChar>self._byte()
+
+        if n < 0xFF:
+            return <LLong>n
+        else:
+
+            n = <UChar>self._byte()
+            while (n == 0xFF):
+                count += 1
+                n = <UChar>self._byte()
+
+            if n == 0:
+                value = <LLong>0xFF # 0xFF is encoded as 0xFF 0x00
+                count -= 1
+            else:
+                value = <LLong>n
+
+            for i in range(count):
+                value = (value << 8) | <LLong>(self._byte())
+
+        return value
+
+    cdef object _decode (self, Py_ssize_t start, Py_ssize_t n, bint unicode):
+        if unicode:
+            return PyUnicode_DecodeUTF8(<char*>self.data + start, n, 'replace')
+        else:
+            return PyString_FromStringAndSize(<char*>self.data + start, n)
+
+    cdef object _string (self, bint unicode):
+        cdef LLong n = self._number()
+        cdef Py_ssize_t start = self.pos
+
+        self._skip(n)
+        return self._decode(start, <Py_ssize_t>n, unicode)
+
 #
 # Base Types
 #
 
-cpdef LLong number (object pfile):
+cpdef LLong number (object pfile) except? -1:
     """
     Returns a number.
 
     :param file: The file to read from
-    :type file: file
+    :type file: file or `mapped_file`
     :rtype: int
     """
     
+    if isinstance(pfile, mapped_file):
+        return (<mapped_file>pfile)._number()
+
     cdef UChar n
     cdef LLong value
     cdef int i
@@ -97,6 +270,23 @@ cpdef LLong number (object pfile):
         
     return value
 
+cpdef int skip (object pfile, LLong n) except -1:
+    """
+    Skips the next bytes.
+
+    :param pfile: The file to read from
+    :type pfile: file or `mapped_file`
+    :param n: The number of bytes to skip
+    :type n: int
+    """
+    if isinstance(pfile, mapped_file):
+        return (<mapped_file>pfile)._skip(n)
+    
+    if fseek(PyFile_AsFile(pfile), <long>n, SEEK_CUR) != 0:
+        raise EndOfFileException, pfile.name
+
+    return 0
+
 cpdef object vector (object file, object get_type, object nelems = None):
     """
     Returns a vector of elements.
@@ -126,16 +316,32 @@ cpdef object vector (object file, object get_type, object nelems = None):
     
     return [get_type(file) for i in range(n)]
 
+cpdef int byte (object pfile) except -1:
+    """
+    Returns a single byte (``char``).
+
+    :param pfile: The file to read from
+    :type pfile: file or `mapped_file`
+    :rtype: int
+    """
+    if isinstance(pfile, mapped_file):
+        return (<mapped_file>pfile)._byte()
+    else:
+        return _get_byte(PyFile_AsFile(pfile))
+
 cpdef object string (object pfile, bint unicode = False):
     """
     Returns a string.
 
     :param pfile: The file to read from
-    :type pfile: file
+    :type pfile: file or `mapped_file`
     :param unicode: Return unicode
     :type unicode: bool
     :rtype: str or unicode
     """
+    if isinstance(pfile, mapped_file):
+        return (<mapped_file>pfile)._string(unicode)
+
     cdef LLong nelems = number(pfile)
     cdef FILE* file = PyFile_AsFile(pfile)
     cdef char* s
@@ -159,6 +365,29 @@ cpdef object string (object pfile, bint unicode = False):
     finally:
         PyMem_Free(s)
 
+cpdef object version_part (object file):
+    """
+    Returns a part of a version string.
+
+    :param file: The file to read from
+    :type file: file or `mapped_file`
+    :returns: the type (see `VERSION_PREFIXES`) and the value
+    :rtype: (int, string)
+    """
+    cdef LLong n = number(file)
+    cdef LLong length = n >> 5
+    cdef object value
+
+    if isinstance(file, mapped_file):
+        value = (<mapped_file>file)._decode((<mapped_file>file).pos, <Py_ssize_t>length, False)
+        (<mapped_file>file)._skip(length)
+    else:
+        value = file.read(length)
+        if len(value) < length:
+            raise EndOfFileException, file.name
+
+    return (n & 0x1F, value)
+
 #
 # Complex Types
 #
@@ -248,20 +477,80 @@ cdef class header:
         self.slots = vector(file, string)
         self.sets = vector(file, string)
 
+cdef class version:
+    """
+    The representation of one version of a package.
+
+    :IVariables:
+
+        version : string
+            The version string, e.g. ``1.2c_pre12-r1``.
+
+        mask : int
+            The mask bitset for the current ``ARCH``: a combination of `MASK_PACKAGE`, `MASK_PROFILE`,
+            `MASK_SYSTEM` and `MASK_WORLD`.
+
+        properties : int
+            The bitset for the PROPERTIES variable.
+
+        restrict : int
+            The bitset for the RESTRICT variable.
+
+        keywords : int[]
+            The indices of `header.keywords` representing the KEYWORDS of the version.
+
+        slot : int
+            The index of `header.slots` representing the slot. The slot "0" is stored as "".
+
+        overlay : int
+            The index of `header.overlays` representing the overlay the version comes from.
+
+        useflags : int[]
+            The indices of `header.useflags` representing the IUSE value of the version.
+    """
+
+    cdef readonly object version
+    cdef readonly int mask
+    cdef readonly int properties
+    cdef object _restrict # 'restrict' is a keyword in C
+    cdef readonly object keywords
+    cdef readonly object slot
+    cdef readonly object overlay
+    cdef readonly object useflags
+
+    def __init__ (self, file):
+        """
+        :param file: The file to read from
+        :type file: file or `mapped_file`
+        """
+        self.mask = byte(file)
+        self.properties = byte(file)
+        self._restrict = number(file)
+        self.keywords = vector(file, number)
+        self.version = "".join([VERSION_PREFIXES[t] + v for t, v in vector(file, version_part)])
+        self.slot = number(file)
+        self.overlay = number(file)
+        self.useflags = vector(file, number)
+
+    property restrict:
+        def __get__ (self):
+            return self._restrict
+
 cdef class package:
     """
     The representation of one package.
 
-    Currently, version information is not parsed and stored.
-    So you can gain general infos only.
+    Only name and description are read when the package is created. The other
+    values are decoded on first access -- which therefore must happen before the file is closed,
+    unless it is a `mapped_file`.
 
     :IVariables:
         
         name : string
             The name of the package.
 
-        description : string
-            Description of the package.
+        description : unicode
+            Description of the package. If read from a `mapped_file`, it is decoded on first access.
 
         homepage : string
             The homepage of the package.
@@ -274,21 +563,118 @@ cdef class package:
 
         useflags : int[]
             The indices of `header.useflags` representing the IUSE value of the package.
+
+        versions : `version` []
+            The versions of the package.
     """
 
     cdef LLong _offset
     cdef readonly object name
-    cdef readonly object description
-    #cdef readonly object provide
-    #cdef readonly object homepage
-    #cdef readonly object license
-    #cdef readonly object useflags
+    cdef object _description
+    cdef mapped_file _source
+    cdef Py_ssize_t _descr_start
+    cdef Py_ssize_t _descr_len
+
+    cdef object _file
+    cdef long _rest_start
+    cdef bint _complete
+    cdef object _provide
+    cdef object _homepage
+    cdef object _license
+    cdef object _useflags
+    cdef object _versions
 
     def __init__ (self, file):
         """
         :param file: The file to read from
-        :type file: file
+        :type file: file or `mapped_file`
         """
+        cdef mapped_file mfile
+        cdef Py_ssize_t after
+        
+        self._file = file
+        self._complete = False
+
+        if isinstance(file, mapped_file):
+            mfile = <mapped_file>file
+            self._offset = mfile._number()
+            after = mfile.pos
+
+            self.name = mfile._string(False)
+
+            # only remember where the description is
+            self._descr_len = <Py_ssize_t>mfile._number()
+            self._descr_start = mfile.pos
+            mfile._skip(self._descr_len)
+            self._source = mfile
+            self._rest_start = mfile.pos
+
+            # skip the rest
+            mfile.pos = after
+            mfile._skip(self._offset)
+        else:
+            self._read_file(file)
+
+    property description:
+        def __get__ (self):
+            if self._source is not None:
+                self._description = self._source._decode(self._descr_start, self._descr_len, True)
+                self._source = None
+
+            return self._description
+
+    property provide:
+        def __get__ (self):
+            self._read_rest()
+            return self._provide
+
+    property homepage:
+        def __get__ (self):
+            self._read_rest()
+            return self._homepage
+
+    property license:
+        def __get__ (self):
+            self._read_rest()
+            return self._license
+
+    property useflags:
+        def __get__ (self):
+            self._read_rest()
+            return self._useflags
+
+    property versions:
+        def __get__ (self):
+            self._read_rest()
+            return self._versions
+
+    cdef _read_rest (self):
+        cdef object file = self._file
+        cdef object pos
+
+        if self._complete:
+            return
+
+        # a mapped file stays valid, as long as it is referenced -- a normal one does not
+        if getattr(file, "closed", False):
+            raise EixError(_("The values of package '%s' have not been read before the file was closed.") % self.name)
+
+        # the file has moved on in the meantime
+        pos = file.tell()
+        file.seek(self._rest_start)
+        try:
+            self._provide = vector(file, number)
+            self._homepage = string(file)
+            self._license = number(file)
+            self._useflags = vector(file, number)
+            self._versions = vector(file, version)
+        finally:
+            file.seek(pos)
+
+        self._complete = True
+        self._file = None # do not keep the file alive longer than needed
+
+    cdef _read_file (self, object file):
         cdef FILE* cfile = PyFile_AsFile(file)
         cdef long after_offset
         
@@ -297,16 +683,10 @@ cdef class package:
         after_offset = ftell(cfile)
         
         self.name = string(file)
-        self.description = string(file, True)
+        self._description = string(file, True)
+        self._rest_start = ftell(cfile)
 
-        # skip the rest, as it is currently unneeded
-        #self.provide = vector(file, number)
-        #self.homepage = string(file)
-        #self.license = number(file)
-        #self.useflags = vector(file, number)
-        
-        # self.versions = LE(typed_vector(version))
-        # for the moment just skip the versions
+        # skip the rest -- it is read on demand
         fseek(cfile, self._offset - (ftell(cfile) - after_offset), SEEK_CUR)
 
 cdef class category:
@@ -332,3 +712,37 @@ cdef class category:
         """
         self.name = string(file)
         self.packages = vector(file, package)
+
+cpdef object category_index (object file, LLong ncats):
+    """
+    Returns the names and starting offsets of the next categories.
+    The packages are skipped without being decoded.
+    Afterwards, the file is positioned after the last category.
+
+    :Parameters:
+
+        file : file or `mapped_file`
+            The file to read from -- positioned at the beginning of a category.
+
+        ncats : int
+            The number of categories to index.
+
+    :rtype: (string, int) []
+    """
+
+    cdef LLong i, j, npkgs
+    cdef long start
+    cdef object name
+    cdef list index = []
+
+    for i in range(ncats):
+        start = file.tell()
+        name = string(file)
+
+        npkgs = number(file)
+        for j in range(npkgs):
+            skip(file, number(file)) # the offset to the next package
+
+        index.append((name, start))
+
+    return index
@@ -405,9 +405,8 @@ class EmergeQueue:
             @plugin.hook("after_emerge", packages = packages, retcode = ret)
             def update_packages():
                 if self.db:
-                    for cat in cats:
-                        self.db.reload(cat)
-                        debug("Category %s refreshed", cat)
+                    self.db.reload_many(cats)
+                    debug("Categories refreshed: %s", ", ".join(cats))
 
             update_packages()
             
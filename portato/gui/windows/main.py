@@ -19,9 +19,11 @@ import vte
 
 # other
 import os
+import time
 import itertools as itt
 import operator as op
 from collections import defaultdict
+from threading import Lock
 
 # our backend stuff
 from ...backend import flags, system # must be the first to avoid circular deps
@@ -30,6 +32,7 @@ from ...helper import debug, warning, error, info
 from ...session import Session
 from ...db import Database
 from ...db.database import UnsupportedSearchTypeError
+from ...db.search import SearchSession
 from ...constants import CONFIG_LOCATION, VERSION, APP_ICON, ICON_DIR
 from ...backend.exceptions import PackageNotFoundException, BlockedException, VersionsNotFoundException
 
@@ -413,6 +416,12 @@ class MainWindow (Window):
             LOG_PAGE
     ) = range(3)
 
+    # seconds between refreshing the lists while the database is loaded
+    DB_REFRESH_INTERVAL = 2
+
+    # number of packages loaded into the package list at once -- more are loaded when scrolling down
+    PKG_WINDOW = 500
+
     def __init__ (self, splash = None):
         """
         Build up window.
@@ -440,7 +449,6 @@ class MainWindow (Window):
         # booleans
         self.doUpdate = False
         self.showAll = True # show only installed or all packages?
-        self.__searchChanged = False
 
         # our own icon factory
         fac = gtk.IconFactory()
@@ -474,7 +482,16 @@ class MainWindow (Window):
 
         # package db
         splash(_("Creating Database"))
-        self.db = Database(self.cfg.get("type", section = "DATABASE"))
+        self.db = Database(self.cfg.get("type", section = "DATABASE"), background = True)
+        self.searchSession = SearchSession(self.db, self.cb_search_finished, threadClass = GtkThread)
+
+        # changes of the database -- applied to the lists in the GUI thread
+        self.dbEvents = []
+        self.dbEventsLock = Lock()
+        self.db.add_listener(self.cb_db_changed)
+
+        # search type of the session, which is not (yet) supported by the database
+        self.wantedSearchType = None
         
         # set plugins and plugin-menu
         splash(_("Loading Plugins"))
@@ -571,6 +588,10 @@ class MainWindow (Window):
         self.build_type_combo()
         
         self.window.show_all()
+
+        # load the rest of the database while the user can already use the window
+        self.lastDBRefresh = time.time()
+        self.db.populate_background(self.cb_db_progress, threadClass = GtkThread)
     
     def show_package (self, pkg = None, cpv = None, cp = None, version = None, **kwargs):
         p = None
@@ -654,7 +675,12 @@ class MainWindow (Window):
         
         store.clear()
 
-        cats = self.db.get_categories(installed = not self.showAll)
+        # the counters of the database -- no need to look at the packages
+        cats = [cat for cat, stats in self.db.get_category_stats().iteritems()
+                if cat != Database.ALL and (stats.matching if self.showAll else stats.matching_installed)]
+
+        if len(cats) > 1:
+            cats.append(Database.ALL)
 
         if not self.cfg.get_boolean("collapseCats", "GUI"):
             for p in cats:
@@ -712,6 +738,7 @@ class MainWindow (Window):
         self.pkgList.append_column(col)
 
         self.pkgList.get_selection().connect("changed", self.cb_pkg_list_selection)
+        self.pkgList.get_vadjustment().connect("value-changed", self.cb_pkg_list_scrolled)
 
     def fill_pkg_store (self, store = None, name = None):
         """
@@ -727,19 +754,50 @@ class MainWindow (Window):
             store = self.pkgList.get_model()
         store.clear()
 
+        self.pkgWindow = None
         if name:
-            for pkg in self.db.get_cat(name, self.sortPkgListByName):
-                if pkg.disabled:
-                    warning(_("Package '%s/%s' is disabled."), pkg.cat, pkg.pkg)
-                    continue
+            # [category, packages loaded, packages in total]
+            self.pkgWindow = [name, 0, self.db.count_cat(name, installed = not self.showAll)]
+            self.fill_pkg_window(store)
 
-                if pkg.inst:
-                    icon = self.icons["installed"]
-                elif not self.showAll:
-                    continue # ignore not installed packages
-                else:
-                    icon = None
-                store.append([icon, pkg.pkg, pkg.cat])
+    def fill_pkg_window (self, store = None, rest = False):
+        """
+        Appends the next packages of the category to the package list.
+
+        @param store: the store to fill
+        @type store: gtk.ListStore
+        @param rest: append all remaining packages instead of the next L{PKG_WINDOW} ones
+        @type rest: boolean
+        @returns: whether packages have been left to append
+        @rtype: boolean
+        """
+
+        if self.pkgWindow is None:
+            return False
+
+        name, offset, total = self.pkgWindow
+        if offset >= total:
+            return False
+
+        if store is None:
+            store = self.pkgList.get_model()
+
+        limit = None if rest else self.PKG_WINDOW
+        n = 0
+        for pkg in self.db.get_cat_range(name, offset, limit, self.sortPkgListByName, installed = not self.showAll):
+            if pkg.inst:
+                icon = self.icons["installed"]
+            else:
+                icon = None
+            store.append([icon, pkg.pkg, pkg.cat])
+            n += 1
+
+        if limit is None or n < limit: # the category might have shrunk meanwhile
+            self.pkgWindow[1] = total
+        else:
+            self.pkgWindow[1] = offset + n
+
+        return True
 
     def build_version_list (self):
         store = gtk.ListStore(gtk.gdk.Pixbuf, str, str)
@@ -792,14 +850,22 @@ class MainWindow (Window):
             
             self.slotcol.set_visible(False)
 
-        packages = system.sort_package_list(system.find_packages(cp, masked=True))
-        if not packages:
+        # the database might know the versions -- saves asking portage for each single one
+        versions = self.db.get_versions(cp)
+        if versions is not None:
+            showSlots = self.slotcol.get_visible()
+            versions = [(v.version, v.inst, v.slot if showSlots else "") for v in versions]
+        else:
+            packages = system.sort_package_list(system.find_packages(cp, masked=True))
+            versions = [(x.get_version(), x.is_installed(), get_slot(x)) for x in packages]
+
+        if not versions:
             raise VersionsNotFoundException(cp)
         
         best = system.find_best_match(cp)
 
         # append versions
-        for vers, inst, slot in ((x.get_version(), x.is_installed(), get_slot(x)) for x in packages):
+        for vers, inst, slot in versions:
             if inst:
                 icon = self.icons["installed"]
             elif best is not None and vers == best.get_version():
@@ -817,9 +883,9 @@ class MainWindow (Window):
             if version:
                 best_version = version
             else:
-                best_version = system.find_best_match(packages[0].get_cp()).get_version()
-            for i, p in enumerate(packages):
-                if p.get_version() == best_version:
+                best_version = best.get_version()
+            for i, v in enumerate(versions):
+                if v[0] == best_version:
                     pos = (i,)
                     break
         except AttributeError: # no package found
@@ -889,6 +955,64 @@ class MainWindow (Window):
         else: # no selCatName -> so no category selected --> ignore
             debug("No category selected --> should be no harm.")
 
+    def apply_db_events (self):
+        """
+        Applies the changes of the database collected by L{cb_db_changed} to the category and package lists.
+        Only the changed rows of the package list are touched, if possible.
+        """
+
+        with self.dbEventsLock:
+            events, self.dbEvents = self.dbEvents, []
+
+        if Database.SEARCH_TYPES_CHANGED in (event for event, data in events):
+            self.update_type_combo()
+            events = [(event, data) for event, data in events if event != Database.SEARCH_TYPES_CHANGED]
+
+        if self.db.is_loading(): # the lists are refreshed by cb_db_progress
+            return False
+
+        refillCats = False
+        refillPkgs = False
+        rows = None # (cat, pkg) -> iter in the package list
+        store = self.pkgList.get_model()
+
+        for event, data in events:
+            if event in (Database.CATEGORY_ADDED, Database.CATEGORY_REMOVED):
+                refillCats = True
+                continue
+
+            if event == Database.PACKAGE_CHANGED and not self.showAll: # the categories only show installed packages
+                refillCats = True
+
+            if refillCats or refillPkgs or self.selCatName not in (data.cat, Database.ALL):
+                continue
+
+            if event == Database.PACKAGE_ADDED or (event == Database.PACKAGE_CHANGED and (not self.showAll or not self.sortPkgListByName)):
+                refillPkgs = True # the position of the package is not known
+                continue
+
+            if rows is None:
+                rows = dict(((row[2], row[1]), row.iter) for row in store)
+
+            it = rows.pop((data.cat, data.pkg), None)
+            if it is None: # not loaded (yet)
+                continue
+
+            if event == Database.PACKAGE_CHANGED:
+                store.set_value(it, 0, self.icons["installed"] if data.inst else None)
+            else: # removed or disabled
+                store.remove(it)
+                if self.pkgWindow is not None: # the following packages have moved up
+                    self.pkgWindow[1] -= 1
+                    self.pkgWindow[2] -= 1
+
+        if refillCats:
+            self.refresh_stores()
+        elif refillPkgs:
+            self.fill_pkg_store(name = self.selCatName)
+
+        return False
+
     def build_type_combo (self):
         model = gtk.ListStore(int, str)
         for k,v in self.db.TYPES.items():
@@ -904,10 +1028,22 @@ class MainWindow (Window):
             if k == self.db.type: break
 
         self.typeCombo.set_active(i)
+        self.update_type_combo()
 
+    def update_type_combo (self):
+        """
+        Adapts the type combo to the search types currently supported by the database.
+        """
         types = self.db.search_types()
-        if types == 1 or types % 2 == 0:
-            self.typeCombo.set_sensitive(False)
+        self.typeCombo.set_sensitive(not (types == 1 or types % 2 == 0))
+
+        wanted = self.wantedSearchType
+        if wanted is not None and wanted & types == wanted:
+            self.wantedSearchType = None
+            for i, (k, v) in enumerate(self.typeCombo.get_model()):
+                if k == wanted:
+                    self.typeCombo.set_active(i) # sets the type of the database
+                    break
 
     def load_session(self, sessionEx = None, defaults_only = False):
         """
@@ -1032,6 +1168,7 @@ class MainWindow (Window):
                 self.db.type = t
             except UnsupportedSearchTypeError:
                 info("Cannot set search type. '%s' not supported by database '%s'.", t, self.db.__class__.__name__)
+                self.wantedSearchType = t # might be supported later on
 
         # SESSION VERSION
         def load_session_version (version):
@@ -1062,7 +1199,7 @@ class MainWindow (Window):
             (["vpanedpos", "hpanedpos"], load_paned, save_paned),
             (["catsel"], load_cat_selection, save_cat_selection, ["app-portage@0"]),
             (["pkgsel"], load_pkg_selection, save_pkg_selection, ["portato@0"]),
-            (["searchtype"], load_search_type, lambda: self.db.type)
+            (["searchtype"], load_search_type, lambda: self.wantedSearchType or self.db.type)
             #([("merge", "queue"), ("unmerge", "queue"), ("oneshot", "queue")], load_queue, save_queue),
             ]))
 
@@ -1131,6 +1268,7 @@ class MainWindow (Window):
         if name:
             if self._jump_check_search(model, pos, lambda r: r[col] != name):
                 debug("Pkg path does not match. Searching...")
+                self.fill_pkg_window(model, rest = True) # the package might not have been loaded yet
                 for cname, path in ((x[col], x.path) for x in model):
                     if cname == name:
                         pos = path
@@ -1273,6 +1411,41 @@ class MainWindow (Window):
         # as this might get called from other threads use gobject.idle_add
         gobject.idle_add(__update, title)
 
+    def cb_db_progress (self, cat, loaded, total):
+        """
+        Callback for the database loading in the background.
+        Shows the progress in the title and refreshes the lists from time to time.
+        """
+
+        def __update():
+            if cat is None: # finished
+                self.window.set_title(self.main_title)
+                self.refresh_stores()
+            else:
+                self.window.set_title(_("%(title)s - Loading database: %(loaded)d/%(total)d") % {"title" : self.main_title, "loaded" : loaded, "total" : total})
+                
+                # refreshing clears the lists - so do not do it too often
+                if time.time() - self.lastDBRefresh > self.DB_REFRESH_INTERVAL:
+                    self.lastDBRefresh = time.time()
+                    self.refresh_stores()
+
+            return False
+
+        # called from the loading thread
+        gobject.idle_add(__update)
+
+    def cb_db_changed (self, event, data):
+        """
+        Callback for changes of the database.
+        Collects the changes, which are applied by L{apply_db_events}.
+        """
+
+        # called from the thread changing the database -- often many times in a row
+        with self.dbEventsLock:
+            self.dbEvents.append((event, data))
+            if len(self.dbEvents) == 1:
+                gobject.idle_add(self.apply_db_events)
+
     def cb_cat_list_selection (self, selection):
         """
         Callback for a category-list selection. 
@@ -1316,6 +1489,16 @@ class MainWindow (Window):
 
         return True
 
+    def cb_pkg_list_scrolled (self, adj):
+        """
+        Callback for scrolling the package list.
+        Appends the next packages when getting near the end of the list.
+        """
+        if adj.value + 2 * adj.page_size >= adj.upper:
+            self.fill_pkg_window()
+
+        return False
+
     def cb_pkg_list_header_clicked(self, col):
         self.sortPkgListByName = not self.sortPkgListByName
         self.fill_pkg_store(name = self.selCatName)
@@ -1611,22 +1794,24 @@ class MainWindow (Window):
         Called when the user enters something in the search field.
         Updates the packages according to the search expression.
         """
-        if not self.__searchChanged and self.cfg.get_boolean("searchOnType", section="GUI"):
-            self.__searchChanged = True
-            
-            def __update():
-                self.__searchChanged = False
-                txt = self.searchEntry.get_text()
-
-                if txt or self.db.restrict:
-                    self.db.restrict = txt
+        if self.cfg.get_boolean("searchOnType", section="GUI"):
+            # the session waits until the user stopped typing
+            self.searchSession.search(self.searchEntry.get_text())
 
-                    self.refresh_stores()
-                    self.catList.get_selection().select_path("0") # XXX make this smarter
+    def cb_search_finished (self, text):
+        """
+        Called by the search session, when the results for the search expression are ready.
+        """
+        def __update():
+            if text == self.searchEntry.get_text(): # else there is already a newer search running
+                self.db.restrict = text # the results are prepared -- switch to them in the GUI thread only
+                self.refresh_stores()
+                self.catList.get_selection().select_path("0") # XXX make this smarter
 
-                return False # not again ;)
+            return False # not again ;)
 
-            gobject.timeout_add(200, __update)
+        # called from the search thread
+        gobject.idle_add(__update)
 
     def cb_type_combo_changed (self, *args):
         model = self.typeCombo.get_model()
@@ -1800,6 +1985,9 @@ class MainWindow (Window):
 
         # write sessions
         Session.close()
+        self.searchSession.close()
+
+        self.db.close()
         
         return False
 
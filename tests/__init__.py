@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# File: tests/__init__.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+"""
+Tests of portato. Run them with C{python -m unittest discover -s tests -t .} from the top directory.
+
+The databases are tested against a L{SyntheticSystem}, so no portage installation is needed.
+"""
+
+import __builtin__
+import os
+import shutil
+import tempfile
+import unittest
+
+# normally installed by gettext on startup
+if not hasattr(__builtin__, "_"):
+    __builtin__._ = lambda s: s
+
+from portato.backend import SystemWrapper
+from portato.backend.synthetic import SyntheticSystem
+
+class DatabaseTestCase (unittest.TestCase):
+    """Sets up a L{SyntheticSystem} and a session directory for the databases - both in a temporary directory."""
+
+    # the packages of the fake system
+    PACKAGES = ["app-misc/foo", "app-misc/bar", "dev-util/baz"]
+    INSTALLED = ["app-misc/foo"]
+
+    def setUp (self):
+        from portato.db import sql, hash, mapped
+
+        self.tmp = tempfile.mkdtemp()
+        self.session_dir = os.path.join(self.tmp, "session")
+        os.mkdir(self.session_dir)
+
+        self.system = SyntheticSystem(self.tmp, self.PACKAGES, self.INSTALLED)
+        self.system.write_tree()
+        SystemWrapper.set_system(self.system)
+
+        # the modules storing their files in the session directory
+        self.session_modules = [(mod, mod.SESSION_DIR) for mod in (sql, hash, mapped)]
+        for mod, old in self.session_modules:
+            mod.SESSION_DIR = self.session_dir
+
+    def tearDown (self):
+        for mod, old in self.session_modules:
+            mod.SESSION_DIR = old
+
+        SystemWrapper.set_system("portage")
+        shutil.rmtree(self.tmp)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# File: tests/test_database.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+import time
+import unittest
+from threading import Thread, Event
+
+from portato.db.database import RWLock, ResultCache, locked_iter
+
+from . import DatabaseTestCase
+
+class RWLockTest (unittest.TestCase):
+    """The reader-writer lock of the databases."""
+
+    def setUp (self):
+        self.lock = RWLock()
+
+    def start (self, f):
+        """Runs the function in a thread and returns an event, which is set when it has finished."""
+        done = Event()
+        def run ():
+            f()
+            done.set()
+
+        t = Thread(target = run)
+        t.daemon = True
+        t.start()
+        return done
+
+    def exclusive (self):
+        self.lock.acquire_exclusive()
+        self.lock.release_exclusive()
+
+    def shared (self):
+        self.lock.acquire_shared()
+        self.lock.release_shared()
+
+    def test_shared (self):
+        self.lock.acquire_shared()
+
+        # other readers are not blocked
+        self.assertTrue(self.start(self.shared).wait(5))
+
+        # but writers are
+        writer = self.start(self.exclusive)
+        self.assertFalse(writer.wait(0.1))
+
+        self.lock.release_shared()
+        self.assertTrue(writer.wait(5))
+
+    def test_exclusive (self):
+        self.lock.acquire_exclusive()
+
+        reader = self.start(self.shared)
+        writer = self.start(self.exclusive)
+        self.assertFalse(reader.wait(0.1))
+        self.assertFalse(writer.wait(0.01))
+
+        self.lock.release_exclusive()
+        self.assertTrue(reader.wait(5))
+        self.assertTrue(writer.wait(5))
+
+    def test_reentrant (self):
+        self.lock.acquire_exclusive()
+        self.lock.acquire_exclusive()
+        self.lock.acquire_shared()
+        self.lock.release_shared()
+        self.lock.release_exclusive()
+
+        # still held
+        self.assertFalse(self.start(self.shared).wait(0.1))
+        self.lock.release_exclusive()
+
+        # a reader may acquire again, even with a writer waiting
+        self.lock.acquire_shared()
+        writer = self.start(self.exclusive)
+        while not self.lock._waiting:
+            time.sleep(0.01)
+
+        self.lock.acquire_shared()
+        self.lock.release_shared()
+        self.lock.release_shared()
+        self.assertTrue(writer.wait(5))
+
+    def test_writer_preferred (self):
+        self.lock.acquire_shared()
+        writer = self.start(self.exclusive)
+        while not self.lock._waiting:
+            time.sleep(0.01)
+
+        # a new reader waits for the writer
+        reader = self.start(self.shared)
+        self.assertFalse(reader.wait(0.1))
+
+        self.lock.release_shared()
+        self.assertTrue(writer.wait(5))
+        self.assertTrue(reader.wait(5))
+
+    def test_upgrade (self):
+        self.lock.acquire_shared()
+        self.assertRaises(RuntimeError, self.lock.acquire_exclusive)
+        self.lock.release_shared()
+
+    def test_locked_iter (self):
+        closed = []
+        def gen ():
+            try:
+                for i in range(5):
+                    yield i
+            finally:
+                closed.append(self.lock._readers)
+
+        it = locked_iter(self.lock.acquire_shared, self.lock.release_shared, gen(), 2)
+        self.assertEqual(next(it), 0)
+
+        # not held between the batches
+        self.assertTrue(self.start(self.exclusive).wait(5))
+
+        self.assertEqual(list(it), [1, 2, 3, 4])
+        self.assertEqual(closed, [1]) # cleaned up under the lock
+
+class ResultCacheTest (unittest.TestCase):
+    """The cache of query results."""
+
+    def setUp (self):
+        self.cache = ResultCache(2)
+        self.calls = []
+
+    def result (self, key):
+        def f ():
+            self.calls.append(key)
+            return iter([key])
+
+        return self.cache.call(key, f)
+
+    def test_call (self):
+        self.assertEqual(self.result("a"), ["a"])
+        self.assertEqual(self.result("a"), ["a"])
+        self.assertEqual(self.calls, ["a"])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_size (self):
+        self.result("a")
+        self.result("b")
+        self.result("a") # now more recent than b
+        self.result("c")
+
+        self.assertEqual(len(self.cache), 2)
+        self.result("a")
+        self.result("b")
+        self.assertEqual(self.calls, ["a", "b", "c", "b"])
+
+    def test_nested (self):
+        # the inner call is part of computing the outer one
+        self.cache.call("outer", lambda: self.result("inner"))
+        self.result("inner")
+
+        self.assertEqual(self.calls, ["inner", "inner"])
+        self.assertEqual(len(self.cache), 2) # outer and the second inner call
+
+    def test_invalidate (self):
+        self.result("a")
+        self.result("b")
+
+        self.cache.invalidate(lambda key: key == "a")
+        self.result("a")
+        self.result("b")
+        self.assertEqual(self.calls, ["a", "b", "a"])
+
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidated_while_computing (self):
+        def f ():
+            self.cache.invalidate()
+            return ["old"]
+
+        self.assertEqual(self.cache.call("a", f), ["old"])
+        self.assertEqual(self.result("a"), ["a"]) # not stored
+
+class CachedTest (DatabaseTestCase):
+    """The results cached by the databases."""
+
+    def test_hash (self):
+        from portato.db.hash import HashDatabase
+
+        db = HashDatabase({"descriptions" : "0"})
+        self.addCleanup(db.close)
+
+        names = lambda cat = None: sorted(p.pkg for p in db.get_cat(cat))
+        self.assertEqual(names(), ["bar", "baz", "foo"])
+        self.assertEqual(names("dev-util"), ["baz"])
+        misses = db.result_cache.misses
+
+        self.assertEqual(names(), ["bar", "baz", "foo"])
+        self.assertEqual(db.result_cache.misses, misses)
+
+        # per restriction
+        db.restrict = "ba"
+        self.assertEqual(names(), ["bar", "baz"])
+        self.assertEqual(names("dev-util"), ["baz"])
+
+        # only the affected categories are computed again
+        db.disable("app-misc/bar")
+        misses = db.result_cache.misses
+        self.assertEqual(names(), ["baz"])
+        self.assertEqual(names("dev-util"), ["baz"])
+        self.assertEqual(db.result_cache.misses, misses + 1)
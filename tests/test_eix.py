@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# File: tests/test_eix.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+import os
+
+from . import DatabaseTestCase
+
+class ReaderTest (DatabaseTestCase):
+    """Reading the eix cache."""
+
+    def setUp (self):
+        DatabaseTestCase.setUp(self)
+
+        self.system.add_version("app-misc/foo", "1.2")
+        self.cache = os.path.join(self.tmp, "eix.cache")
+        self.system.write_eix_cache(self.cache)
+
+    def read (self, mapped):
+        from portato.eix import EixReader
+
+        with EixReader(self.cache, mapped = mapped) as reader:
+            pkgs = [p for c, p in reader.iter_packages()]
+
+            # read after the other packages have been read
+            self.assertEqual([len(p.versions) for p in pkgs[:2]], [2, 1])
+
+        return pkgs
+
+    def test_file (self):
+        from portato.eix.exceptions import EixError
+
+        pkgs = self.read(False)
+        self.assertEqual(pkgs[0].homepage, "http://www.gentoo.org") # already read
+        self.assertRaises(EixError, getattr, pkgs[2], "homepage")
+
+    def test_mapped (self):
+        pkgs = self.read(True)
+
+        # still mapped
+        self.assertEqual([len(p.versions) for p in pkgs], [2, 1, 1])
+        self.assertEqual(pkgs[2].homepage, "http://www.gentoo.org")
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+# File: tests/test_eix_sql.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+import os
+import time
+
+from . import DatabaseTestCase
+
+class DescriptionSearchTest (DatabaseTestCase):
+    """Searching the descriptions with the full text index."""
+
+    DESCRIPTIONS = {
+            "app-misc/foo" : "NOT a toolkit",
+            "app-misc/bar" : "gtk OR qt - AND more",
+            "dev-util/baz" : "Some tool"
+            }
+
+    def open (self, module):
+        from portato.db.eix_sql import EixSQLDatabase
+
+        class Database (EixSQLDatabase):
+            FTS_MODULES = (module,)
+
+        # the packages are inserted directly -- the cache is never read
+        cache = os.path.join(self.tmp, "eix.cache")
+        open(cache, "w").close()
+
+        db = Database({"cache" : cache}, background = True)
+        self.addCleanup(db.close)
+
+        if db.fts != module:
+            self.skipTest("SQLite has no %s support" % module)
+
+        con = db.connections.get()
+        rows = [tuple(cp.split("/")) + (self.DESCRIPTIONS[cp],) for cp in self.PACKAGES]
+        db.insert_rows("INSERT INTO packages (cat_id, name, descr, inst, disabled) VALUES (?, ?, ?, 0, 0)", rows, con)
+        con.execute(db.FTS_INSERT)
+        db.update_category_stats(None, con)
+        con.commit()
+
+        db.type = db.SEARCH_DESCRIPTION
+        return db
+
+    def search (self, db, restrict):
+        db.restrict = restrict
+        found = sorted("%s/%s" % (p.cat, p.pkg) for p in db.get_cat())
+        self.assertEqual(db.count_cat(), len(found))
+        return found
+
+    def check_operators (self, module):
+        db = self.open(module)
+
+        self.assertEqual(self.search(db, "NOT"), ["app-misc/foo"])
+        self.assertEqual(self.search(db, "AND"), ["app-misc/bar"])
+        self.assertEqual(self.search(db, "gtk OR"), ["app-misc/bar"])
+        self.assertEqual(self.search(db, "not toolkit"), ["app-misc/foo"])
+
+        # prefixes still match
+        self.assertEqual(self.search(db, "tool"), ["app-misc/foo", "dev-util/baz"])
+
+    def test_fts5 (self):
+        self.check_operators("fts5")
+
+    def test_fts4 (self):
+        self.check_operators("fts4")
+
+class UpdateTest (DatabaseTestCase):
+    """Opening the database again after the eix cache has been updated."""
+
+    def setUp (self):
+        DatabaseTestCase.setUp(self)
+
+        self.cache = os.path.join(self.tmp, "eix.cache")
+        self.system.descriptions = {"app-misc/foo" : "Old text", "app-misc/bar" : "Old text", "dev-util/baz" : "Old text"}
+        self.system.write_eix_cache(self.cache)
+        self.session = {"cache" : self.cache}
+
+    def open (self):
+        from portato.db.eix_sql import EixSQLDatabase
+
+        db = EixSQLDatabase(self.session)
+        self.addCleanup(db.close)
+        return db
+
+    def update_cache (self):
+        """Runs eix-update: the tree itself is not touched."""
+        self.system.write_eix_cache(self.cache)
+        t = time.time() + 10
+        os.utime(self.cache, (t, t))
+
+    def test_unchanged (self):
+        t = int(time.time()) - 10 + 0.123456 # more digits than str() keeps -- rounded down
+        os.utime(self.cache, (t, t))
+
+        db = self.open()
+        db.disable("app-misc/bar")
+        db.close()
+
+        # not populated again
+        db = self.open()
+        self.assertEqual([p.pkg for p in db.get_cat(showDisabled = True) if p.disabled], ["bar"])
+
+    def test_versions (self):
+        db = self.open()
+        self.assertEqual([v.version for v in db.get_versions("app-misc/foo")], ["1.0"])
+        db.close()
+
+        self.system.versions["app-misc/foo"].append("2.0") # only in the cache
+        self.update_cache()
+
+        db = self.open()
+        self.assertEqual([v.version for v in db.get_versions("app-misc/foo")], ["1.0", "2.0"])
+
+    def test_descriptions (self):
+        db = self.open()
+        db.close()
+
+        self.system.descriptions["dev-util/baz"] = "New text"
+        self.update_cache()
+
+        db = self.open()
+        if not db.fts:
+            self.skipTest("SQLite has no full text search")
+
+        db.type = db.SEARCH_DESCRIPTION
+        db.restrict = "new"
+        self.assertEqual(["%s/%s" % (p.cat, p.pkg) for p in db.get_cat()], ["dev-util/baz"])
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# File: tests/test_hash.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+from __future__ import with_statement
+
+import os
+import time
+from threading import Event
+
+from . import DatabaseTestCase
+
+class SnapshotTest (DatabaseTestCase):
+    """Loading the database from the snapshot written on the last start."""
+
+    def open (self):
+        from portato.db.hash import HashDatabase
+        db = HashDatabase({"descriptions" : "0"})
+        self.addCleanup(db.close)
+        return db
+
+    def names (self, db):
+        return sorted(p.pkg for p in db.get_cat())
+
+    def add_package (self):
+        # not seen by a database using the snapshot
+        self.system.pkgs.append("app-misc/new")
+        self.system.versions["app-misc/new"] = ["1.0"]
+
+    def touch (self, path):
+        t = time.time() + 10
+        os.utime(path, (t, t))
+
+    def test_load (self):
+        self.open().close()
+        self.add_package()
+
+        self.assertEqual(self.names(self.open()), ["bar", "baz", "foo"])
+
+    def test_outdated (self):
+        self.open().close()
+        self.add_package()
+
+        # a sync of the tree
+        self.touch(os.path.join(self.system.portdir, "metadata/timestamp"))
+        self.assertEqual(self.names(self.open()), ["bar", "baz", "foo", "new"])
+
+    def test_installed (self):
+        self.open().close()
+        self.system.inst.add("dev-util/baz")
+
+        # a merge
+        self.touch(self.system.vdb)
+        db = self.open()
+        self.assertEqual(sorted(p.pkg for p in db.get_cat() if p.inst), ["baz", "foo"])
+        self.assertEqual(sorted(db.get_categories(installed = True)), [db.ALL, "app-misc", "dev-util"])
+
+    def test_corrupted (self):
+        from portato.db.hash import HashDatabase
+
+        self.add_package()
+        with open(os.path.join(self.session_dir, HashDatabase.SNAPSHOT_FILE), "wb") as f:
+            f.write("no snapshot")
+
+        self.assertEqual(self.names(self.open()), ["bar", "baz", "foo", "new"])
+
+class DescriptionTest (DatabaseTestCase):
+    """Searching the descriptions read from the metadata cache."""
+
+    def setUp (self):
+        DatabaseTestCase.setUp(self)
+
+        self.system.descriptions = {"app-misc/foo" : "A toolkit", "app-misc/bar" : "Some text", "dev-util/baz" : "A tool"}
+        self.system.write_metadata_cache()
+
+    def open (self):
+        """Opens the database and waits until the descriptions have been read."""
+        from portato.db.hash import HashDatabase
+
+        loaded = Event()
+        def listener (event, data):
+            if event == HashDatabase.SEARCH_TYPES_CHANGED and data & HashDatabase.SEARCH_DESCRIPTION:
+                loaded.set()
+
+        db = HashDatabase({})
+        self.addCleanup(db.close)
+        db.add_listener(listener)
+        self.wait(db, loaded)
+
+        return db, loaded
+
+    def wait (self, db, loaded):
+        if not db.search_types() & db.SEARCH_DESCRIPTION:
+            self.assertTrue(loaded.wait(5))
+
+    def search (self, db, restrict):
+        db.restrict = restrict
+        return sorted(p.pkg for p in db.get_cat())
+
+    def test_search (self):
+        db, loaded = self.open()
+
+        db.type = db.SEARCH_DESCRIPTION
+        self.assertEqual(self.search(db, "tool"), ["baz", "foo"])
+
+        db.type = db.SEARCH_NAME | db.SEARCH_DESCRIPTION
+        self.assertEqual(self.search(db, "ba"), ["bar", "baz"])
+
+    def test_reload (self):
+        db, loaded = self.open()
+
+        loaded.clear()
+        db.reload()
+
+        # read again
+        self.wait(db, loaded)
+        db.type = db.SEARCH_DESCRIPTION
+        self.assertEqual(self.search(db, "tool"), ["baz", "foo"])
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# File: tests/test_mapped.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+from . import DatabaseTestCase
+
+class MappedDatabaseTest (DatabaseTestCase):
+    """The database keeping the packages in a memory-mapped file."""
+
+    PACKAGES = ["app-misc/foo", "app-misc/bar", "dev-util/baz", "dev-util/foobar"]
+
+    def open (self):
+        from portato.db.mapped import MappedDatabase
+        db = MappedDatabase({})
+        self.addCleanup(db.close)
+        return db
+
+    def names (self, db, category = None):
+        return ["%s/%s" % (p.cat, p.pkg) for p in db.get_cat(category)]
+
+    def test_packages (self):
+        db = self.open()
+
+        self.assertEqual(self.names(db), ["app-misc/bar", "dev-util/baz", "app-misc/foo", "dev-util/foobar"])
+        self.assertEqual(self.names(db, "dev-util"), ["dev-util/baz", "dev-util/foobar"])
+        self.assertEqual(sorted(db.get_categories()), [db.ALL, "app-misc", "dev-util"])
+        self.assertEqual(list(db.get_categories(installed = True)), ["app-misc"])
+
+    def test_reopen (self):
+        db = self.open()
+        db.disable("app-misc/bar")
+        db.close()
+
+        # read from the file -- the disabled packages are only kept for the session
+        db = self.open()
+        self.assertEqual(self.names(db, "app-misc"), ["app-misc/bar", "app-misc/foo"])
+
+    def test_reload (self):
+        db = self.open()
+
+        self.system.pkgs.append("app-misc/new")
+        self.system.versions["app-misc/new"] = ["1.0"]
+        db.reload("app-misc")
+
+        self.assertEqual(self.names(db, "app-misc"), ["app-misc/bar", "app-misc/foo", "app-misc/new"])
+
+    def test_search (self):
+        db = self.open()
+
+        db.restrict = "foo"
+        self.assertEqual(self.names(db), ["app-misc/foo", "dev-util/foobar"])
+
+        db.restrict = "foob" # narrowed down
+        self.assertEqual(self.names(db), ["dev-util/foobar"])
+
+        db.restrict = r"\Aapp"
+        self.assertEqual(self.names(db), ["app-misc/bar", "app-misc/foo"])
+
+        db.restrict = "ba[rz]$"
+        self.assertEqual(self.names(db), ["app-misc/bar", "dev-util/baz", "dev-util/foobar"])
+
+    def test_restrict_reset (self):
+        db = self.open()
+
+        # as done by the search dialog: the compiled restriction is set back directly
+        db.restrict = "baz"
+        old = db.restrict
+        db.restrict = "foo"
+        self.names(db)
+        db._restrict = old
+
+        self.assertEqual(self.names(db), ["dev-util/baz"])
+
+    def test_closed (self):
+        from portato.db.exceptions import DatabaseError
+
+        db = self.open()
+        db.close()
+        db.close() # nothing happens
+
+        self.assertRaises(DatabaseError, self.names, db)
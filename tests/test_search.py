@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# File: tests/test_search.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+from threading import Event
+
+from . import DatabaseTestCase
+
+class SearchSessionTest (DatabaseTestCase):
+    """The incremental search while typing."""
+
+    PACKAGES = ["app-misc/foo", "app-misc/bar", "dev-util/baz", "dev-util/foobar"]
+
+    def run_session (self, cls, texts):
+        """Types the texts one after the other and returns the ones, the callback has been called with."""
+        from portato.db.search import SearchSession
+
+        db = cls({})
+        self.addCleanup(db.close)
+
+        found = []
+        done = Event()
+        def callback (text):
+            found.append(text)
+            db.restrict = text # as the GUI does
+            done.set()
+
+        session = SearchSession(db, callback, delay = 0.05)
+        self.addCleanup(session.close)
+
+        db.restrict = "bar"
+        for text in texts:
+            session.search(text)
+
+        self.assertTrue(done.wait(5))
+        return db, found
+
+    def check (self, cls):
+        db, found = self.run_session(cls, ["f", "fo", "foo"])
+
+        # only the last expression is searched
+        self.assertEqual(found, ["foo"])
+        self.assertEqual(sorted(p.pkg for p in db.get_cat()), ["foo", "foobar"])
+
+    def test_hash (self):
+        from portato.db.hash import HashDatabase
+        self.check(HashDatabase)
+
+    def test_mapped (self):
+        from portato.db.mapped import MappedDatabase
+        self.check(MappedDatabase)
+
+    def test_sql (self):
+        from portato.db.sql import SQLDatabase
+        self.check(SQLDatabase)
+
+    def test_prepare (self):
+        from portato.db.hash import HashDatabase
+
+        db = HashDatabase({})
+        self.addCleanup(db.close)
+        db.restrict = "bar"
+
+        # the restriction is left to the caller
+        self.assertTrue(db.prepare_search("foo"))
+        self.assertEqual(db.restrict.pattern, "bar")
+        self.assertEqual(sorted(p.pkg for p in db.get_cat()), ["bar", "foobar"])
+
+        # a cancelled search does not finish
+        self.assertFalse(db.prepare_search("baz", lambda: True))
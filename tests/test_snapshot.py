@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# File: tests/test_snapshot.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+from __future__ import with_statement
+
+import os
+import gzip
+import json
+from contextlib import closing
+
+from . import DatabaseTestCase
+
+class SnapshotTest (DatabaseTestCase):
+    """Exporting the packages of one database and importing them into another one."""
+
+    def setUp (self):
+        DatabaseTestCase.setUp(self)
+        self.path = os.path.join(self.tmp, "snapshot.json.gz")
+
+    def packages (self, db):
+        return sorted((p.cat, p.pkg, p.inst) for p in db.get_cat())
+
+    def write (self, snapshot):
+        with closing(gzip.open(self.path, "wb")) as f:
+            json.dump(snapshot, f)
+
+    def test_roundtrip (self):
+        from portato.db.hash import HashDatabase
+        from portato.db.sql import SQLDatabase
+
+        db = HashDatabase({})
+        db.disable("app-misc/bar")
+        db.export_snapshot(self.path)
+        db.close()
+
+        # the installed flags are taken from this host
+        self.system.inst = set(["dev-util/baz"])
+
+        db = SQLDatabase({})
+        self.addCleanup(db.close)
+        db.import_snapshot(self.path)
+
+        self.assertEqual(self.packages(db), [("app-misc", "foo", False), ("dev-util", "baz", True)])
+        self.assertFalse(db.is_loading())
+
+    def test_other_tree (self):
+        from portato.db.hash import HashDatabase
+        from portato.db.exceptions import SnapshotError
+
+        db = HashDatabase({})
+        self.addCleanup(db.close)
+        db.export_snapshot(self.path)
+
+        with open(os.path.join(self.system.portdir, "metadata", "timestamp"), "w") as f:
+            f.write("another sync")
+
+        self.assertRaises(SnapshotError, db.import_snapshot, self.path)
+
+    def test_invalid (self):
+        from portato.db.hash import HashDatabase
+        from portato.db.exceptions import SnapshotError
+
+        db = HashDatabase({})
+        self.addCleanup(db.close)
+
+        with closing(gzip.open(self.path, "wb")) as f:
+            f.write("no snapshot")
+        self.assertRaises(SnapshotError, db.import_snapshot, self.path)
+
+        self.write({"format" : db.EXPORT_FORMAT - 1, "key" : db.tree_key(), "packages" : {}})
+        self.assertRaises(SnapshotError, db.import_snapshot, self.path)
+
+        # not a name of the tree
+        self.write({"format" : db.EXPORT_FORMAT, "key" : db.tree_key(), "packages" : {"app-misc" : [u"f\xf6\xf6"]}})
+        self.assertRaises(SnapshotError, db.import_snapshot, self.path)
+
+        # nothing has been replaced
+        self.assertEqual(self.packages(db), [("app-misc", "bar", False), ("app-misc", "foo", True), ("dev-util", "baz", False)])
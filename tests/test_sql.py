@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+# File: tests/test_sql.py
+# This file is part of the Portato-Project, a graphical portage-frontend.
+#
+# Copyright (C) 2006-2010 René 'Necoro' Neumann
+# This is free software.  You may redistribute copies of it under the terms of
+# the GNU General Public License version 2.
+# There is NO WARRANTY, to the extent permitted by law.
+#
+# Written by René 'Necoro' Neumann <necoro@necoro.net>
+
+import cPickle as pickle
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from threading import Thread
+
+from . import DatabaseTestCase
+
+class MigrationTest (DatabaseTestCase):
+    """Opening a C{package.db} written by format 2."""
+
+    def setUp (self):
+        DatabaseTestCase.setUp(self)
+
+        # the only table of format 2 -- bar has been disabled
+        con = sqlite3.connect(os.path.join(self.session_dir, "package.db"))
+        con.execute("""
+        CREATE TABLE packages
+        (
+            name TEXT,
+            cat TEXT,
+            descr TEXT DEFAULT "",
+            inst INTEGER,
+            disabled INTEGER
+        )""")
+        con.executemany("INSERT INTO packages (cat, name, descr, inst, disabled) VALUES (?, ?, ?, ?, ?)", [
+            ("app-misc", "foo", "", True, False),
+            ("app-misc", "bar", "", False, True),
+            ("dev-util", "baz", "", False, False)])
+        con.commit()
+        con.close()
+
+        self.session = {"format" : "2", "pickle" : "1"}
+
+    def write_portdirs (self):
+        """Writes the C{portdirs.db} of format 2 for the current tree."""
+        timestamp = os.path.join(self.system.portdir, "metadata", "timestamp")
+        hashes = {"ROOT" : hashlib.md5("%s %s" % (timestamp, os.stat(timestamp).st_mtime)).hexdigest()}
+
+        with open(os.path.join(self.session_dir, "portdirs.db"), "wb") as f:
+            pickle.dump(hashes, f, protocol = -1)
+
+    def open (self):
+        from portato.db.sql import SQLDatabase
+        db = SQLDatabase(self.session)
+        self.addCleanup(db.close)
+        return db
+
+    def test_keeps_packages (self):
+        self.write_portdirs()
+        db = self.open()
+
+        self.assertEqual(self.session["format"], db.FORMAT)
+        self.assertEqual(sorted(tuple(p) for p in db.get_cat(showDisabled = True)), [
+            ("app-misc", "bar", False, True),
+            ("app-misc", "foo", True, False),
+            ("dev-util", "baz", False, False)])
+
+        stats = db.get_category_stats()
+        self.assertEqual(tuple(stats["app-misc"]), (2, 1, 1, 1, 1))
+
+        # the versions are read afterwards
+        self.assertEqual([v.version for v in db.get_versions("app-misc/foo")], ["1.0"])
+
+        # the fingerprints allow to repopulate only changed categories next time
+        self.assertTrue(os.path.exists(os.path.join(self.session_dir, "categories.db")))
+
+    def test_changed_tree (self):
+        self.write_portdirs()
+
+        timestamp = os.path.join(self.system.portdir, "metadata", "timestamp")
+        t = time.time() + 10
+        os.utime(timestamp, (t, t))
+
+        db = self.open()
+
+        # repopulated -- the disabled flag is gone
+        self.assertEqual(sorted(tuple(p) for p in db.get_cat(showDisabled = True)), [
+            ("app-misc", "bar", False, False),
+            ("app-misc", "foo", True, False),
+            ("dev-util", "baz", False, False)])
+
+    def test_unknown_format (self):
+        self.session["format"] = "1"
+        self.write_portdirs()
+        db = self.open()
+
+        self.assertFalse(any(p.disabled for p in db.get_cat(showDisabled = True)))
+
+class VersionsTest (DatabaseTestCase):
+    """The versions stored by the database after the tree has changed."""
+
+    def setUp (self):
+        DatabaseTestCase.setUp(self)
+        self.session = {}
+
+    def open (self):
+        from portato.db.sql import SQLDatabase
+        db = SQLDatabase(self.session)
+        self.addCleanup(db.close)
+        return db
+
+    def versions (self, db, cp):
+        return [(v.version, v.inst) for v in db.get_versions(cp)]
+
+    def test_new_version (self):
+        db = self.open()
+        self.assertEqual(self.versions(db, "app-misc/foo"), [("1.0", True)])
+        db.close()
+
+        # a sync -- besides the timestamp, only the directory of the package changes
+        self.system.add_version("app-misc/foo", "2.0")
+        t = time.time() + 10
+        for path in ("metadata/timestamp", "app-misc/foo"):
+            os.utime(os.path.join(self.system.portdir, path), (t, t))
+
+        db = self.open()
+        self.assertEqual(self.versions(db, "app-misc/foo"), [("1.0", True), ("2.0", False)])
+
+class BatchedTest (unittest.TestCase):
+    """Generating rows in batches in a separate thread."""
+
+    def test_batches (self):
+        from portato.db.sql import generate_batched
+
+        self.assertEqual([list(b) for b in generate_batched(iter(xrange(5)), 2)], [[0, 1], [2, 3], [4]])
+
+    def test_stopped_early (self):
+        from portato.db.sql import generate_batched
+
+        def rows ():
+            i = 0
+            while True: # only ends when the consumer has stopped
+                yield i
+                i += 1
+
+        batches = generate_batched(rows(), 10)
+        self.assertEqual(list(next(batches)), range(10))
+        batches.close() # must not hang
+
+    def test_error (self):
+        from portato.db.sql import generate_batched
+
+        def rows ():
+            yield 1
+            raise ValueError("broken")
+
+        self.assertRaises(ValueError, list, generate_batched(rows(), 10))
+
+class ConnectionManagerTest (unittest.TestCase):
+    """The connections of the threads."""
+
+    def setUp (self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_finished_threads (self):
+        from portato.db.sql import ConnectionManager
+
+        manager = ConnectionManager(os.path.join(self.tmp, "test.db"))
+        self.addCleanup(manager.close)
+
+        main = manager.get()
+        self.assertTrue(manager.get() is main)
+
+        opened = []
+        def run ():
+            opened.append(manager.get())
+
+        for i in range(3):
+            t = Thread(target = run)
+            t.start()
+            t.join()
+
+        # each thread closed the one of the thread before
+        for con in opened[:-1]:
+            self.assertRaises(sqlite3.ProgrammingError, con.execute, "SELECT 1")
+
+        opened[-1].execute("SELECT 1") # its thread has finished as well, but nobody opened a connection since
+        main.execute("SELECT 1")